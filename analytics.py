@@ -0,0 +1,281 @@
+import argparse
+import json
+import sys
+import time
+from collections import namedtuple
+
+from archive import table_source
+from db_pool import pooled_connection
+from timecodes import from_minute, to_day_number
+
+# On-time performance from ActualTripStopData. Stop rows are read in chunks
+# as plain integers straight into NumPy arrays, and matched to their
+# offering's driver (by Driver.rowid) and bus with a sorted-key search rather
+# than a per-row join. Each chunk's delays are binned per group with
+# bincount and added to running histograms, so memory depends on the number
+# of groups, not rows. Archived months the range reaches into are read
+# too (archive.table_source).
+#
+# NumPy is only needed here, and only imported when a report is run.
+
+DIMENSIONS = ("trip", "stop", "driver", "bus", "hour")
+
+# A stop is on time when it is reached at most EARLY minutes ahead of and
+# at most LATE minutes behind its scheduled arrival
+DEFAULT_EARLY = 1
+DEFAULT_LATE = 5
+DEFAULT_CHUNK_SIZE = 250000
+
+# Delays are histogrammed over [MIN_DELAY, MAX_DELAY]; anything further out
+# is counted in the end bins
+MIN_DELAY = -60
+MAX_DELAY = 180
+BINS = MAX_DELAY - MIN_DELAY + 1
+
+GroupStats = namedtuple("GroupStats", "key stops on_time_pct early_pct late_pct mean_delay p50_delay p90_delay")
+
+_COLUMNS = {"trip": 0, "stop": 1, "driver": 4, "bus": 5}
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("On-time analytics require NumPy (pip install numpy)") from None
+    return numpy
+
+
+class DelayHistograms:
+    # One row of delay-bin counts per group key
+    def __init__(self, np):
+        self.np = np
+        self.keys = []
+        self.rows = {}
+        self.counts = np.zeros((0, BINS), dtype=np.int64)
+        self.delay_sums = np.zeros(0, dtype=np.float64)
+
+    def add(self, keys, bins, delays):
+        np = self.np
+        unique, inverse = np.unique(keys, return_inverse=True)
+        new = [key for key in unique.tolist() if key not in self.rows]
+        if new:
+            for key in new:
+                self.rows[key] = len(self.keys)
+                self.keys.append(key)
+            self.counts = np.vstack([self.counts, np.zeros((len(new), BINS), dtype=np.int64)])
+            self.delay_sums = np.concatenate([self.delay_sums, np.zeros(len(new))])
+        rows = np.array([self.rows[key] for key in unique.tolist()], dtype=np.int64)[inverse]
+        groups = len(self.keys)
+        self.counts += np.bincount(rows * BINS + bins, minlength=groups * BINS).reshape(groups, BINS)
+        self.delay_sums += np.bincount(rows, weights=delays, minlength=groups)
+
+    def stats(self, early, late, label=lambda key: key):
+        np = self.np
+        delays = np.arange(MIN_DELAY, MAX_DELAY + 1)
+        on_time = (delays >= -early) & (delays <= late)
+        totals = self.counts.sum(axis=1)
+        cumulative = self.counts.cumsum(axis=1)
+        results = []
+        for row, key in enumerate(self.keys):
+            total = int(totals[row])
+            if total == 0:
+                continue
+            counts = self.counts[row]
+            results.append(GroupStats(
+                label(key),
+                total,
+                100.0 * counts[on_time].sum() / total,
+                100.0 * counts[delays < -early].sum() / total,
+                100.0 * counts[delays > late].sum() / total,
+                float(self.delay_sums[row] / total),
+                int(delays[np.searchsorted(cumulative[row], 0.5 * total)]),
+                int(delays[np.searchsorted(cumulative[row], 0.9 * total)]),
+            ))
+        return results
+
+
+def _offering_keys(np, trips, days, starts):
+    # One int64 per offering: TripNumber, DayNumber (< 2**16) and StartMinute
+    # (< 2**12) packed together, so rows can be matched with searchsorted
+    return (trips * 65536 + days) * 4096 + starts
+
+
+def _source(connection, table, first_day, last_day):
+    # The table, or its union with the archived months the range reaches
+    # into (archive.table_source); open ends reach every archive
+    return table_source(connection, table, -(1 << 31) if first_day is None else first_day,
+                        (1 << 31) - 1 if last_day is None else last_day)
+
+
+def _day_range(column, first_day, last_day):
+    conditions = []
+    parameters = []
+    if first_day is not None:
+        conditions.append(f"{column} >= ?")
+        parameters.append(first_day)
+    if last_day is not None:
+        conditions.append(f"{column} <= ?")
+        parameters.append(last_day)
+    return conditions, parameters
+
+
+def load_offerings(connection, first_day=None, last_day=None):
+    # (sorted offering keys, driver rowids, bus IDs) for the range; driver and
+    # bus are attached to stop rows in NumPy rather than with a join per row
+    np = _numpy()
+    conditions, parameters = _day_range("o.DayNumber", first_day, last_day)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    rows = connection.execute(f'''
+        SELECT o.TripNumber, o.DayNumber, o.StartMinute,
+               COALESCE(d.rowid, -1), COALESCE(o.BusID, -1)
+        FROM {_source(connection, "TripOfferingData", first_day, last_day)} o
+        LEFT JOIN Driver d ON d.DriverName = o.DriverName{where}
+    ''', parameters).fetchall()
+    offerings = np.array(rows, dtype=np.int64).reshape(-1, 5)
+    keys = _offering_keys(np, offerings[:, 0], offerings[:, 1], offerings[:, 2])
+    order = np.argsort(keys)
+    return keys[order], offerings[order, 3], offerings[order, 4]
+
+
+def iter_arrays(connection, first_day=None, last_day=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Yields (N, 6) int64 arrays: trip, stop, scheduled, actual, driver, bus.
+    # Stop rows without a matching offering get driver and bus -1.
+    np = _numpy()
+    keys, drivers, buses = load_offerings(connection, first_day, last_day)
+    conditions, parameters = _day_range("DayNumber", first_day, last_day)
+    conditions += ["ScheduledArrivalMinute IS NOT NULL", "ActualArrivalMinute IS NOT NULL"]
+    cursor = connection.execute(f'''
+        SELECT TripNumber, StopNumber, ScheduledArrivalMinute, ActualArrivalMinute,
+               DayNumber, StartMinute
+        FROM {_source(connection, "ActualTripStopData", first_day, last_day)}
+        WHERE {" AND ".join(conditions)}
+    ''', parameters)
+    cursor.arraysize = chunk_size
+    while True:
+        rows = cursor.fetchmany()
+        if not rows:
+            break
+        chunk = np.array(rows, dtype=np.int64)
+        if len(keys) == 0:
+            chunk[:, 4:] = -1
+            yield chunk
+            continue
+        wanted = _offering_keys(np, chunk[:, 0], chunk[:, 4], chunk[:, 5])
+        found = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        matched = keys[found] == wanted
+        chunk[:, 4] = np.where(matched, drivers[found], -1)
+        chunk[:, 5] = np.where(matched, buses[found], -1)
+        yield chunk
+
+
+def on_time_performance(first_date=None, last_date=None, dimensions=DIMENSIONS,
+                        early=DEFAULT_EARLY, late=DEFAULT_LATE, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Returns {"overall": GroupStats, "rows": n, dimension: [GroupStats, ...]}
+    # with each dimension's groups ordered worst on-time percentage first
+    np = _numpy()
+    first_day = None if first_date is None else to_day_number(first_date)
+    last_day = None if last_date is None else to_day_number(last_date)
+    histograms = {dimension: DelayHistograms(np) for dimension in dimensions}
+    overall = DelayHistograms(np)
+    rows = 0
+
+    with pooled_connection() as connection:
+        drivers = dict(connection.execute("SELECT rowid, DriverName FROM Driver"))
+        for chunk in iter_arrays(connection, first_day, last_day, chunk_size):
+            # Arrivals are times of day, so one just after midnight for a
+            # stop scheduled just before it is a few minutes late, not most
+            # of a day early: differences are taken modulo a day, into
+            # [-12h, +12h)
+            delays = (chunk[:, 3] - chunk[:, 2] + 720) % 1440 - 720
+            bins = np.clip(delays, MIN_DELAY, MAX_DELAY) - MIN_DELAY
+            for dimension, histogram in histograms.items():
+                if dimension == "hour":
+                    keys = (chunk[:, 2] // 60) % 24
+                else:
+                    keys = chunk[:, _COLUMNS[dimension]]
+                histogram.add(keys, bins, delays)
+            overall.add(np.zeros(len(chunk), dtype=np.int64), bins, delays)
+            rows += len(chunk)
+
+    labels = {
+        "driver": lambda key: drivers.get(key, "(unknown)"),
+        "bus": lambda key: None if key < 0 else key,
+        "hour": lambda key: from_minute(key * 60),
+    }
+    report = {"rows": rows}
+    summary = overall.stats(early, late, lambda key: "all")
+    report["overall"] = summary[0] if summary else None
+    for dimension, histogram in histograms.items():
+        report[dimension] = sorted(
+            histogram.stats(early, late, labels.get(dimension, lambda key: key)),
+            key=lambda stats: (stats.on_time_pct, -stats.stops))
+    return report
+
+
+def print_report(report, limit=10):
+    overall = report["overall"]
+    if overall is None:
+        print("No actual arrival data in range.")
+        return
+    print(f"{report['rows']} stop arrivals: {overall.on_time_pct:.1f}% on time, "
+          f"{overall.early_pct:.1f}% early, {overall.late_pct:.1f}% late, "
+          f"mean delay {overall.mean_delay:.1f} min (p50 {overall.p50_delay}, p90 {overall.p90_delay})")
+    for dimension in DIMENSIONS:
+        if dimension not in report:
+            continue
+        groups = report[dimension]
+        if dimension == "hour":
+            shown = sorted(groups, key=lambda stats: stats.key)
+            title = "By hour"
+        else:
+            shown = groups[:limit]
+            title = f"By {dimension} (worst {len(shown)} of {len(groups)})"
+        print(f"\n=== {title} ===")
+        print(f"{dimension.title()} | Stops | On time % | Early % | Late % | Mean | p50 | p90")
+        print("-" * 70)
+        for stats in shown:
+            print(f"{stats.key} | {stats.stops} | {stats.on_time_pct:.1f} | {stats.early_pct:.1f} | "
+                  f"{stats.late_pct:.1f} | {stats.mean_delay:.1f} | {stats.p50_delay} | {stats.p90_delay}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="On-time performance from actual stop data")
+    parser.add_argument("--from", dest="first_date", help="First date (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="last_date", help="Last date (YYYY-MM-DD)")
+    parser.add_argument("--by", nargs="+", choices=DIMENSIONS, default=list(DIMENSIONS))
+    parser.add_argument("--early", type=int, default=DEFAULT_EARLY, help="Minutes early still on time")
+    parser.add_argument("--late", type=int, default=DEFAULT_LATE, help="Minutes late still on time")
+    parser.add_argument("--limit", type=int, default=10, help="Groups shown per dimension")
+    parser.add_argument("--json", help="Also write the full report to this file")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--db", help="Database file (defaults to POMONA_TRANSIT_DB)")
+    args = parser.parse_args(argv)
+
+    from app import setup_database
+    from db_pool import configure_pool
+
+    if args.db:
+        configure_pool(args.db, size=1)
+    setup_database()
+
+    started = time.perf_counter()
+    try:
+        report = on_time_performance(args.first_date, args.last_date, args.by,
+                                     args.early, args.late, args.chunk_size)
+    except (ValueError, ImportError) as e:
+        print(f"Error: {e}")
+        return 1
+    elapsed = time.perf_counter() - started
+    print_report(report, args.limit)
+    print(f"\n{report['rows']} rows in {elapsed:.2f}s")
+
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump({key: [stats._asdict() for stats in value] if isinstance(value, list)
+                       else value._asdict() if hasattr(value, "_asdict") else value
+                       for key, value in report.items()}, handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
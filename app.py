@@ -1,76 +1,34 @@
+import heapq
 import sqlite3
 from datetime import datetime
 
-# [Previous setup_database() function and test data remains exactly the same]
-
-def setup_database():
-    connection = sqlite3.connect("pomona_transit.db")
+from archive import table_source
+from bookings import BOOKING_POLICY, BookingConflict, booking_index
+from bookings import describe as describe_conflict
+from db_pool import pooled_connection
+from migrations import ensure_schema, restore_indexes
+from query_cache import cached, schedule_cache
+from service_calendar import offering_exists, offerings_source
+from snapshot import read_connection
+from telemetry import write_stop_rows
+from timecodes import from_day_number, from_minute, to_day_number, to_minute
+from writer import get_writer
+
+def setup_database(seed=False):
+    with get_connection() as connection:
+        # A single PRAGMA user_version read once the schema is current; the
+        # tables are created and migrated only when it is behind
+        ensure_schema(connection)
+        # Indexes an interrupted bulk load left dropped (usually none)
+        restore_indexes(connection)
+        if seed:
+            seed_test_data(connection)
+
+def seed_test_data(connection):
+    # Sample rows for trying the menu out, only loaded on request
+    # (python app.py --seed)
     cursor = connection.cursor()
 
-    # Create all required tables
-    cursor.executescript('''
-        CREATE TABLE IF NOT EXISTS Trip (
-            TripNumber INTEGER PRIMARY KEY,
-            StartLocationName TEXT,
-            DestinationName TEXT
-        );
-
-        CREATE TABLE IF NOT EXISTS TripOffering (
-            TripNumber INTEGER,
-            Date TEXT,
-            ScheduledStartTime TEXT,
-            ScheduledArrivalTime TEXT,
-            DriverName TEXT,
-            BusID INTEGER,
-            PRIMARY KEY (TripNumber, Date, ScheduledStartTime),
-            FOREIGN KEY (TripNumber) REFERENCES Trip(TripNumber),
-            FOREIGN KEY (DriverName) REFERENCES Driver(DriverName),
-            FOREIGN KEY (BusID) REFERENCES Bus(BusID)
-        );
-
-        CREATE TABLE IF NOT EXISTS Bus (
-            BusID INTEGER PRIMARY KEY,
-            Model TEXT,
-            Year INTEGER
-        );
-
-        CREATE TABLE IF NOT EXISTS Driver (
-            DriverName TEXT PRIMARY KEY,
-            DriverTelephoneNumber TEXT
-        );
-
-        CREATE TABLE IF NOT EXISTS Stop (
-            StopNumber INTEGER PRIMARY KEY,
-            StopAddress TEXT
-        );
-
-        CREATE TABLE IF NOT EXISTS TripStopInfo (
-            TripNumber INTEGER,
-            StopNumber INTEGER,
-            SequenceNumber INTEGER,
-            DrivingTime INTEGER,
-            PRIMARY KEY (TripNumber, StopNumber),
-            FOREIGN KEY (TripNumber) REFERENCES Trip(TripNumber),
-            FOREIGN KEY (StopNumber) REFERENCES Stop(StopNumber)
-        );
-
-        CREATE TABLE IF NOT EXISTS ActualTripStopInfo (
-            TripNumber INTEGER,
-            Date TEXT,
-            ScheduledStartTime TEXT,
-            StopNumber INTEGER,
-            ScheduledArrivalTime TEXT,
-            ActualStartTime TEXT,
-            ActualArrivalTime TEXT,
-            NumberOfPassengerIn INTEGER,
-            NumberOfPassengerOut INTEGER,
-            PRIMARY KEY (TripNumber, Date, ScheduledStartTime, StopNumber),
-            FOREIGN KEY (TripNumber) REFERENCES Trip(TripNumber),
-            FOREIGN KEY (StopNumber) REFERENCES Stop(StopNumber)
-        );
-    ''')
-    
-    # Insert test data
     test_data = {
         'trips': [
             (1, 'Pomona', 'Los Angeles'),
@@ -114,120 +72,201 @@ def setup_database():
     cursor.executemany('INSERT OR IGNORE INTO TripStopInfo VALUES (?, ?, ?, ?)', test_data['trip_stops'])
 
     connection.commit()
-    connection.close()
 
 def get_connection():
-    return sqlite3.connect("pomona_transit.db")
+    return pooled_connection()
+
+def get_read_connection():
+    # Display reads go to the snapshot when snapshot mode is on
+    return read_connection()
+
+# Writes are operations for the single writer thread (writer.py): each runs
+# as operation(connection, *args) inside the writer's batch transaction and
+# must not commit. The public functions below wait for the batch to commit.
+def _insert_driver(connection, name, phone):
+    connection.execute('INSERT INTO Driver VALUES (?, ?)', (name, phone))
 
 def add_driver(name, phone):
-    connection = get_connection()
-    cursor = connection.cursor()
-    
-    cursor.execute('INSERT INTO Driver VALUES (?, ?)', (name, phone))
-    connection.commit()
-    connection.close()
+    get_writer().execute(_insert_driver, name, phone)
 
 def display_all_drivers():
-    connection = get_connection()
-    cursor = connection.cursor()
-    
-    cursor.execute('SELECT * FROM Driver')
-    results = cursor.fetchall()
-    connection.close()
-    return results
+    with get_read_connection() as connection:
+        cursor = connection.cursor()
+        
+        cursor.execute('SELECT * FROM Driver')
+        return cursor.fetchall()
 
-def add_trip_offering(trip_number, date, start_time, arrival_time, driver, bus_id):
-    connection = get_connection()
-    cursor = connection.cursor()
-    
-    cursor.execute('''
-        INSERT INTO TripOffering 
+def _insert_trip_offering(connection, trip_number, day, start, arrival, driver, bus_id):
+    # The writer's batch already holds the write lock (BEGIN IMMEDIATE), so
+    # no other writer can book the same driver or bus between the check and
+    # the insert; earlier offerings in the same batch are already indexed
+    conflicts = booking_index.check(connection, trip_number, day, start, arrival, driver, bus_id)
+    if conflicts and BOOKING_POLICY == "reject":
+        raise BookingConflict(conflicts)
+    for conflict in conflicts:
+        print(f"Warning: {describe_conflict(conflict)}")
+
+    connection.execute('''
+        INSERT INTO TripOfferingData 
         VALUES (?, ?, ?, ?, ?, ?)
-    ''', (trip_number, date, start_time, arrival_time, driver, bus_id))
-    
-    connection.commit()
-    connection.close()
+    ''', (trip_number, day, start, arrival, driver, bus_id))
+
+    booking_index.add(connection, trip_number, day, start, arrival, driver, bus_id)
+
+def add_trip_offering(trip_number, date, start_time, arrival_time, driver, bus_id):
+    day = to_day_number(date)
+    start = to_minute(start_time)
+    arrival = to_minute(arrival_time)
+
+    get_writer().execute(
+        _insert_trip_offering, trip_number, day, start, arrival, driver, bus_id,
+        on_commit=lambda: schedule_cache.invalidate(("day", day), ("driver", driver)),
+        on_rollback=lambda: booking_index.discard(trip_number, day, start, driver, bus_id))
+
+def _delete_trip_offering(connection, trip_number, day, start, deleted):
+    # Appends the offering's (driver, bus) to deleted when it existed
+    key = (trip_number, day, start)
+    row = connection.execute('''
+        SELECT DriverName, BusID FROM TripOfferingData
+        WHERE TripNumber = ? AND DayNumber = ? AND StartMinute = ?
+    ''', key).fetchone()
+    if row is None:
+        return False
+    connection.execute('''
+        DELETE FROM TripOfferingData
+        WHERE TripNumber = ? AND DayNumber = ? AND StartMinute = ?
+    ''', key)
+    deleted.append(row)
+    return True
+
+def delete_trip_offering(trip_number, date, start_time):
+    day = to_day_number(date)
+    start = to_minute(start_time)
+    deleted = []
+
+    def forget():
+        for driver, bus_id in deleted:
+            booking_index.discard(trip_number, day, start, driver, bus_id)
+            schedule_cache.invalidate(("day", day), ("driver", driver), ("bus", bus_id))
+
+    try:
+        return get_writer().execute(_delete_trip_offering, trip_number, day, start, deleted,
+                                    on_commit=forget)
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+        return False
 
 
 def display_all_trips():
-    connection = get_connection()
+    with get_read_connection() as connection:
+        cursor = connection.cursor()
+        
+        cursor.execute('''
+            SELECT TripNumber, StartLocationName, DestinationName
+            FROM Trip
+        ''')
+        
+        return cursor.fetchall()
+
+def display_locations():
+    with get_read_connection() as connection:
+        cursor = connection.cursor()
+        
+        cursor.execute("SELECT DISTINCT StartLocationName, DestinationName FROM Trip")
+        return cursor.fetchall()
+
+def display_all_trip_offerings():
+    with get_read_connection() as connection:
+        cursor = connection.cursor()
+        
+        cursor.execute('''
+            SELECT t.TripNumber, t.StartLocationName, t.DestinationName,
+                   tr.DayNumber, tr.StartMinute
+            FROM Trip t
+            JOIN TripOfferingData tr ON t.TripNumber = tr.TripNumber
+        ''')
+        return [(trip, start, destination, from_day_number(day), from_minute(minute))
+                for trip, start, destination, day, minute in cursor]
+
+def _delete_trip(connection, trip_number):
     cursor = connection.cursor()
-    
-    cursor.execute('''
-        SELECT TripNumber, StartLocationName, DestinationName
-        FROM Trip
-    ''')
-    
-    results = cursor.fetchall()
-    connection.close()
-    return results
+
+    # First delete related records from TripOffering, TripStopInfo and
+    # ActualTripStopInfo (foreign keys are enforced on pooled connections)
+    cursor.execute('DELETE FROM ActualTripStopData WHERE TripNumber = ?', (trip_number,))
+    cursor.execute('DELETE FROM TripOfferingData WHERE TripNumber = ?', (trip_number,))
+    cursor.execute('DELETE FROM ServicePattern WHERE TripNumber = ?', (trip_number,))
+    cursor.execute('DELETE FROM TripStopInfo WHERE TripNumber = ?', (trip_number,))
+    # Then delete the trip itself
+    cursor.execute('DELETE FROM Trip WHERE TripNumber = ?', (trip_number,))
 
 def delete_trip(trip_number):
-    connection = get_connection()
-    cursor = connection.cursor()
-    
     try:
-        # First delete related records from TripOffering and TripStopInfo
-        cursor.execute('DELETE FROM TripOffering WHERE TripNumber = ?', (trip_number,))
-        cursor.execute('DELETE FROM TripStopInfo WHERE TripNumber = ?', (trip_number,))
-        # Then delete the trip itself
-        cursor.execute('DELETE FROM Trip WHERE TripNumber = ?', (trip_number,))
-        connection.commit()
+        get_writer().execute(_delete_trip, trip_number,
+                             on_commit=lambda: schedule_cache.invalidate(("trip", trip_number)))
         return True
     except sqlite3.Error as e:
         print(f"Error: {e}")
         return False
-    finally:
-        connection.close()
 
-def delete_bus(bus_id):
-    connection = get_connection()
+def _delete_bus(connection, bus_id):
     cursor = connection.cursor()
-    
+
+    # Check if bus is currently assigned to any trips or service patterns
+    cursor.execute('''
+        SELECT EXISTS (SELECT 1 FROM TripOfferingData WHERE BusID = ?)
+            OR EXISTS (SELECT 1 FROM ServicePattern WHERE BusID = ?)
+    ''', (bus_id, bus_id))
+    if cursor.fetchone()[0]:
+        return False
+
+    cursor.execute('DELETE FROM Bus WHERE BusID = ?', (bus_id,))
+    return True
+
+def delete_bus(bus_id):
     try:
-        # Check if bus is currently assigned to any trips
-        cursor.execute('SELECT COUNT(*) FROM TripOffering WHERE BusID = ?', (bus_id,))
-        if cursor.fetchone()[0] > 0:
-            print("Cannot delete bus: Bus is assigned to existing trip offerings")
-            return False
-            
-        cursor.execute('DELETE FROM Bus WHERE BusID = ?', (bus_id,))
-        connection.commit()
-        return True
+        deleted = get_writer().execute(_delete_bus, bus_id,
+                                       on_commit=lambda: schedule_cache.invalidate(("bus", bus_id)))
     except sqlite3.Error as e:
         print(f"Error: {e}")
         return False
-    finally:
-        connection.close()
+    if not deleted:
+        print("Cannot delete bus: Bus is assigned to existing trip offerings")
+    return deleted
 
-def delete_driver(driver_name):
-    connection = get_connection()
+def _delete_driver(connection, driver_name):
     cursor = connection.cursor()
-    
+
+    # Check if driver is currently assigned to any trips or service patterns
+    cursor.execute('''
+        SELECT EXISTS (SELECT 1 FROM TripOfferingData WHERE DriverName = ?)
+            OR EXISTS (SELECT 1 FROM ServicePattern WHERE DriverName = ?)
+    ''', (driver_name, driver_name))
+    if cursor.fetchone()[0]:
+        return False
+
+    cursor.execute('DELETE FROM Driver WHERE DriverName = ?', (driver_name,))
+    return True
+
+def delete_driver(driver_name):
     try:
-        # Check if driver is currently assigned to any trips
-        cursor.execute('SELECT COUNT(*) FROM TripOffering WHERE DriverName = ?', (driver_name,))
-        if cursor.fetchone()[0] > 0:
-            print("Cannot delete driver: Driver is assigned to existing trip offerings")
-            return False
-            
-        cursor.execute('DELETE FROM Driver WHERE DriverName = ?', (driver_name,))
-        connection.commit()
-        return True
+        deleted = get_writer().execute(
+            _delete_driver, driver_name,
+            on_commit=lambda: schedule_cache.invalidate(("driver", driver_name)))
     except sqlite3.Error as e:
         print(f"Error: {e}")
         return False
-    finally:
-        connection.close()
+    if not deleted:
+        print("Cannot delete driver: Driver is assigned to existing trip offerings")
+    return deleted
+
+def _insert_bus(connection, bus_id, model, year):
+    connection.execute('INSERT INTO Bus (BusID, Model, Year) VALUES (?, ?, ?)', 
+                       (bus_id, model, year))
 
 def add_bus(bus_id, model, year):
-    connection = get_connection()
-    cursor = connection.cursor()
-    
     try:
-        cursor.execute('INSERT INTO Bus (BusID, Model, Year) VALUES (?, ?, ?)', 
-                      (bus_id, model, year))
-        connection.commit()
+        get_writer().execute(_insert_bus, bus_id, model, year)
         return True
     except sqlite3.IntegrityError:
         print("Error: Bus ID already exists!")
@@ -235,122 +274,151 @@ def add_bus(bus_id, model, year):
     except sqlite3.Error as e:
         print(f"Error: {e}")
         return False
-    finally:
-        connection.close()
 
 def display_all_buses():
-    connection = get_connection()
-    cursor = connection.cursor()
-    
-    cursor.execute('SELECT * FROM Bus')
-    results = cursor.fetchall()
-    connection.close()
-    return results
+    with get_read_connection() as connection:
+        cursor = connection.cursor()
+        
+        cursor.execute('SELECT * FROM Bus')
+        return cursor.fetchall()
 
 def record_actual_trip_data(trip_number, date, scheduled_start_time):
-    connection = get_connection()
-    cursor = connection.cursor()
-    
-    try:
-        # First, verify the trip offering exists
-        cursor.execute('''
-            SELECT EXISTS (
-                SELECT 1 FROM TripOffering 
-                WHERE TripNumber = ? AND Date = ? AND ScheduledStartTime = ?
-            )
-        ''', (trip_number, date, scheduled_start_time))
+    day = to_day_number(date)
+    start_minute = to_minute(scheduled_start_time)
+
+    with get_connection() as connection:
+        cursor = connection.cursor()
         
-        if not cursor.fetchone()[0]:
+        # First, verify the trip offering exists (explicit or from a
+        # service pattern)
+        if not offering_exists(connection, trip_number, day, start_minute):
             print("Error: Trip offering not found!")
             return False
         
-        # Get all stops for this trip
+        # Get all stops for this trip, with the scheduled arrival derived
+        # from the driving times (ScheduledStopTime, kept by triggers for
+        # explicit offerings)
         cursor.execute('''
-            SELECT s.StopNumber, s.StopAddress, tsi.SequenceNumber
+            SELECT s.StopNumber, s.StopAddress, tsi.SequenceNumber, st.ArrivalMinute,
+                   tsi.DrivingTime
             FROM TripStopInfo tsi
             JOIN Stop s ON tsi.StopNumber = s.StopNumber
+            LEFT JOIN ScheduledStopTime st
+                ON st.TripNumber = tsi.TripNumber AND st.DayNumber = ?
+                AND st.StartMinute = ? AND st.StopNumber = tsi.StopNumber
             WHERE tsi.TripNumber = ?
-            ORDER BY tsi.SequenceNumber
-        ''', (trip_number,))
+            ORDER BY tsi.SequenceNumber, tsi.StopNumber
+        ''', (day, start_minute, trip_number))
         
-        stops = cursor.fetchall()
+        # Pattern departures have no ScheduledStopTime rows, so their
+        # arrivals are summed here the same way
+        stops = []
+        offset = 0
+        for stop, address, sequence, arrival, driving_time in cursor:
+            offset += driving_time or 0
+            stops.append((stop, address, sequence,
+                          start_minute + offset if arrival is None else arrival))
         
-        if not stops:
-            print("Error: No stops found for this trip!")
-            return False
-            
-        print("\nRecording actual data for each stop:")
-        print("(Times should be in HH:MM format)")
+    if not stops:
+        print("Error: No stops found for this trip!")
+        return False
         
-        for stop in stops:
-            print(f"\nStop {stop[0]}: {stop[1]} (Sequence: {stop[2]})")
-            
-            scheduled_arrival = input("Scheduled Arrival Time: ")
-            actual_start = input("Actual Start Time: ")
-            actual_arrival = input("Actual Arrival Time: ")
-            
-            while True:
-                try:
-                    passengers_in = int(input("Number of Passengers In: "))
-                    passengers_out = int(input("Number of Passengers Out: "))
-                    break
-                except ValueError:
-                    print("Please enter valid numbers for passengers.")
-            
-            # Insert the actual trip stop information
-            cursor.execute('''
-                INSERT INTO ActualTripStopInfo (
-                    TripNumber, Date, ScheduledStartTime, StopNumber,
-                    ScheduledArrivalTime, ActualStartTime, ActualArrivalTime,
-                    NumberOfPassengerIn, NumberOfPassengerOut
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                trip_number, date, scheduled_start_time, stop[0],
-                scheduled_arrival, actual_start, actual_arrival,
-                passengers_in, passengers_out
-            ))
+    print("\nRecording actual data for each stop:")
+    print("(Times should be in HH:MM format)")
+    
+    # Collect every stop before writing, so no transaction is held open
+    # while the operator types
+    rows = []
+    for stop in stops:
+        scheduled_arrival = stop[3]
+        print(f"\nStop {stop[0]}: {stop[1]} (Sequence: {stop[2]}, "
+              f"Scheduled Arrival: {from_minute(scheduled_arrival)})")
         
-        connection.commit()
-        return True
+        while True:
+            try:
+                actual_start = to_minute(input("Actual Start Time: "))
+                actual_arrival = to_minute(input("Actual Arrival Time: "))
+                break
+            except ValueError:
+                print("Please enter times in HH:MM format.")
         
+        while True:
+            try:
+                passengers_in = int(input("Number of Passengers In: "))
+                passengers_out = int(input("Number of Passengers Out: "))
+                break
+            except ValueError:
+                print("Please enter valid numbers for passengers.")
+        
+        rows.append((
+            trip_number, day, start_minute, stop[0],
+            scheduled_arrival, actual_start, actual_arrival,
+            passengers_in, passengers_out
+        ))
+
+    # Same upsert as the telemetry path, so re-recording a stop updates it
+    try:
+        get_writer().execute(write_stop_rows, rows)
+        return True
     except sqlite3.Error as e:
         print(f"Database error: {e}")
-        connection.rollback()
         return False
-    finally:
-        connection.close()
 
 def display_actual_trip_data(trip_number, date, scheduled_start_time):
-    connection = get_connection()
-    cursor = connection.cursor()
-    
-    try:
-        cursor.execute('''
+    day = to_day_number(date)
+
+    with get_read_connection() as connection:
+        cursor = connection.cursor()
+        stop_data = table_source(connection, "ActualTripStopData", day)
+        
+        cursor.execute(f'''
             SELECT 
                 a.StopNumber,
                 s.StopAddress,
-                a.ScheduledArrivalTime,
-                a.ActualStartTime,
-                a.ActualArrivalTime,
+                a.ScheduledArrivalMinute,
+                a.ActualStartMinute,
+                a.ActualArrivalMinute,
                 a.NumberOfPassengerIn,
                 a.NumberOfPassengerOut
-            FROM ActualTripStopInfo a
+            FROM {stop_data} a
             JOIN Stop s ON a.StopNumber = s.StopNumber
             WHERE a.TripNumber = ? 
-            AND a.Date = ? 
-            AND a.ScheduledStartTime = ?
+            AND a.DayNumber = ? 
+            AND a.StartMinute = ?
             ORDER BY a.StopNumber
-        ''', (trip_number, date, scheduled_start_time))
+        ''', (trip_number, day, to_minute(scheduled_start_time)))
         
-        return cursor.fetchall()
-    finally:
-        connection.close()
-
+        return [(stop, address, from_minute(scheduled), from_minute(actual_start),
+                 from_minute(actual_arrival), passengers_in, passengers_out)
+                for stop, address, scheduled, actual_start, actual_arrival,
+                    passengers_in, passengers_out in cursor]
+
+# Cache tags: a result depends on the trips it lists, plus the day, driver
+# and buses it was filtered on, so writers can invalidate just those.
+def _trip_stops_tags(args, rows):
+    return [("trip", args[0])]
+
+def _weekly_schedule_tags(args, rows):
+    return [("driver", args[0])] + [("trip", row[0]) for row in rows]
+
+def _schedule_tags(args, rows):
+    tags = [("day", to_day_number(args[2]))]
+    for trip, _, _, driver, bus_id in rows:
+        tags += [("trip", trip), ("driver", driver), ("bus", bus_id)]
+    return tags
+
+def _departure_board_tags(args, rows):
+    day = to_day_number(args[1])
+    tags = [("day", day), ("day", day - 1)]
+    for _, trip, _, _, _, driver, bus_id in rows:
+        tags += [("trip", trip), ("driver", driver), ("bus", bus_id)]
+    return tags
+
+@cached(schedule_cache, _trip_stops_tags)
 def display_trip_stops(trip_number):
-    connection = get_connection()
-    cursor = connection.cursor()
-    
-    try:
+    with get_read_connection() as connection:
+        cursor = connection.cursor()
+        
         cursor.execute('''
             SELECT tsi.TripNumber, s.StopNumber, s.StopAddress, 
                    tsi.SequenceNumber, tsi.DrivingTime
@@ -360,57 +428,92 @@ def display_trip_stops(trip_number):
             ORDER BY tsi.SequenceNumber
         ''', (trip_number,))
         
-        results = cursor.fetchall()
-        return results
-    finally:
-        connection.close()
+        return cursor.fetchall()
 
 
+@cached(schedule_cache, _weekly_schedule_tags)
 def display_driver_weekly_schedule(driver_name, start_date):
-    connection = get_connection()
-    cursor = connection.cursor()
-    
-    try:
-        cursor.execute('''
+    first_day = to_day_number(start_date)
+
+    with get_read_connection() as connection:
+        cursor = connection.cursor()
+        offerings = offerings_source(connection, first_day, first_day + 6)
+        
+        # "to" is an SQL keyword and cannot be used as a table alias
+        cursor.execute(f'''
             SELECT 
                 t.TripNumber,
                 t.StartLocationName,
                 t.DestinationName,
-                to.Date,
-                to.ScheduledStartTime,
-                to.ScheduledArrivalTime
-            FROM TripOffering to
-            JOIN Trip t ON to.TripNumber = t.TripNumber
-            WHERE to.DriverName = ?
-            AND date(to.Date) BETWEEN date(?) AND date(?, '+6 days')
-            ORDER BY to.Date, to.ScheduledStartTime
-        ''', (driver_name, start_date, start_date))
+                tr.DayNumber,
+                tr.StartMinute,
+                tr.ArrivalMinute
+            FROM {offerings} tr
+            JOIN Trip t ON tr.TripNumber = t.TripNumber
+            WHERE tr.DriverName = ?
+            AND tr.DayNumber BETWEEN ? AND ?
+            ORDER BY tr.DayNumber, tr.StartMinute
+        ''', (driver_name, first_day, first_day + 6))
         
-        results = cursor.fetchall()
-        return results
-    finally:
-        connection.close()
+        return [(trip, start, destination, from_day_number(day),
+                 from_minute(start_minute), from_minute(arrival_minute))
+                for trip, start, destination, day, start_minute, arrival_minute in cursor]
 
 
 
+@cached(schedule_cache, _schedule_tags)
 def display_schedule(start_location, destination, date):
-    connection = get_connection()
-    cursor = connection.cursor()
-    
-    cursor.execute('''
-        SELECT TripOffering.TripNumber, TripOffering.ScheduledStartTime, 
-               TripOffering.ScheduledArrivalTime, TripOffering.DriverName, 
-               TripOffering.BusID
-        FROM TripOffering
-        JOIN Trip ON Trip.TripNumber = TripOffering.TripNumber
-        WHERE Trip.StartLocationName = ? 
-        AND Trip.DestinationName = ? 
-        AND TripOffering.Date = ?
-    ''', (start_location, destination, date))
-    
-    results = cursor.fetchall()
-    connection.close()
-    return results
+    day = to_day_number(date)
+
+    with get_read_connection() as connection:
+        cursor = connection.cursor()
+        offerings = offerings_source(connection, day)
+        
+        cursor.execute(f'''
+            SELECT TripOfferingData.TripNumber, TripOfferingData.StartMinute, 
+                   TripOfferingData.ArrivalMinute, TripOfferingData.DriverName, 
+                   TripOfferingData.BusID
+            FROM {offerings} TripOfferingData
+            JOIN Trip ON Trip.TripNumber = TripOfferingData.TripNumber
+            WHERE Trip.StartLocationName = ? 
+            AND Trip.DestinationName = ? 
+            AND TripOfferingData.DayNumber = ?
+            ORDER BY TripOfferingData.StartMinute
+        ''', (start_location, destination, day))
+        
+        return [(trip, from_minute(start), from_minute(arrival), driver, bus_id)
+                for trip, start, arrival, driver, bus_id in cursor]
+
+
+_DEPARTURES_SQL = '''
+    SELECT st.ArrivalMinute - ?, st.TripNumber, st.StartMinute,
+           t.StartLocationName, t.DestinationName, o.DriverName, o.BusID
+    FROM ScheduledStopTime st
+    JOIN TripOfferingData o
+        ON o.TripNumber = st.TripNumber AND o.DayNumber = st.DayNumber
+        AND o.StartMinute = st.StartMinute
+    JOIN Trip t ON t.TripNumber = st.TripNumber
+    WHERE st.StopNumber = ? AND st.DayNumber = ? AND st.ArrivalMinute >= ?
+    ORDER BY st.ArrivalMinute, st.TripNumber
+    LIMIT ?
+'''
+
+@cached(schedule_cache, _departure_board_tags)
+def display_departure_board(stop_number, date, after="00:00", limit=10):
+    day = to_day_number(date)
+    after_minute = to_minute(after)
+
+    with get_read_connection() as connection:
+        # Each query is one ordered range scan on idx_scheduledstoptime_stop_day
+        # that stops after `limit` rows: the day itself, and the previous
+        # day's offerings that reach the stop after midnight
+        today = connection.execute(_DEPARTURES_SQL, (0, stop_number, day, after_minute, limit))
+        overnight = connection.execute(
+            _DEPARTURES_SQL, (1440, stop_number, day - 1, after_minute + 1440, limit)).fetchall()
+        departures = list(heapq.merge(overnight, today.fetchall()))[:limit]
+
+    return [(from_minute(minute), trip, from_minute(start % 1440), origin, destination, driver, bus_id)
+            for minute, trip, start, origin, destination, driver, bus_id in departures]
 
 
 def main_menu():
@@ -430,6 +533,8 @@ def main_menu():
         print("12. Display Driver's Weekly Schedule")
         print("13. Record Actual Trip Data")
         print("14. View Actual Trip Data")
+        print("15. Plan Journey")
+        print("16. Departure Board")
         print("0. Exit")
         
         choice = input("\nEnter your choice: ")
@@ -437,10 +542,7 @@ def main_menu():
         if choice == "1":
             print("\n--- Display Schedule ---")
             print("Available locations:", end=" ")
-            connection = get_connection()
-            cursor = connection.cursor()
-            cursor.execute("SELECT DISTINCT StartLocationName, DestinationName FROM Trip")
-            locations = cursor.fetchall()
+            locations = display_locations()
             print("\nFrom -> To:")
             for loc in locations:
                 print(f"{loc[0]} -> {loc[1]}")
@@ -449,7 +551,11 @@ def main_menu():
             destination = input("Enter Destination: ")
             date = input("Enter Date (YYYY-MM-DD): ")
             
-            schedule = display_schedule(start, destination, date)
+            try:
+                schedule = display_schedule(start, destination, date)
+            except ValueError as e:
+                print(f"Error: {e}")
+                continue
             print("\nSchedule:")
             print("TripNumber | Start Time | Arrival Time | Driver | Bus ID")
             print("-" * 60)
@@ -494,7 +600,7 @@ def main_menu():
             try:
                 add_trip_offering(trip_number, date, start_time, arrival_time, driver, bus_id)
                 print("Trip offering added successfully!")
-            except sqlite3.IntegrityError as e:
+            except (sqlite3.IntegrityError, ValueError) as e:
                 print(f"Error: {e}")
 
         elif choice == "6":
@@ -588,7 +694,11 @@ def main_menu():
             driver_name = input("\nEnter Driver Name: ")
             start_date = input("Enter Start Date (YYYY-MM-DD): ")
             
-            schedule = display_driver_weekly_schedule(driver_name, start_date)
+            try:
+                schedule = display_driver_weekly_schedule(driver_name, start_date)
+            except ValueError as e:
+                print(f"Error: {e}")
+                continue
             
             if schedule:
                 print(f"\nWeekly Schedule for {driver_name} starting {start_date}")
@@ -605,15 +715,7 @@ def main_menu():
             print("\n--- Record Actual Trip Data ---")
             # Show available trips first
             print("\nAvailable Trip Offerings:")
-            connection = get_connection()
-            cursor = connection.cursor()
-            cursor.execute('''
-                SELECT DISTINCT t.TripNumber, t.StartLocationName, t.DestinationName,
-                       tr.Date, tr.ScheduledStartTime
-                FROM Trip t
-                JOIN TripOffering tr ON t.TripNumber = tr.TripNumber
-            ''')
-            trips = cursor.fetchall()
+            trips = display_all_trip_offerings()
             print("Trip # | From | To | Date | Start Time")
             print("-" * 50)
             for trip in trips:
@@ -628,10 +730,8 @@ def main_menu():
                     print("\nActual trip data recorded successfully!")
                 else:
                     print("\nFailed to record actual trip data.")
-            except ValueError:
-                print("Invalid input. Trip Number must be a number.")
-            finally:
-                connection.close()
+            except ValueError as e:
+                print(f"Invalid input: {e}")
 
         elif choice == "14":
             print("\n--- View Actual Trip Data ---")
@@ -639,7 +739,11 @@ def main_menu():
             date = input("Enter Date (YYYY-MM-DD): ")
             scheduled_start = input("Enter Scheduled Start Time (HH:MM): ")
             
-            actual_data = display_actual_trip_data(trip_number, date, scheduled_start)
+            try:
+                actual_data = display_actual_trip_data(trip_number, date, scheduled_start)
+            except ValueError as e:
+                print(f"Error: {e}")
+                continue
             
             if actual_data:
                 print("\nActual Trip Data:")
@@ -650,6 +754,53 @@ def main_menu():
             else:
                 print("No actual trip data found for this trip offering.")
 
+        elif choice == "15":
+            # Loaded on first use rather than at startup
+            from journey_planner import plan_journey, print_journey
+
+            print("\n--- Plan Journey ---")
+            print("\nDirect routes (From -> To):")
+            for loc in display_locations():
+                print(f"{loc[0]} -> {loc[1]}")
+
+            start_location = input("\nEnter Start Location: ")
+            destination = input("Enter Destination: ")
+            date = input("Enter Date (YYYY-MM-DD): ")
+            depart_after = input("Leave After (HH:MM, blank for any time): ") or "00:00"
+
+            try:
+                journey = plan_journey(start_location, destination, date, depart_after)
+            except ValueError as e:
+                print(f"Error: {e}")
+                continue
+
+            print_journey(journey)
+
+        elif choice == "16":
+            print("\n--- Departure Board ---")
+            try:
+                stop_number = int(input("Enter Stop Number: "))
+            except ValueError:
+                print("Error: Please enter a valid stop number")
+                continue
+            date = input("Enter Date (YYYY-MM-DD): ")
+            after = input("Leave After (HH:MM, blank for any time): ") or "00:00"
+
+            try:
+                departures = display_departure_board(stop_number, date, after, 10)
+            except ValueError as e:
+                print(f"Error: {e}")
+                continue
+
+            if departures:
+                print(f"\nNext departures from stop {stop_number} after {after}")
+                print("Time | Trip # | Started | From | To | Driver | Bus ID")
+                print("-" * 70)
+                for departure in departures:
+                    print(" | ".join(str(value) for value in departure))
+            else:
+                print("No departures found from this stop after that time")
+
         elif choice == "0":
             print("\nGoodbye!")
             break
@@ -658,5 +809,21 @@ def main_menu():
             print("Invalid choice. Please try again.")
 
 if __name__ == "__main__":
-    setup_database()
+    import argparse
+    import sys
+
+    from instrumentation import enable_from_environment
+    from snapshot import enable_from_environment as enable_snapshots_from_environment
+
+    parser = argparse.ArgumentParser(description="Pomona Transit System")
+    parser.add_argument("--db", help="Database file (defaults to POMONA_TRANSIT_DB)")
+    parser.add_argument("--seed", action="store_true", help="Load the sample trips, drivers and buses")
+    args = parser.parse_args()
+
+    if args.db:
+        from db_pool import configure_pool
+        configure_pool(args.db)
+    setup_database(seed=args.seed)
+    enable_from_environment(sys.modules[__name__])
+    enable_snapshots_from_environment()
     main_menu()
\ No newline at end of file
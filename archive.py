@@ -0,0 +1,286 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+from db_pool import get_pool
+from query_cache import schedule_cache
+from timecodes import from_day_number, to_day_number
+from writer import get_writer
+
+# Hot/cold partitioning. Offerings and stop data older than a horizon move
+# into one SQLite file per month (pomona_transit_2024-11.db next to the main
+# file, or under POMONA_TRANSIT_ARCHIVE_DIR). ArchivedMonth in the main file
+# lists them; read functions that take a date range call table_source(),
+# which ATTACHes the months the range reaches into and returns a UNION ALL
+# over the hot and cold copies of the table.
+
+DEFAULT_HORIZON_DAYS = int(os.environ.get("POMONA_TRANSIT_ARCHIVE_HORIZON_DAYS", "365"))
+
+# SQLite's default limit on attached databases
+MAX_ATTACHED = 10
+
+ARCHIVED_TABLES = ("TripOfferingData", "ActualTripStopData")
+
+ARCHIVE_SCHEMA = {
+    "TripOfferingData": '''
+        CREATE TABLE IF NOT EXISTS {schema}.TripOfferingData (
+            TripNumber INTEGER NOT NULL,
+            DayNumber INTEGER NOT NULL,
+            StartMinute INTEGER NOT NULL,
+            ArrivalMinute INTEGER,
+            DriverName TEXT,
+            BusID INTEGER,
+            PRIMARY KEY (TripNumber, DayNumber, StartMinute)
+        ) WITHOUT ROWID
+    ''',
+    "ActualTripStopData": '''
+        CREATE TABLE IF NOT EXISTS {schema}.ActualTripStopData (
+            TripNumber INTEGER NOT NULL,
+            DayNumber INTEGER NOT NULL,
+            StartMinute INTEGER NOT NULL,
+            StopNumber INTEGER NOT NULL,
+            ScheduledArrivalMinute INTEGER,
+            ActualStartMinute INTEGER,
+            ActualArrivalMinute INTEGER,
+            NumberOfPassengerIn INTEGER,
+            NumberOfPassengerOut INTEGER,
+            PRIMARY KEY (TripNumber, DayNumber, StartMinute, StopNumber)
+        ) WITHOUT ROWID
+    ''',
+}
+
+ARCHIVE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_archive_offering_day "
+    "ON TripOfferingData (DayNumber, StartMinute, ArrivalMinute)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_archive_offering_driver_day "
+    "ON TripOfferingData (DriverName, DayNumber, StartMinute, ArrivalMinute)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_archive_offering_bus_day "
+    "ON TripOfferingData (BusID, DayNumber, StartMinute, ArrivalMinute)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_archive_actual_day "
+    "ON ActualTripStopData (DayNumber)",
+]
+
+# Archived stop rows keep their place in the ridership aggregates, so the
+# trigger that would subtract them is set aside while they are deleted
+RIDERSHIP_DELETE_TRIGGER = "ActualTripStopData_ridership_delete"
+
+
+def archive_directory(db_path):
+    return os.environ.get("POMONA_TRANSIT_ARCHIVE_DIR") or os.path.dirname(os.path.abspath(db_path))
+
+
+def archive_path(db_path, month):
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    return os.path.join(archive_directory(db_path), f"{stem}_{month}.db")
+
+
+def _alias(month):
+    return "archive_" + month.replace("-", "_")
+
+
+def _months(first_day, last_day):
+    # (month 'YYYY-MM', first day, last day) for each month in the range
+    months = []
+    day = first_day
+    while day <= last_day:
+        current = from_day_number(day)[:7]
+        first_of_next = date(int(current[:4]), int(current[5:]), 28) + timedelta(days=4)
+        month_end = to_day_number(first_of_next.replace(day=1)) - 1
+        months.append((current, day, min(month_end, last_day)))
+        day = month_end + 1
+    return months
+
+
+# === Reading history ===
+def history_schemas(connection, first_day, last_day):
+    # Schema names holding rows for the range: "main", plus every archived
+    # month the range reaches into, attached on first use
+    months = connection.execute('''
+        SELECT Month, Path FROM ArchivedMonth
+        WHERE LastDay >= ? AND FirstDay <= ?
+    ''', (first_day, last_day)).fetchall()
+    if not months:
+        return ["main"]
+
+    attached = {row[1] for row in connection.execute("PRAGMA database_list")}
+    wanted = {_alias(month) for month, _ in months}
+    missing = [(month, path) for month, path in months if _alias(month) not in attached]
+    if len(wanted) > MAX_ATTACHED:
+        raise ValueError(f"Date range spans {len(wanted)} archived months; at most {MAX_ATTACHED} can be read at once")
+    # Make room by detaching months this query does not need
+    spare = sorted(name for name in attached if name.startswith("archive_") and name not in wanted)
+    attached_archives = sum(1 for name in attached if name.startswith("archive_"))
+    while attached_archives + len(missing) > MAX_ATTACHED and spare:
+        connection.execute(f"DETACH DATABASE {spare.pop()}")
+        attached_archives -= 1
+    for month, path in missing:
+        connection.execute(f"ATTACH DATABASE ? AS {_alias(month)}", (path,))
+    return ["main"] + sorted(_alias(month) for month, _ in months)
+
+
+def table_source(connection, table, first_day, last_day=None):
+    # What to put after FROM to read `table` for the range: the plain table
+    # name while the range is hot, otherwise a UNION ALL over the archives
+    schemas = history_schemas(connection, first_day, first_day if last_day is None else last_day)
+    if len(schemas) == 1:
+        return table
+    return "(" + " UNION ALL ".join(f"SELECT * FROM {schema}.{table}" for schema in schemas) + ")"
+
+
+# === Archiving ===
+def _create_archive(connection, schema):
+    for sql in ARCHIVE_SCHEMA.values():
+        connection.execute(sql.format(schema=schema))
+    for sql in ARCHIVE_INDEXES:
+        connection.execute(sql.format(schema=schema))
+
+
+def _archive_month(connection, db_path, month, first_day, last_day):
+    # A writer operation (writer.py): the batch's transaction on the main
+    # file covers the copy and the delete, so nothing can change the month
+    # in between and every row deleted is exactly a row copied. With the
+    # main file in WAL mode SQLite does not commit across attached files
+    # atomically, so the rows are copied, as this transaction sees them,
+    # through a connection of their own to the archive and committed there
+    # first; if the delete is then rolled back they are in both files, and
+    # re-running is harmless.
+    path = archive_path(db_path, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    copied = {}
+    archive = sqlite3.connect(path, isolation_level=None)
+    try:
+        _create_archive(archive, "main")
+        archive.execute("BEGIN")
+        for table in ARCHIVED_TABLES:
+            rows = connection.execute(
+                f"SELECT * FROM main.{table} WHERE DayNumber BETWEEN ? AND ?", (first_day, last_day))
+            placeholders = ", ".join("?" * len(rows.description))
+            copied[table] = archive.executemany(
+                f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", rows).rowcount
+        archive.execute("COMMIT")
+    finally:
+        archive.close()
+
+    trigger = connection.execute(
+        "SELECT sql FROM main.sqlite_master WHERE type = 'trigger' AND name = ?",
+        (RIDERSHIP_DELETE_TRIGGER,)).fetchone()
+    if trigger is not None:
+        connection.execute(f"DROP TRIGGER main.{RIDERSHIP_DELETE_TRIGGER}")
+    deleted = {}
+    for table in reversed(ARCHIVED_TABLES):
+        deleted[table] = connection.execute(
+            f"DELETE FROM main.{table} WHERE DayNumber BETWEEN ? AND ?",
+            (first_day, last_day)).rowcount
+    if trigger is not None:
+        connection.execute(trigger[0])
+    connection.execute('''
+        INSERT INTO ArchivedMonth (Month, Path, FirstDay, LastDay, Offerings, StopRows, ArchivedAt)
+        VALUES (?, ?, ?, ?, ?, ?, datetime('now'))
+        ON CONFLICT (Month) DO UPDATE SET
+            Path = excluded.Path,
+            FirstDay = MIN(FirstDay, excluded.FirstDay),
+            LastDay = MAX(LastDay, excluded.LastDay),
+            Offerings = Offerings + excluded.Offerings,
+            StopRows = StopRows + excluded.StopRows,
+            ArchivedAt = excluded.ArchivedAt
+    ''', (month, path, first_day, last_day,
+          deleted["TripOfferingData"], deleted["ActualTripStopData"]))
+    return copied, deleted
+
+
+def _has_rows(connection, first_day, last_day):
+    return any(connection.execute(
+        f"SELECT EXISTS (SELECT 1 FROM main.{table} WHERE DayNumber BETWEEN ? AND ?)",
+        (first_day, last_day)).fetchone()[0] for table in ARCHIVED_TABLES)
+
+
+def archive_before(cutoff_date, vacuum=False):
+    # Moves every offering and stop row dated before cutoff_date into the
+    # month archives, one write per month. Returns [(month, rows deleted per
+    # table), ...].
+    writer = get_writer()
+    pool = writer.pool
+    cutoff = to_day_number(cutoff_date)
+    with pool.connection() as connection:
+        oldest = connection.execute('''
+            SELECT MIN(day) FROM (
+                SELECT MIN(DayNumber) AS day FROM TripOfferingData
+                UNION ALL SELECT MIN(DayNumber) FROM ActualTripStopData)
+        ''').fetchone()[0]
+        months = [] if oldest is None or oldest >= cutoff else [
+            (month, first_day, last_day) for month, first_day, last_day in _months(oldest, cutoff - 1)
+            if _has_rows(connection, first_day, last_day)]
+    # The connection goes back to the pool first: the writer needs one
+    results = []
+    for month, first_day, last_day in months:
+        _, deleted = writer.execute(_archive_month, pool.db_path, month, first_day, last_day)
+        results.append((month, deleted))
+    if vacuum and results:
+        # Deleted pages only go back to the OS with a VACUUM
+        with pool.connection() as connection:
+            connection.execute("VACUUM")
+    if results:
+        schedule_cache.clear()
+    return results
+
+
+def archive_older_than(horizon_days=DEFAULT_HORIZON_DAYS, today=None, **options):
+    today = today or date.today()
+    return archive_before(today - timedelta(days=horizon_days), **options)
+
+
+def archived_months(pool=None):
+    with (pool or get_pool()).connection() as connection:
+        return connection.execute('''
+            SELECT Month, Path, FirstDay, LastDay, Offerings, StopRows, ArchivedAt
+            FROM ArchivedMonth ORDER BY Month
+        ''').fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move old service days into monthly archive files")
+    parser.add_argument("--db", help="Database file (defaults to POMONA_TRANSIT_DB)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="Archive everything older than the horizon")
+    run.add_argument("--horizon-days", type=int, default=DEFAULT_HORIZON_DAYS)
+    run.add_argument("--before", help="Archive days before this date (YYYY-MM-DD) instead")
+    run.add_argument("--vacuum", action="store_true", help="Shrink the main file afterwards")
+    commands.add_parser("list", help="Show the archived months")
+    args = parser.parse_args(argv)
+
+    from app import setup_database
+    from db_pool import configure_pool
+
+    if args.db:
+        configure_pool(args.db, size=1)
+    setup_database()
+
+    if args.command == "list":
+        print("Month | Days | Offerings | Stop Rows | Archived At | File")
+        print("-" * 80)
+        for month, path, first_day, last_day, offerings, stop_rows, archived_at in archived_months():
+            print(f"{month} | {from_day_number(first_day)}..{from_day_number(last_day)} | "
+                  f"{offerings} | {stop_rows} | {archived_at} | {path}")
+        return 0
+
+    started = time.perf_counter()
+    try:
+        if args.before:
+            results = archive_before(args.before, vacuum=args.vacuum)
+        else:
+            results = archive_older_than(args.horizon_days, vacuum=args.vacuum)
+    except (ValueError, sqlite3.Error) as e:
+        print(f"Error: {e}")
+        return 1
+    for month, deleted in results:
+        print(f"{month}: {deleted['TripOfferingData']} offerings, "
+              f"{deleted['ActualTripStopData']} stop rows archived")
+    print(f"{len(results)} month(s) archived in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
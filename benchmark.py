@@ -0,0 +1,194 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import app
+from datagen import ID_BASE, FleetSpec, driver_name, generate
+from db_pool import configure_pool
+from query_cache import schedule_cache
+from timecodes import from_day_number, from_minute, to_day_number
+from timetable_engine import TimetableEngine
+
+# Named data sizes; each one is generated into its own scratch database
+SIZES = {
+    "small": FleetSpec(trips=20, stops=80, days=7, departures_per_day=4),
+    "medium": FleetSpec(trips=100, stops=400, days=30, departures_per_day=8),
+    "large": FleetSpec(trips=400, stops=1500, days=90, departures_per_day=12),
+}
+
+DEFAULT_REPEAT = 50
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(samples):
+    return {
+        "calls": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": _percentile(samples, 0.50) * 1000,
+        "p95_ms": _percentile(samples, 0.95) * 1000,
+        "max_ms": max(samples) * 1000,
+    }
+
+
+def time_calls(function, argument_sets, clear_cache=True):
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for args in argument_sets:
+            if clear_cache:
+                schedule_cache.clear()
+            started = time.perf_counter()
+            function(*args)
+            samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def benchmark_size(name, spec, directory, repeat):
+    db_path = os.path.join(directory, f"bench_{name}.db")
+    pool = configure_pool(db_path, size=2)
+    app.setup_database()
+
+    started = time.perf_counter()
+    with pool.connection() as connection:
+        counts = generate(connection, spec)
+    generate_seconds = time.perf_counter() - started
+
+    # Sample arguments are drawn from the generated data with a fixed seed
+    rng = random.Random(spec.seed + 1)
+    with pool.connection() as connection:
+        routes = connection.execute(
+            "SELECT DISTINCT StartLocationName, DestinationName FROM Trip WHERE TripNumber >= ?",
+            (ID_BASE,)).fetchall()
+        offerings = connection.execute(
+            "SELECT TripNumber, DayNumber, StartMinute FROM TripOfferingData "
+            "WHERE TripNumber >= ? ORDER BY TripNumber, DayNumber, StartMinute LIMIT 5000",
+            (ID_BASE,)).fetchall()
+
+    first_day = to_day_number(spec.start_date)
+    dates = [from_day_number(first_day + rng.randrange(spec.days)) for _ in range(repeat)]
+    schedule_args = [rng.choice(routes) + (dates[i],) for i in range(repeat)]
+    weekly_args = [(driver_name(rng.randrange(spec.drivers)), spec.start_date) for _ in range(repeat)]
+    trip_args = [(ID_BASE + rng.randrange(spec.trips),) for _ in range(repeat)]
+    actual_args = [(trip, from_day_number(day), from_minute(minute))
+                   for trip, day, minute in rng.sample(offerings, min(repeat, len(offerings)))]
+
+    # Writes go past the generated range so they never collide with it
+    new_day = first_day + spec.days + 1
+    add_args = [(ID_BASE + i % spec.trips, from_day_number(new_day + i // spec.trips),
+                 "04:00", "05:00", driver_name(i % spec.drivers), ID_BASE + i % spec.buses)
+                for i in range(repeat)]
+    delete_trip_args = [(ID_BASE + t,) for t in range(spec.trips - 1, max(-1, spec.trips - 1 - repeat), -1)]
+    bus_args = [(ID_BASE + rng.randrange(spec.buses),) for _ in range(repeat)]
+    driver_args = [(driver_name(rng.randrange(spec.drivers)),) for _ in range(repeat)]
+
+    # The in-memory engine answers the same schedule lookup; loading a day is
+    # timed separately from the lookups it serves
+    engine = TimetableEngine(max_days=spec.days)
+    day_args = [(from_day_number(first_day + d),) for d in range(spec.days)]
+    driver_day_args = [(driver, dates[i]) for i, (driver, _) in enumerate(weekly_args)]
+    engine_functions = {
+        "engine_load_day": time_calls(engine.service_day, day_args, clear_cache=False),
+        "engine_schedule": time_calls(engine.schedule, schedule_args, clear_cache=False),
+        "engine_driver_day": time_calls(engine.driver_day, driver_day_args, clear_cache=False),
+    }
+    engine.close()
+
+    functions = {
+        "display_schedule": time_calls(app.display_schedule, schedule_args),
+        "display_schedule_cached": time_calls(app.display_schedule, schedule_args * 2, clear_cache=False),
+        "display_driver_weekly_schedule": time_calls(app.display_driver_weekly_schedule, weekly_args),
+        "display_trip_stops": time_calls(app.display_trip_stops, trip_args),
+        "display_actual_trip_data": time_calls(app.display_actual_trip_data, actual_args),
+        "add_trip_offering": time_calls(app.add_trip_offering, add_args),
+        # Every generated bus and driver has offerings, so these measure the guard check
+        "delete_bus_guard": time_calls(app.delete_bus, bus_args),
+        "delete_driver_guard": time_calls(app.delete_driver, driver_args),
+        "delete_trip": time_calls(app.delete_trip, delete_trip_args),
+    }
+    functions.update(engine_functions)
+    pool.close()
+
+    return {
+        "name": name,
+        "spec": spec.as_dict(),
+        "rows": counts,
+        "generate_seconds": generate_seconds,
+        "database_bytes": os.path.getsize(db_path),
+        "functions": functions,
+    }
+
+
+def compare(current, previous, threshold):
+    # Returns (size, function, old p50, new p50) for every p50 that got worse
+    # by more than the threshold ratio
+    regressions = []
+    old_sizes = {size["name"]: size for size in previous["sizes"]}
+    for size in current["sizes"]:
+        old = old_sizes.get(size["name"])
+        if old is None:
+            continue
+        for function, result in size["functions"].items():
+            old_result = old["functions"].get(function)
+            if old_result and result["p50_ms"] > old_result["p50_ms"] * threshold:
+                regressions.append((size["name"], function, old_result["p50_ms"], result["p50_ms"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the transaction functions in app.py")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["small", "medium"])
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Earlier results file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="p50 slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "repeat": args.repeat,
+        "sizes": [],
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.sizes:
+            print(f"--- {name} ---")
+            result = benchmark_size(name, SIZES[name], directory, args.repeat)
+            print(f"rows: {result['rows']} (generated in {result['generate_seconds']:.1f}s)")
+            print("Function | p50 ms | p95 ms | max ms")
+            print("-" * 60)
+            for function, timing in result["functions"].items():
+                print(f"{function} | {timing['p50_ms']:.3f} | {timing['p95_ms']:.3f} | {timing['max_ms']:.3f}")
+            results["sizes"].append(result)
+
+    with open(args.output, "w") as handle:
+        json.dump(results, handle, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as handle:
+            previous = json.load(handle)
+        regressions = compare(results, previous, args.threshold)
+        for size, function, old, new in regressions:
+            print(f"REGRESSION {size} {function}: p50 {old:.3f} ms -> {new:.3f} ms")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
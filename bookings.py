@@ -0,0 +1,303 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from query_cache import schedule_cache
+from service_calendar import offerings_source
+from timecodes import from_day_number, from_minute, to_day_number
+
+# Double-booking detection. A driver or bus is booked for the half-open
+# window [StartMinute, ArrivalMinute) of each offering, so back-to-back trips
+# do not conflict. Each (resource, day) keeps its windows sorted by start,
+# with the running maximum of their ends alongside, so a check is two binary
+# searches even when stored windows overlap one another (flagged bookings,
+# imported or generated data). audit() lists the overlaps already stored.
+#
+# An arrival before the start is on the next day, so a trip that crosses
+# midnight keeps its window on the day it starts, with an end past 1440, and
+# is checked against the day before and the day after as well.
+#
+# Sets hold the departures of service patterns (service_calendar.py) with
+# their default driver and bus, as well as the explicit offerings, so the
+# two cannot be booked over each other. An explicit offering replaces the
+# pattern departure with the same trip, day and start, so that one window
+# is not a clash.
+#
+# Loaded windows only see the writes made through this process's writer, so
+# a set is reloaded once it is older than BOOKING_INDEX_TTL seconds, which
+# bounds how long writes from other processes or tools can go unseen.
+
+# "reject" raises BookingConflict; "flag" prints a warning and inserts anyway
+BOOKING_POLICY = os.environ.get("POMONA_TRANSIT_BOOKING_CONFLICTS", "reject")
+
+BOOKING_INDEX_TTL = float(os.environ.get("POMONA_TRANSIT_BOOKING_TTL", "5"))
+
+RESOURCE_COLUMNS = {"driver": "DriverName", "bus": "BusID"}
+
+# other_day is the day the clashing window starts on
+Conflict = namedtuple("Conflict",
+                      "kind resource day trip start end other_trip other_start other_end other_day")
+
+
+class BookingConflict(ValueError):
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        super().__init__("; ".join(describe(conflict) for conflict in conflicts))
+
+
+def _clock(minute):
+    return from_minute(minute % 1440)
+
+
+def describe(conflict):
+    other_day = "" if conflict.other_day == conflict.day else f" on {from_day_number(conflict.other_day)}"
+    return (f"{conflict.kind} {conflict.resource} on {from_day_number(conflict.day)}: "
+            f"trip {conflict.trip} {_clock(conflict.start)}-{_clock(conflict.end)} overlaps "
+            f"trip {conflict.other_trip}{other_day} "
+            f"{_clock(conflict.other_start)}-{_clock(conflict.other_end)}")
+
+
+def _end(start, arrival):
+    # An offering without an arrival, or arriving at its start minute,
+    # still occupies that minute; an arrival before the start is on the
+    # next day
+    if arrival is None or arrival == start:
+        return start + 1
+    if arrival < start:
+        return arrival + 1440
+    return arrival
+
+
+def _neighbours(day, end):
+    # (day, shift) for each day whose windows can overlap one on `day`
+    # ending at `end`: the day itself, the day before (whose overnight
+    # windows reach into this one), and the day after when this window
+    # crosses midnight. Adding shift puts the window in that day's minutes.
+    yield day, 0
+    yield day - 1, 1440
+    if end > 1440:
+        yield day + 1, -1440
+
+
+class IntervalSet:
+    # reach[i] is the latest end among windows 0..i, so it never decreases
+    __slots__ = ("starts", "ends", "trips", "reach")
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.trips = []
+        self.reach = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlapping(self, start, end, skip=None):
+        # Returns (trip, start, end) of a clashing window, or None. Windows
+        # 0..before-1 start before the new one ends; the first of them whose
+        # reach passes the new start is the one that ends after it. The
+        # window skip (trip, start), if any, is passed over.
+        before = bisect_left(self.starts, end)
+        i = bisect_right(self.reach, start, 0, before)
+        while i < before:
+            if self.ends[i] > start and (self.trips[i], self.starts[i]) != skip:
+                return self.trips[i], self.starts[i], self.ends[i]
+            i += 1
+        return None
+
+    def _update_reach(self, i):
+        del self.reach[i:]
+        reach = self.reach[-1] if self.reach else None
+        for end in self.ends[i:]:
+            reach = end if reach is None or end > reach else reach
+            self.reach.append(reach)
+
+    def insert(self, trip, start, end):
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.trips.insert(i, trip)
+        self._update_reach(i)
+
+    def remove(self, trip, start=None):
+        first = None
+        for i in range(len(self.starts) - 1, -1, -1):
+            if self.trips[i] == trip and (start is None or self.starts[i] == start):
+                del self.starts[i], self.ends[i], self.trips[i]
+                first = i
+        if first is not None:
+            self._update_reach(first)
+
+
+class BookingIndex:
+    # Windows are loaded per (kind, resource, day) on first use, through the
+    # covering (resource, DayNumber, StartMinute, ArrivalMinute) indexes, and
+    # then kept in step by the writers in app.py until they are ttl seconds
+    # old.
+    def __init__(self, cache=schedule_cache, ttl=BOOKING_INDEX_TTL):
+        self.ttl = ttl
+        self._sets = {}
+        self._loaded_at = {}
+        self._lock = threading.RLock()
+        self._cache = cache
+        self.loads = 0
+        self.checks = 0
+        cache.subscribe(self._on_invalidate)
+
+    def close(self):
+        self._cache.unsubscribe(self._on_invalidate)
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._sets.clear()
+            self._loaded_at.clear()
+
+    def _on_invalidate(self, tags):
+        with self._lock:
+            if tags is None:
+                self.clear()
+                return
+            if any(kind == "pattern" for kind, _ in tags):
+                # Pattern departures were added, moved or re-crewed on the
+                # days sent with it
+                days = {value for kind, value in tags if kind == "day"}
+                for key in [key for key in self._sets if key[2] in days]:
+                    del self._sets[key], self._loaded_at[key]
+            for kind, value in tags:
+                if kind == "trip":
+                    # The trip's offerings may have been replaced rather
+                    # than removed, so the sets holding it are reloaded
+                    for key in [key for key, intervals in self._sets.items() if value in intervals.trips]:
+                        del self._sets[key], self._loaded_at[key]
+
+    def _intervals(self, connection, kind, resource, day):
+        key = (kind, resource, day)
+        intervals = self._sets.get(key)
+        now = time.monotonic()
+        if intervals is None or now - self._loaded_at[key] > self.ttl:
+            intervals = IntervalSet()
+            for trip, start, arrival in connection.execute(f'''
+                SELECT TripNumber, StartMinute, ArrivalMinute
+                FROM {offerings_source(connection, day)} o
+                WHERE {RESOURCE_COLUMNS[kind]} = ? AND DayNumber = ?
+                ORDER BY StartMinute
+            ''', (resource, day)):
+                intervals.insert(trip, start, _end(start, arrival))
+            self._sets[key] = intervals
+            self._loaded_at[key] = now
+            self.loads += 1
+        return intervals
+
+    def check(self, connection, trip, day, start, arrival, driver, bus_id):
+        # Every conflict the new offering would create, as Conflict tuples
+        end = _end(start, arrival)
+        conflicts = []
+        with self._lock:
+            self.checks += 1
+            for kind, resource in (("driver", driver), ("bus", bus_id)):
+                if resource is None:
+                    continue
+                for other_day, shift in _neighbours(day, end):
+                    clash = self._intervals(connection, kind, resource, other_day).overlapping(
+                        start + shift, end + shift, (trip, start) if other_day == day else None)
+                    if clash is not None:
+                        conflicts.append(Conflict(kind, resource, day, trip, start, end, *clash, other_day))
+                        break
+        return conflicts
+
+    def add(self, connection, trip, day, start, arrival, driver, bus_id):
+        with self._lock:
+            # The offering replaces any pattern departure with its key,
+            # whoever that was crewed by
+            for key, intervals in self._sets.items():
+                if key[2] == day:
+                    intervals.remove(trip, start)
+            for kind, resource in (("driver", driver), ("bus", bus_id)):
+                if resource is not None:
+                    self._intervals(connection, kind, resource, day).insert(trip, start, _end(start, arrival))
+
+    def discard(self, trip, day, start, driver, bus_id):
+        # The day's sets are reloaded on next use rather than edited, so a
+        # pattern departure the offering had replaced (see add) comes back
+        # with them
+        with self._lock:
+            for key in [key for key in self._sets if key[2] == day]:
+                del self._sets[key], self._loaded_at[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "resource_days": len(self._sets),
+                "intervals": sum(len(intervals) for intervals in self._sets.values()),
+                "loads": self.loads,
+                "checks": self.checks,
+            }
+
+
+def audit(connection, first_day=None, last_day=None, kinds=("driver", "bus")):
+    # Yields every overlap in the range in one ordered pass per resource
+    # kind: rows arrive sorted by (resource, day, start), and each window is
+    # compared, in minutes since day 0, with the latest-ending window seen
+    # so far for its resource, so overnight windows carry into the next
+    # day. The day before the range is read for its spill-over only.
+    first_day = -(1 << 31) + 1 if first_day is None else to_day_number(first_day)
+    last_day = (1 << 31) - 1 if last_day is None else to_day_number(last_day)
+    for kind in kinds:
+        column = RESOURCE_COLUMNS[kind]
+        group = None
+        latest = None
+        for resource, day, start, arrival, trip in connection.execute(f'''
+            SELECT {column}, DayNumber, StartMinute, ArrivalMinute, TripNumber
+            FROM TripOfferingData
+            WHERE {column} IS NOT NULL AND DayNumber BETWEEN ? AND ?
+            ORDER BY {column}, DayNumber, StartMinute
+        ''', (first_day - 1, last_day)):
+            end = _end(start, arrival)
+            base = day * 1440
+            if resource != group:
+                group = resource
+                latest = (trip, start, end, day)
+                continue
+            latest_end = latest[3] * 1440 + latest[2]
+            if base + start < latest_end and day >= first_day:
+                yield Conflict(kind, resource, day, trip, start, end, *latest)
+            if base + end > latest_end:
+                latest = (trip, start, end, day)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find drivers and buses booked on overlapping trips")
+    parser.add_argument("--from", dest="first_date", help="First date (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="last_date", help="Last date (YYYY-MM-DD)")
+    parser.add_argument("--kind", choices=list(RESOURCE_COLUMNS), help="Only check drivers or buses")
+    parser.add_argument("--db", help="Database file (defaults to POMONA_TRANSIT_DB)")
+    args = parser.parse_args(argv)
+
+    from app import setup_database
+    from db_pool import configure_pool, pooled_connection
+
+    if args.db:
+        configure_pool(args.db, size=1)
+    setup_database()
+
+    kinds = (args.kind,) if args.kind else tuple(RESOURCE_COLUMNS)
+    found = 0
+    with pooled_connection() as connection:
+        for conflict in audit(connection, args.first_date, args.last_date, kinds):
+            print(describe(conflict))
+            found += 1
+    print(f"{found} conflict(s) found")
+    return 1 if found else 0
+
+
+# Shared by add_trip_offering in app.py
+booking_index = BookingIndex()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
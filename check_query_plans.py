@@ -0,0 +1,188 @@
+import builtins
+import contextlib
+import io
+import itertools
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+import app
+from db_pool import configure_pool
+
+# Listings are expected to read every row of their table
+FULL_SCAN_ALLOWED = {
+    "display_all_drivers",
+    "display_all_trips",
+    "display_all_buses",
+    "display_locations",
+    "display_all_trip_offerings",
+}
+
+# One representative call per transaction function, run against the seed data
+SAMPLE_CALLS = [
+    ("display_schedule", ("Pomona", "Los Angeles", "2024-11-24")),
+    ("display_driver_weekly_schedule", ("John Doe", "2024-11-20")),
+    ("display_trip_stops", (1,)),
+    ("display_all_drivers", ()),
+    ("display_all_trips", ()),
+    ("display_all_buses", ()),
+    ("display_locations", ()),
+    ("display_all_trip_offerings", ()),
+    ("add_driver", ("Plan Check", "555-0199")),
+    ("add_bus", (199, "Plan Check", 2024)),
+    ("add_trip_offering", (1, "2024-11-25", "08:00", "10:00", "Plan Check", 199)),
+    ("record_actual_trip_data", (1, "2024-11-25", "08:00")),
+    ("display_actual_trip_data", (1, "2024-11-25", "08:00")),
+    ("display_departure_board", (1, "2024-11-24", "08:15", 10)),
+    ("delete_bus", (103,)),
+    ("delete_driver", ("Bob Wilson",)),
+    ("delete_trip", (1,)),
+]
+
+# Answers fed to the prompts in record_actual_trip_data, one stop at a time
+STOP_ANSWERS = ["08:30", "08:00", "08:32", "4", "1"]
+
+PLANNED_STATEMENTS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+# The trace shows only the outer statement (once per trigger it fires), so
+# trigger bodies are read from the schema and planned on their own
+WRITE_TARGET = re.compile(r"(INSERT|UPDATE|DELETE)\s+(?:OR\s+\w+\s+)?(?:INTO\s+|FROM\s+)?(\w+)", re.I)
+TRIGGER_EVENT = re.compile(r"\b(INSERT|UPDATE|DELETE)\b(?:\s+OF\s+[\w\s,]+?)?\s+ON\s+\w+", re.I)
+ROW_COLUMN = re.compile(r"\b(?:NEW|OLD)\.\w+", re.I)
+
+
+def explain(connection, sql):
+    # Trigger statements are planned with their NEW./OLD. columns as
+    # parameters, which the planner treats like any other bound value
+    sql, count = ROW_COLUMN.subn("?", sql)
+    rows = connection.execute("EXPLAIN QUERY PLAN " + sql, (None,) * count).fetchall()
+    return [row[3] for row in rows]
+
+
+def table_scans(details):
+    # Scanning a subquery's rows (a co-routine or materialized view) is
+    # fine; its own lines show how it reads the table underneath
+    derived = {d.split(" ", 1)[1] for d in details if d.startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+    return [d for d in details
+            if d.startswith("SCAN") and d != "SCAN CONSTANT ROW" and d[len("SCAN "):] not in derived]
+
+
+def _split_statements(body):
+    statements = []
+    current = ""
+    for piece in body.split(";"):
+        current += piece + ";"
+        if sqlite3.complete_statement(current):
+            statement = current.strip().rstrip(";").strip()
+            if statement:
+                statements.append(statement)
+            current = ""
+    return statements
+
+
+def load_triggers(connection):
+    # {(table, event): [(trigger name, [body statement, ...])]}
+    triggers = {}
+    for name, table, sql in connection.execute(
+            "SELECT name, tbl_name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY name"):
+        header, body = re.split(r"\bBEGIN\b", sql, maxsplit=1, flags=re.I)
+        event = TRIGGER_EVENT.search(header).group(1).upper()
+        body = body[:body.upper().rindex("END")]
+        triggers.setdefault((table.lower(), event), []).append((name, _split_statements(body)))
+    return triggers
+
+
+def triggered(triggers, sql, seen):
+    # Yields (trigger name, statement) for the triggers sql can fire, and
+    # for the ones those statements fire in turn
+    match = WRITE_TARGET.match(sql.lstrip())
+    if not match:
+        return
+    events = {match.group(1).upper()}
+    if "DO UPDATE" in " ".join(sql.upper().split()):
+        events.add("UPDATE")
+    for event in sorted(events):
+        for name, body in triggers.get((match.group(2).lower(), event), ()):
+            if name in seen:
+                continue
+            seen.add(name)
+            for statement in body:
+                yield name, statement
+                yield from triggered(triggers, statement, seen)
+
+
+def check_plans(db_path):
+    pool = configure_pool(db_path, size=1)
+    app.setup_database(seed=True)
+
+    # With a single pooled connection every function runs on the traced one
+    statements = []
+    with pool.connection() as connection:
+        connection.set_trace_callback(statements.append)
+
+    planner = sqlite3.connect(db_path)
+    triggers = load_triggers(planner)
+    answers = itertools.cycle(STOP_ANSWERS)
+    real_input = builtins.input
+    builtins.input = lambda prompt="": next(answers)
+    failures = []
+    report = []
+    # Each statement is planned once, and each trigger statement once for
+    # the whole run, under the trigger that holds it
+    checked = set()
+
+    def check(name, sql):
+        sql = " ".join(sql.split())
+        if (name, sql) in checked:
+            return
+        checked.add((name, sql))
+        details = explain(planner, sql)
+        scans = table_scans(details)
+        report.append((name, sql, details))
+        if scans and name not in FULL_SCAN_ALLOWED:
+            failures.append((name, sql, scans))
+
+    try:
+        for name, args in SAMPLE_CALLS:
+            statements.clear()
+            with contextlib.redirect_stdout(io.StringIO()):
+                getattr(app, name)(*args)
+            for sql in statements:
+                if not sql.lstrip().upper().startswith(PLANNED_STATEMENTS):
+                    continue
+                check(name, sql)
+                for trigger, statement in triggered(triggers, sql, set()):
+                    check(f"trigger {trigger}", statement)
+    finally:
+        builtins.input = real_input
+        planner.close()
+        pool.close()
+
+    return report, failures
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        report, failures = check_plans(os.path.join(directory, "plan_check.db"))
+
+    for name, sql, details in report:
+        print(f"{name}: {sql}")
+        for detail in details:
+            print(f"    {detail}")
+
+    if failures:
+        print(f"\n{len(failures)} statement(s) fall back to a table scan:")
+        for name, sql, scans in failures:
+            print(f"  {name}: {sql}")
+            for scan in scans:
+                print(f"    {scan}")
+        return 1
+
+    print("\nAll transaction queries are index-backed.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import builtins
+import contextlib
+import io
+import itertools
+import os
+import sys
+import tempfile
+
+import app
+from bookings import BookingConflict, audit
+from db_pool import configure_pool
+from service_calendar import add_service_pattern
+from telemetry import StopEvent, TelemetryIngestor, ingest_stop_events
+
+# Scenario checks for the transaction functions, run like
+# check_query_plans.py against a scratch database with the seed data. Each
+# scenario takes the pool and returns a list of failure messages.
+
+
+def _accepted(function, *args):
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(*args)
+    except BookingConflict:
+        return False
+    return True
+
+
+def overnight_bookings(pool):
+    # A trip from 23:30 to 01:00 books its driver and bus through midnight
+    failures = []
+    expected = [
+        ((1, "2024-11-24", "23:30", "01:00", "Bob Wilson", 103), True),
+        ((2, "2024-11-24", "23:45", "23:50", "Bob Wilson", 103), False),
+        ((2, "2024-11-25", "00:10", "00:50", "Bob Wilson", 103), False),
+        ((3, "2024-11-25", "01:00", "02:00", "Bob Wilson", 103), True),
+        # Booked the other way round: the early trip exists first
+        ((3, "2024-11-27", "00:10", "00:50", "Jane Smith", 102), True),
+        ((1, "2024-11-26", "23:30", "01:00", "Jane Smith", 102), False),
+    ]
+    for args, accept in expected:
+        if _accepted(app.add_trip_offering, *args) != accept:
+            failures.append(f"add_trip_offering{args} was {'rejected' if accept else 'accepted'}")
+
+    # Stored overlaps across midnight, as an import could leave them
+    with pool.connection() as connection:
+        connection.executemany("INSERT INTO TripOffering VALUES (?, ?, ?, ?, ?, ?)", [
+            (2, "2024-11-28", "23:00", "01:00", "John Doe", 101),
+            (3, "2024-11-29", "00:30", "01:30", "John Doe", 101),
+        ])
+        connection.commit()
+        found = list(audit(connection, "2024-11-29", "2024-11-29"))
+    if sorted(conflict.kind for conflict in found) != ["bus", "driver"]:
+        failures.append(f"audit found {found}, expected the driver and bus overlap on 2024-11-29")
+    return failures
+
+
+def pattern_actuals(pool):
+    # A departure that exists only as a weekday pattern can be recorded
+    # and ingested like an explicit offering
+    failures = []
+    add_service_pattern(2, "15:00", "19:00", "1111100", "2024-11-25", "2024-12-06", "Bob Wilson", 103)
+
+    answers = itertools.cycle(["15:35", "15:40", "3", "0"])
+    real_input = builtins.input
+    builtins.input = lambda prompt="": next(answers)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            recorded = app.record_actual_trip_data(2, "2024-11-26", "15:00")
+    finally:
+        builtins.input = real_input
+    if not recorded:
+        failures.append(f"record_actual_trip_data was refused: {output.getvalue().strip()}")
+    scheduled = [row[2] for row in app.display_actual_trip_data(2, "2024-11-26", "15:00")]
+    if scheduled != ["15:30", "16:30"]:
+        failures.append(f"recorded scheduled arrivals {scheduled}, expected ['15:30', '16:30']")
+
+    rejected = []
+    stats = ingest_stop_events([
+        StopEvent(2, "2024-11-27", "15:00", 1, "15:30", "15:31", "15:33", 5, 0),
+        # Saturday, when the pattern does not run
+        StopEvent(2, "2024-11-30", "15:00", 1, "15:30", "15:31", "15:33", 5, 0),
+    ], pool=pool, on_reject=lambda event, error: rejected.append(str(error)))
+    if stats["accepted"] != 1 or len(rejected) != 1:
+        failures.append(f"telemetry accepted {stats['accepted']} and rejected {rejected}, expected 1 and 1")
+    return failures
+
+
+def pattern_bookings(pool):
+    # Pattern departures book their default driver and bus
+    failures = []
+    add_service_pattern(1, "15:00", "17:00", "1111111", "2024-11-25", "2024-12-01", "John Doe", 102)
+    expected = [
+        ((1, "2024-11-25", "15:30", "16:30", "John Doe", 102), False),
+        ((3, "2024-11-26", "16:00", "18:00", "Jane Smith", 102), False),
+        # Replacing the pattern's own departure is not a clash
+        ((1, "2024-11-27", "15:00", "17:30", "John Doe", 102), True),
+        ((3, "2024-11-28", "17:00", "18:00", "John Doe", 102), True),
+    ]
+    for args, accept in expected:
+        if _accepted(app.add_trip_offering, *args) != accept:
+            failures.append(f"add_trip_offering{args} was {'rejected' if accept else 'accepted'}")
+    return failures
+
+
+def telemetry_after_delete(pool):
+    # A long-lived ingestor stops accepting rows for a trip once it is deleted
+    rejected = []
+    ingestor = TelemetryIngestor(pool, on_reject=lambda event, error: rejected.append(str(error)))
+    event = StopEvent(2, "2024-11-24", "09:00", 1, "09:30", "09:31", "09:33", 5, 0)
+    try:
+        ingestor.ingest([event])
+        app.delete_trip(2)
+        stats = ingestor.ingest([event])
+    finally:
+        ingestor.close()
+    if stats["accepted"] != 1 or len(rejected) != 1:
+        return [f"telemetry accepted {stats['accepted']} and rejected {rejected} around delete_trip, "
+                "expected 1 and 1"]
+    return []
+
+
+SCENARIOS = [
+    overnight_bookings,
+    pattern_actuals,
+    pattern_bookings,
+    telemetry_after_delete,
+]
+
+
+def check_scenarios(directory):
+    failures = []
+    for scenario in SCENARIOS:
+        pool = configure_pool(os.path.join(directory, f"{scenario.__name__}.db"), size=2)
+        try:
+            app.setup_database(seed=True)
+            failures += [f"{scenario.__name__}: {failure}" for failure in scenario(pool)]
+        finally:
+            pool.close()
+    return failures
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        failures = check_scenarios(directory)
+
+    if failures:
+        print(f"{len(failures)} scenario check(s) failed:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+
+    print(f"All {len(SCENARIOS)} scenario(s) passed.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
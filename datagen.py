@@ -0,0 +1,167 @@
+import argparse
+import heapq
+import random
+import sys
+
+from timecodes import to_day_number
+
+# Generated IDs start here so they never collide with the seed data
+ID_BASE = 1000
+
+STREETS = ["Main St", "Broadway", "Ocean Ave", "Holt Ave", "Garey Ave", "Mission Blvd",
+           "Foothill Blvd", "Temple Ave", "Valley Blvd", "Grand Ave"]
+MODELS = [("Mercedes Sprinter", 2018), ("Ford Transit", 2019), ("Toyota Coaster", 2020),
+          ("Gillig Low Floor", 2021), ("New Flyer Xcelsior", 2022)]
+
+
+class FleetSpec:
+    __slots__ = ("trips", "stops", "days", "locations", "departures_per_day",
+                 "stops_per_trip", "drivers", "buses", "actual_fraction",
+                 "start_date", "seed")
+
+    def __init__(self, trips=50, stops=200, days=7, locations=10, departures_per_day=6,
+                 stops_per_trip=(4, 10), drivers=None, buses=None, actual_fraction=1.0,
+                 start_date="2025-01-06", seed=42):
+        self.trips = trips
+        self.stops = stops
+        self.days = days
+        self.locations = locations
+        self.departures_per_day = departures_per_day
+        self.stops_per_trip = stops_per_trip
+        # Enough drivers and buses that nobody works more than a few trips a day
+        self.drivers = drivers or max(1, trips * departures_per_day // 4)
+        self.buses = buses or max(1, trips * departures_per_day // 4)
+        self.actual_fraction = actual_fraction
+        self.start_date = start_date
+        self.seed = seed
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def location_name(index):
+    return f"City {index:03d}"
+
+
+def driver_name(index):
+    return f"Driver {index:05d}"
+
+
+def _next_free(free, start, end):
+    # free is a heap of (minute free from, index); books the one free the
+    # longest until end, or a new one when all are busy at start
+    free_from, index = free[0]
+    if free_from > start:
+        index = len(free)
+        heapq.heappush(free, (end, index))
+    else:
+        heapq.heapreplace(free, (end, index))
+    return index
+
+
+def generate(connection, spec):
+    # Deterministic for a given spec: the same seed always yields the same rows
+    rng = random.Random(spec.seed)
+    first_day = to_day_number(spec.start_date)
+    counts = {}
+
+    def insert(table, sql, rows):
+        cursor = connection.executemany(sql, rows)
+        counts[table] = counts.get(table, 0) + cursor.rowcount
+
+    # Every stop belongs to a location; trips run between the locations of
+    # their first and last stops, and shared stops allow transfers
+    stop_location = [i % spec.locations for i in range(spec.stops)]
+    insert("Stop", "INSERT INTO Stop VALUES (?, ?)",
+           ((ID_BASE + i, f"{100 + i} {STREETS[i % len(STREETS)]}, {location_name(stop_location[i])}")
+            for i in range(spec.stops)))
+
+    trip_stops = []
+    low, high = spec.stops_per_trip
+    for trip in range(spec.trips):
+        count = min(spec.stops, rng.randint(low, high))
+        trip_stops.append([ID_BASE + s for s in rng.sample(range(spec.stops), count)])
+
+    insert("Trip", "INSERT INTO Trip VALUES (?, ?, ?)",
+           ((ID_BASE + t, location_name(stop_location[stops[0] - ID_BASE]),
+             location_name(stop_location[stops[-1] - ID_BASE]))
+            for t, stops in enumerate(trip_stops)))
+
+    driving_times = [[rng.randint(3, 25) for _ in stops] for stops in trip_stops]
+    insert("TripStopInfo", "INSERT INTO TripStopInfo VALUES (?, ?, ?, ?)",
+           ((ID_BASE + t, stop, sequence + 1, driving_times[t][sequence])
+            for t, stops in enumerate(trip_stops)
+            for sequence, stop in enumerate(stops)))
+
+    # Departures are spread over 05:00-22:00. Each day's offerings are
+    # staffed in start order by whichever driver and bus have been free the
+    # longest, so nobody is booked onto two offerings at once; a late trip
+    # that runs past midnight keeps its driver and bus into the next day.
+    # spec.drivers and spec.buses are a minimum: when all of them are out at
+    # a busy moment, another is taken on.
+    offerings = []
+    free_drivers = [(0, i) for i in range(spec.drivers)]
+    free_buses = [(0, i) for i in range(spec.buses)]
+    for day in range(first_day, first_day + spec.days):
+        departures = sorted((departure, t) for t in range(spec.trips)
+                            for departure in rng.sample(range(300, 1320, 5), spec.departures_per_day))
+        for departure, t in departures:
+            duration = sum(driving_times[t])
+            start = (day - first_day) * 1440 + departure
+            driver = _next_free(free_drivers, start, start + duration)
+            bus = _next_free(free_buses, start, start + duration)
+            offerings.append((ID_BASE + t, day, departure, departure + duration,
+                              driver_name(driver), ID_BASE + bus))
+    insert("Driver", "INSERT INTO Driver VALUES (?, ?)",
+           ((driver_name(i), f"555-{i:05d}") for i in range(len(free_drivers))))
+    insert("Bus", "INSERT INTO Bus VALUES (?, ?, ?)",
+           ((ID_BASE + i,) + MODELS[i % len(MODELS)] for i in range(len(free_buses))))
+    insert("TripOfferingData", "INSERT INTO TripOfferingData VALUES (?, ?, ?, ?, ?, ?)",
+           offerings)
+
+    def actual_rows():
+        for trip, day, departure, _, _, _ in offerings:
+            if rng.random() >= spec.actual_fraction:
+                continue
+            t = trip - ID_BASE
+            scheduled = departure
+            actual = departure + rng.randint(-2, 6)
+            for sequence, stop in enumerate(trip_stops[t]):
+                scheduled += driving_times[t][sequence]
+                actual += max(1, driving_times[t][sequence] + rng.randint(-3, 5))
+                yield (trip, day, departure, stop, scheduled, actual - 1, actual,
+                       rng.randint(0, 30), rng.randint(0, 30))
+
+    insert("ActualTripStopData",
+           "INSERT INTO ActualTripStopData VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", actual_rows())
+
+    connection.commit()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill a transit database with synthetic data")
+    parser.add_argument("--db", required=True, help="Database file to fill")
+    parser.add_argument("--trips", type=int, default=50)
+    parser.add_argument("--stops", type=int, default=200)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--departures", type=int, default=6, help="Departures per trip per day")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    from app import setup_database
+    from db_pool import configure_pool
+
+    pool = configure_pool(args.db, size=1)
+    setup_database()
+    spec = FleetSpec(trips=args.trips, stops=args.stops, days=args.days,
+                     departures_per_day=args.departures, seed=args.seed)
+    with pool.connection() as connection:
+        counts = generate(connection, spec)
+    for table, count in counts.items():
+        print(f"{table}: {count}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Defaults can be overridden from the environment or with configure_pool()
+DEFAULT_DB_PATH = os.environ.get("POMONA_TRANSIT_DB", "pomona_transit.db")
+DEFAULT_POOL_SIZE = int(os.environ.get("POMONA_TRANSIT_POOL_SIZE", "4"))
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+DEFAULT_CHECKOUT_TIMEOUT = 30.0
+DEFAULT_JOURNAL_MODE = "WAL"
+DEFAULT_SYNCHRONOUS = "NORMAL"
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, db_path=DEFAULT_DB_PATH, size=DEFAULT_POOL_SIZE,
+                 busy_timeout_ms=DEFAULT_BUSY_TIMEOUT_MS, mmap_size=DEFAULT_MMAP_SIZE,
+                 checkout_timeout=DEFAULT_CHECKOUT_TIMEOUT, journal_mode=DEFAULT_JOURNAL_MODE,
+                 synchronous=DEFAULT_SYNCHRONOUS):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.db_path = db_path
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.mmap_size = mmap_size
+        self.checkout_timeout = checkout_timeout
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+        # Callables run on every checkout / checkin, e.g. for tracing
+        self._checkout_hooks = []
+        self._checkin_hooks = []
+
+        # Checkout statistics
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _connect(self):
+        # Connections are handed between threads, but only ever used by
+        # one thread at a time, so the same-thread check is disabled.
+        connection = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        # The journal mode is stored in the database file; leaving WAL only
+        # takes effect while no other connection has it open
+        connection.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        connection.execute(f"PRAGMA synchronous={self.synchronous}")
+        connection.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        connection.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+    def checkout(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = None
+
+        if connection is None:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    connection = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+                waited = 0.0
+            else:
+                started = time.perf_counter()
+                try:
+                    connection = self._idle.get(timeout=self.checkout_timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeout(
+                        f"No pooled connection available after {self.checkout_timeout}s"
+                    )
+                waited = time.perf_counter() - started
+        else:
+            waited = 0.0
+
+        with self._lock:
+            self._checkouts += 1
+            if waited > 0:
+                self._waits += 1
+                self._total_wait += waited
+                self._max_wait = max(self._max_wait, waited)
+        for hook in self._checkout_hooks:
+            hook(connection)
+        return connection
+
+    def checkin(self, connection):
+        for hook in self._checkin_hooks:
+            hook(connection)
+        # Never hand out a connection with a half-finished transaction
+        if connection.in_transaction:
+            connection.rollback()
+        if self._closed:
+            connection.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self.checkout()
+        try:
+            yield connection
+        finally:
+            self.checkin(connection)
+
+    def add_hooks(self, on_checkout=None, on_checkin=None):
+        if on_checkout is not None:
+            self._checkout_hooks.append(on_checkout)
+        if on_checkin is not None:
+            self._checkin_hooks.append(on_checkin)
+
+    def remove_hooks(self, on_checkout=None, on_checkin=None):
+        if on_checkout in self._checkout_hooks:
+            self._checkout_hooks.remove(on_checkout)
+        if on_checkin in self._checkin_hooks:
+            self._checkin_hooks.remove(on_checkin)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "db_path": self.db_path,
+                "size": self.size,
+                "created": self._created,
+                "idle": self._idle.qsize(),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "total_wait_seconds": self._total_wait,
+                "max_wait_seconds": self._max_wait,
+                "avg_wait_seconds": self._total_wait / self._waits if self._waits else 0.0,
+            }
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+            with self._lock:
+                self._created -= 1
+
+
+# === Process-wide pool ===
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure_pool(db_path=DEFAULT_DB_PATH, size=DEFAULT_POOL_SIZE, **options):
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(db_path, size, **options)
+        return _pool
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+
+def pooled_connection():
+    return get_pool().connection()
+
+
+def pool_stats():
+    return get_pool().stats()
@@ -0,0 +1,341 @@
+import argparse
+import csv
+import io
+import json
+import struct
+import sys
+import time
+from array import array
+
+from archive import table_source
+from db_pool import pooled_connection
+from timecodes import from_day_number, from_minute, to_day_number
+
+# Streaming export. Rows come off the cursor with fetchmany() in fixed-size
+# chunks and each chunk is written before the next is read, so memory stays
+# flat however many rows match. Every format gets the same columns, with
+# dates and times in the original text forms. Offerings and stop data are
+# read through archive.table_source(), so archived months are exported too.
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# Compact binary fallback for columnar output when pyarrow is missing
+BINARY_MAGIC = b"PTX1"
+INT_NULL = -(1 << 63)
+
+# Tables archive.py moves old months out of, named as {placeholders} in the
+# dataset FROM clauses
+HISTORY_TABLES = ("ActualTripStopData", "TripOfferingData")
+FIRST_DAY = -(1 << 31)
+LAST_DAY = (1 << 31) - 1
+
+
+def _date(value):
+    return None if value is None else from_day_number(value)
+
+
+def _time(value):
+    return None if value is None else from_minute(value)
+
+
+# Each dataset: (columns as (name, type, converter), FROM clause, filter columns)
+DATASETS = {
+    "actual": (
+        [("TripNumber", "int", None), ("Date", "text", _date), ("ScheduledStartTime", "text", _time),
+         ("StopNumber", "int", None), ("StopAddress", "text", None),
+         ("ScheduledArrivalTime", "text", _time), ("ActualStartTime", "text", _time),
+         ("ActualArrivalTime", "text", _time), ("NumberOfPassengerIn", "int", None),
+         ("NumberOfPassengerOut", "int", None)],
+        '''a.TripNumber, a.DayNumber, a.StartMinute, a.StopNumber, s.StopAddress,
+           a.ScheduledArrivalMinute, a.ActualStartMinute, a.ActualArrivalMinute,
+           a.NumberOfPassengerIn, a.NumberOfPassengerOut
+           FROM {ActualTripStopData} a
+           LEFT JOIN Stop s ON s.StopNumber = a.StopNumber''',
+        ("a.DayNumber", "a.TripNumber"),
+    ),
+    "schedule": (
+        [("TripNumber", "int", None), ("StartLocationName", "text", None),
+         ("DestinationName", "text", None), ("Date", "text", _date),
+         ("ScheduledStartTime", "text", _time), ("ScheduledArrivalTime", "text", _time),
+         ("DriverName", "text", None), ("BusID", "int", None)],
+        '''o.TripNumber, t.StartLocationName, t.DestinationName, o.DayNumber,
+           o.StartMinute, o.ArrivalMinute, o.DriverName, o.BusID
+           FROM {TripOfferingData} o
+           LEFT JOIN Trip t ON t.TripNumber = o.TripNumber''',
+        ("o.DayNumber", "o.TripNumber"),
+    ),
+    "trips": (
+        [("TripNumber", "int", None), ("StartLocationName", "text", None),
+         ("DestinationName", "text", None)],
+        "TripNumber, StartLocationName, DestinationName FROM Trip",
+        (None, "TripNumber"),
+    ),
+    "drivers": (
+        [("DriverName", "text", None), ("DriverTelephoneNumber", "text", None)],
+        "DriverName, DriverTelephoneNumber FROM Driver",
+        (None, None),
+    ),
+    "buses": (
+        [("BusID", "int", None), ("Model", "text", None), ("Year", "int", None)],
+        "BusID, Model, Year FROM Bus",
+        (None, None),
+    ),
+}
+
+
+def columns(dataset):
+    return [(name, kind) for name, kind, _ in DATASETS[dataset][0]]
+
+
+def _query(connection, dataset, first_date, last_date, trip_number):
+    # (sql, parameters); ValueError when the filters do not apply
+    _, source, (day_column, trip_column) = DATASETS[dataset]
+    conditions = []
+    parameters = []
+    first_day = None if first_date is None else to_day_number(first_date)
+    last_day = None if last_date is None else to_day_number(last_date)
+    if first_day is not None or last_day is not None:
+        if day_column is None:
+            raise ValueError(f"{dataset} cannot be filtered by date")
+        if first_day is not None:
+            conditions.append(f"{day_column} >= ?")
+            parameters.append(first_day)
+        if last_day is not None:
+            conditions.append(f"{day_column} <= ?")
+            parameters.append(last_day)
+    source = source.format(**{
+        table: table_source(connection, table, FIRST_DAY if first_day is None else first_day,
+                            LAST_DAY if last_day is None else last_day)
+        for table in HISTORY_TABLES if "{" + table + "}" in source})
+    if trip_number is not None:
+        if trip_column is None:
+            raise ValueError(f"{dataset} cannot be filtered by trip")
+        conditions.append(f"{trip_column} = ?")
+        parameters.append(trip_number)
+
+    sql = "SELECT " + source
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return sql, parameters
+
+
+def iter_chunks(connection, dataset, first_date=None, last_date=None, trip_number=None,
+                chunk_size=DEFAULT_CHUNK_SIZE):
+    # Returns an iterator of lists of at most chunk_size converted rows. The
+    # filters are checked here, before anything is read or written.
+    sql, parameters = _query(connection, dataset, first_date, last_date, trip_number)
+    return _chunks(connection, DATASETS[dataset][0], sql, parameters, chunk_size)
+
+
+def _chunks(connection, spec, sql, parameters, chunk_size):
+    converters = [(i, convert) for i, (_, _, convert) in enumerate(spec) if convert is not None]
+    cursor = connection.execute(sql, parameters)
+    cursor.arraysize = chunk_size
+    while True:
+        rows = cursor.fetchmany()
+        if not rows:
+            break
+        if converters:
+            rows = [list(row) for row in rows]
+            for row in rows:
+                for i, convert in converters:
+                    row[i] = convert(row[i])
+        yield rows
+
+
+# === Writers ===
+# Each takes the open binary output, the dataset's columns and the chunk
+# iterator, and returns the number of rows written.
+
+def write_csv(output, spec, chunks):
+    text = _text(output)
+    writer = csv.writer(text)
+    writer.writerow([name for name, _ in spec])
+    count = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        count += len(rows)
+    text.flush()
+    text.detach()
+    return count
+
+
+def write_jsonl(output, spec, chunks):
+    text = _text(output)
+    names = [name for name, _ in spec]
+    count = 0
+    for rows in chunks:
+        text.write("".join(json.dumps(dict(zip(names, row))) + "\n" for row in rows))
+        count += len(rows)
+    text.flush()
+    text.detach()
+    return count
+
+
+def _text(output):
+    return io.TextIOWrapper(output, encoding="utf-8", newline="")
+
+
+def _arrow_schema(pyarrow, spec):
+    types = {"int": pyarrow.int64(), "text": pyarrow.string()}
+    return pyarrow.schema([(name, types[kind]) for name, kind in spec])
+
+
+def _arrow_batches(pyarrow, schema, chunks):
+    for rows in chunks:
+        yield pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array(column, type=field.type) for column, field in zip(zip(*rows), schema)],
+            schema=schema)
+
+
+def write_parquet(output, spec, chunks):
+    import pyarrow
+    import pyarrow.parquet
+    schema = _arrow_schema(pyarrow, spec)
+    count = 0
+    with pyarrow.parquet.ParquetWriter(output, schema) as writer:
+        for batch in _arrow_batches(pyarrow, schema, chunks):
+            # One row group per chunk
+            writer.write_batch(batch)
+            count += batch.num_rows
+    return count
+
+
+def write_arrow(output, spec, chunks):
+    import pyarrow
+    import pyarrow.ipc
+    schema = _arrow_schema(pyarrow, spec)
+    count = 0
+    with pyarrow.ipc.new_file(output, schema) as writer:
+        for batch in _arrow_batches(pyarrow, schema, chunks):
+            writer.write_batch(batch)
+            count += batch.num_rows
+    return count
+
+
+def write_binary(output, spec, chunks):
+    # Layout: magic, a length-prefixed JSON header with the columns, then one
+    # block per chunk: row count, and per column either int64 values (NULL as
+    # INT_NULL) or uint32 byte lengths (0xFFFFFFFF for NULL) followed by UTF-8
+    # text. A zero row count ends the file.
+    header = json.dumps({"columns": spec}).encode()
+    output.write(BINARY_MAGIC + struct.pack("<I", len(header)) + header)
+    count = 0
+    for rows in chunks:
+        output.write(struct.pack("<I", len(rows)))
+        for (_, kind), values in zip(spec, zip(*rows)):
+            if kind == "int":
+                output.write(array("q", (INT_NULL if value is None else value for value in values)).tobytes())
+            else:
+                encoded = [None if value is None else str(value).encode() for value in values]
+                lengths = array("I", (0xFFFFFFFF if value is None else len(value) for value in encoded))
+                output.write(lengths.tobytes())
+                output.write(b"".join(value for value in encoded if value is not None))
+        count += len(rows)
+    output.write(struct.pack("<I", 0))
+    return count
+
+
+def read_binary(path):
+    # Yields rows back out of a write_binary file, one chunk at a time
+    with open(path, "rb") as handle:
+        if handle.read(4) != BINARY_MAGIC:
+            raise ValueError(f"{path} is not a binary transit export")
+        (length,) = struct.unpack("<I", handle.read(4))
+        spec = json.loads(handle.read(length))["columns"]
+        while True:
+            (count,) = struct.unpack("<I", handle.read(4))
+            if count == 0:
+                return
+            columns_read = []
+            for _, kind in spec:
+                if kind == "int":
+                    values = array("q")
+                    values.frombytes(handle.read(8 * count))
+                    columns_read.append([None if value == INT_NULL else value for value in values])
+                else:
+                    lengths = array("I")
+                    lengths.frombytes(handle.read(4 * count))
+                    data = handle.read(sum(n for n in lengths if n != 0xFFFFFFFF))
+                    texts = []
+                    offset = 0
+                    for n in lengths:
+                        if n == 0xFFFFFFFF:
+                            texts.append(None)
+                        else:
+                            texts.append(data[offset:offset + n].decode())
+                            offset += n
+                    columns_read.append(texts)
+            yield from zip(*columns_read)
+
+
+WRITERS = {
+    "csv": write_csv,
+    "jsonl": write_jsonl,
+    "parquet": write_parquet,
+    "arrow": write_arrow,
+    "binary": write_binary,
+}
+
+
+def columnar_format():
+    # Parquet when pyarrow is installed, otherwise the binary fallback
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return "binary"
+    return "parquet"
+
+
+def export(dataset, format, output, first_date=None, last_date=None, trip_number=None,
+           chunk_size=DEFAULT_CHUNK_SIZE):
+    # output is a path, or "-" for stdout. Returns the number of rows written.
+    if format == "columnar":
+        format = columnar_format()
+    writer = WRITERS[format]
+    spec = columns(dataset)
+    with pooled_connection() as connection:
+        # Raises on a bad filter before the output is opened and truncated
+        chunks = iter_chunks(connection, dataset, first_date, last_date, trip_number, chunk_size)
+        if output == "-":
+            count = writer(sys.stdout.buffer, spec, chunks)
+            sys.stdout.buffer.flush()
+            return count
+        with open(output, "wb") as handle:
+            return writer(handle, spec, chunks)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream transit data to a file")
+    parser.add_argument("dataset", choices=list(DATASETS))
+    parser.add_argument("format", choices=list(WRITERS) + ["columnar"],
+                        help="columnar picks parquet if pyarrow is installed, else binary")
+    parser.add_argument("output", help="Output file, or - for stdout")
+    parser.add_argument("--from", dest="first_date", help="First date (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="last_date", help="Last date (YYYY-MM-DD)")
+    parser.add_argument("--trip", type=int, help="Only this trip number")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--db", help="Database file (defaults to POMONA_TRANSIT_DB)")
+    args = parser.parse_args(argv)
+
+    from app import setup_database
+    from db_pool import configure_pool
+
+    if args.db:
+        configure_pool(args.db, size=1)
+    setup_database()
+
+    started = time.perf_counter()
+    try:
+        count = export(args.dataset, args.format, args.output, args.first_date,
+                       args.last_date, args.trip, args.chunk_size)
+    except (ValueError, ImportError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - started
+    print(f"{count} rows exported in {elapsed:.1f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
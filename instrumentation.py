@@ -0,0 +1,372 @@
+import atexit
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import snapshot
+import writer
+from db_pool import get_pool
+
+# Opt-in: nothing here runs until enable() is called (or the environment
+# variable POMONA_TRANSIT_INSTRUMENT is set when app.py starts).
+
+INSTRUMENTED_FUNCTIONS = [
+    "display_schedule", "display_trip_stops", "display_driver_weekly_schedule",
+    "display_actual_trip_data", "display_all_trips", "display_all_drivers",
+    "display_all_buses", "display_locations", "display_all_trip_offerings",
+    "display_departure_board",
+    "add_driver", "add_bus", "add_trip_offering", "record_actual_trip_data",
+    "delete_trip", "delete_bus", "delete_driver",
+]
+
+# Prometheus histogram bucket bounds, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_SAMPLES = 10000
+PROGRESS_INTERVAL = 1000
+
+DEFAULT_SLOW_QUERY_MS = 50.0
+DEFAULT_SLOW_SAMPLE_LIMIT = 50
+
+
+class Histogram:
+    # Cumulative bucket counts for export plus a bounded ring of raw samples
+    # for percentiles
+    __slots__ = ("bucket_counts", "count", "total", "samples", "_next")
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.samples = []
+        self._next = 0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(seconds)
+        else:
+            self.samples[self._next] = seconds
+            self._next = (self._next + 1) % MAX_SAMPLES
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class FunctionStats:
+    __slots__ = ("latency", "rows", "errors")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.rows = 0
+        self.errors = 0
+
+
+class StatementStats:
+    __slots__ = ("function", "count", "total", "max", "vm_steps")
+
+    def __init__(self, function):
+        self.function = function
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.vm_steps = 0
+
+
+class _OpenStatement:
+    __slots__ = ("sql", "function", "started", "steps")
+
+    def __init__(self, sql, function, started):
+        self.sql = sql
+        self.function = function
+        self.started = started
+        self.steps = 0
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def normalize_sql(sql):
+    # Traced SQL has the bound values expanded; fold them back to ? so
+    # executions of the same statement aggregate together
+    return _LITERALS.sub("?", " ".join(sql.split()))
+
+
+class Instrumentation:
+    def __init__(self, slow_query_ms=DEFAULT_SLOW_QUERY_MS, slow_sample_limit=DEFAULT_SLOW_SAMPLE_LIMIT):
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.slow_sample_limit = slow_sample_limit
+        self.functions = {}
+        self.statements = {}
+        self.slow_samples = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._open = {}
+        self._originals = {}
+        self._pool = None
+        self._plans = {}
+
+    # === Function timing ===
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def wrap(self, name, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            stack = self._stack()
+            stack.append(name)
+            started = time.perf_counter()
+            failed = False
+            try:
+                result = function(*args, **kwargs)
+                return result
+            except Exception:
+                failed = True
+                result = None
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                stack.pop()
+                self._record_call(name, elapsed, result, failed)
+        wrapper.__instrumented__ = function
+        return wrapper
+
+    def _caller_context(self):
+        # Runs on the thread queuing a write (writer.py); the operation then
+        # runs on the writer thread as if inside the same function
+        stack = self._stack()
+        return self._running_as(stack[-1] if stack else None)
+
+    @contextmanager
+    def _running_as(self, name):
+        stack = self._stack()
+        stack.append(name)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    def _record_call(self, name, elapsed, result, failed):
+        if isinstance(result, (list, tuple)):
+            rows = len(result)
+        else:
+            rows = 0
+        with self._lock:
+            stats = self.functions.get(name)
+            if stats is None:
+                stats = self.functions[name] = FunctionStats()
+            stats.latency.observe(elapsed)
+            stats.rows += rows
+            stats.errors += failed
+
+    # === Statement tracing ===
+    def _on_checkout(self, connection):
+        key = id(connection)
+
+        def trace(sql):
+            # Statements run by triggers are reported with a leading comment
+            if sql.startswith("--"):
+                return
+            now = time.perf_counter()
+            self._finish(key, now)
+            stack = self._stack()
+            self._open[key] = _OpenStatement(sql, stack[-1] if stack else None, now)
+
+        def progress():
+            statement = self._open.get(key)
+            if statement is not None:
+                statement.steps += PROGRESS_INTERVAL
+            return 0
+
+        connection.set_trace_callback(trace)
+        connection.set_progress_handler(progress, PROGRESS_INTERVAL)
+
+    def _on_checkin(self, connection):
+        connection.set_trace_callback(None)
+        connection.set_progress_handler(None, 0)
+        self._finish(id(connection), time.perf_counter())
+
+    def _finish(self, key, now):
+        # A statement is timed from its trace callback until the next
+        # statement starts or the connection goes back to the pool, so the
+        # time spent stepping through its rows is included
+        statement = self._open.pop(key, None)
+        if statement is None:
+            return
+        elapsed = now - statement.started
+        normalized = normalize_sql(statement.sql)
+        with self._lock:
+            stats = self.statements.get(normalized)
+            if stats is None:
+                stats = self.statements[normalized] = StatementStats(statement.function)
+            stats.count += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.vm_steps += statement.steps
+            if elapsed >= self.slow_query_seconds:
+                self.slow_samples.append((statement.function, statement.sql, elapsed))
+                if len(self.slow_samples) > self.slow_sample_limit:
+                    # Keep the slowest samples
+                    self.slow_samples.sort(key=lambda sample: sample[2], reverse=True)
+                    del self.slow_samples[self.slow_sample_limit:]
+
+    # === Install / remove ===
+    def install(self, module, pool=None):
+        for name in INSTRUMENTED_FUNCTIONS:
+            function = getattr(module, name, None)
+            if function is None or hasattr(function, "__instrumented__"):
+                continue
+            self._originals[(module, name)] = function
+            setattr(module, name, self.wrap(name, function))
+        self._pool = pool or get_pool()
+        self._pool.add_hooks(self._on_checkout, self._on_checkin)
+        snapshot.add_reader_hooks(self._on_checkout, self._on_checkin)
+        writer.add_context_hook(self._caller_context)
+
+    def uninstall(self):
+        for (module, name), function in self._originals.items():
+            setattr(module, name, function)
+        self._originals.clear()
+        if self._pool is not None:
+            self._pool.remove_hooks(self._on_checkout, self._on_checkin)
+            snapshot.remove_reader_hooks(self._on_checkout, self._on_checkin)
+            writer.remove_context_hook(self._caller_context)
+            self._pool = None
+
+    # === Reports ===
+    def query_plan(self, sql):
+        # Plans are taken on a separate connection, never inside a callback
+        if sql not in self._plans:
+            db_path = self._pool.db_path if self._pool else get_pool().db_path
+            connection = sqlite3.connect(db_path)
+            try:
+                rows = connection.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+                self._plans[sql] = [row[3] for row in rows]
+            except sqlite3.Error as e:
+                self._plans[sql] = [f"(no plan: {e})"]
+            finally:
+                connection.close()
+        return self._plans[sql]
+
+    def text_report(self):
+        lines = ["=== Function latency ===",
+                 "Function | Calls | p50 ms | p95 ms | p99 ms | Rows | Errors",
+                 "-" * 80]
+        with self._lock:
+            functions = sorted(self.functions.items(), key=lambda item: -item[1].latency.total)
+            statements = sorted(self.statements.items(), key=lambda item: -item[1].total)
+            slow = list(self.slow_samples)
+        for name, stats in functions:
+            latency = stats.latency
+            lines.append(
+                f"{name} | {latency.count} | {latency.percentile(0.50) * 1000:.3f} | "
+                f"{latency.percentile(0.95) * 1000:.3f} | {latency.percentile(0.99) * 1000:.3f} | "
+                f"{stats.rows} | {stats.errors}")
+
+        lines += ["", "=== Statements (by total time) ===",
+                  "Total ms | Calls | Avg ms | Max ms | VM steps | Function | SQL",
+                  "-" * 80]
+        for sql, stats in statements:
+            lines.append(
+                f"{stats.total * 1000:.3f} | {stats.count} | {stats.total / stats.count * 1000:.3f} | "
+                f"{stats.max * 1000:.3f} | {stats.vm_steps} | {stats.function} | {sql}")
+
+        lines += ["", f"=== Slow statements (>= {self.slow_query_seconds * 1000:.0f} ms) ==="]
+        for function, sql, elapsed in sorted(slow, key=lambda sample: -sample[2]):
+            lines.append(f"{elapsed * 1000:.3f} ms in {function}: {' '.join(sql.split())}")
+            for detail in self.query_plan(sql):
+                lines.append(f"    {detail}")
+        return "\n".join(lines) + "\n"
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP transit_function_seconds Latency of app.py transaction functions",
+            "# TYPE transit_function_seconds histogram",
+        ]
+        with self._lock:
+            functions = sorted(self.functions.items())
+            statements = sorted(self.statements.items())
+        for name, stats in functions:
+            latency = stats.latency
+            for bound, count in zip(BUCKETS, latency.bucket_counts):
+                lines.append(f'transit_function_seconds_bucket{{function="{name}",le="{bound}"}} {count}')
+            lines.append(f'transit_function_seconds_bucket{{function="{name}",le="+Inf"}} {latency.count}')
+            lines.append(f'transit_function_seconds_sum{{function="{name}"}} {latency.total}')
+            lines.append(f'transit_function_seconds_count{{function="{name}"}} {latency.count}')
+
+        lines += ["# HELP transit_function_rows_total Rows returned by transaction functions",
+                  "# TYPE transit_function_rows_total counter"]
+        lines += [f'transit_function_rows_total{{function="{name}"}} {stats.rows}'
+                  for name, stats in functions]
+        lines += ["# HELP transit_function_errors_total Exceptions raised by transaction functions",
+                  "# TYPE transit_function_errors_total counter"]
+        lines += [f'transit_function_errors_total{{function="{name}"}} {stats.errors}'
+                  for name, stats in functions]
+
+        labels = [(f'function="{stats.function}",sql="'
+                   + sql.replace("\\", "\\\\").replace('"', '\\"') + '"', stats)
+                  for sql, stats in statements]
+        lines += ["# HELP transit_statement_seconds_total Time spent per SQL statement",
+                  "# TYPE transit_statement_seconds_total counter"]
+        lines += [f"transit_statement_seconds_total{{{label}}} {stats.total}" for label, stats in labels]
+        lines += ["# HELP transit_statement_calls_total Executions per SQL statement",
+                  "# TYPE transit_statement_calls_total counter"]
+        lines += [f"transit_statement_calls_total{{{label}}} {stats.count}" for label, stats in labels]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        # Prometheus text for .prom files, the text report otherwise
+        text = self.prometheus_text() if path.endswith(".prom") else self.text_report()
+        with open(path, "w") as handle:
+            handle.write(text)
+
+
+# === Process-wide instance ===
+_active = None
+
+
+def enable(module=None, pool=None, **options):
+    global _active
+    if _active is not None:
+        return _active
+    if module is None:
+        import app as module
+    _active = Instrumentation(**options)
+    _active.install(module, pool)
+    return _active
+
+
+def disable():
+    global _active
+    if _active is not None:
+        _active.uninstall()
+        _active = None
+
+
+def active():
+    return _active
+
+
+def enable_from_environment(module=None):
+    # POMONA_TRANSIT_INSTRUMENT=1 turns tracing on; the report is written at
+    # exit to POMONA_TRANSIT_METRICS_FILE (".prom" for Prometheus text)
+    if not os.environ.get("POMONA_TRANSIT_INSTRUMENT"):
+        return None
+    slow_ms = float(os.environ.get("POMONA_TRANSIT_SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS))
+    instrumentation = enable(module, slow_query_ms=slow_ms)
+    path = os.environ.get("POMONA_TRANSIT_METRICS_FILE", "transit_metrics.txt")
+    atexit.register(instrumentation.dump, path)
+    return instrumentation
@@ -0,0 +1,304 @@
+import argparse
+import sys
+from array import array
+from bisect import bisect_left
+
+from db_pool import pooled_connection
+from query_cache import schedule_cache
+from service_calendar import offerings_source
+from timecodes import from_day_number, from_minute, to_day_number, to_minute
+
+# Journeys are planned with the Connection Scan Algorithm. A "connection" is
+# one hop of one trip offering: leave a place at a minute, reach the next
+# place at a later minute. Every offering runs
+#
+#     StartLocationName -> stop 1 -> ... -> stop n -> DestinationName
+#
+# with stop i reached at StartMinute plus the running sum of DrivingTime, so
+# riders can change buses at a shared location or at a shared stop. All of a
+# day's connections (explicit offerings and pattern departures) are built
+# once, sorted by departure, and kept in schedule_cache under the same tags
+# as the schedule reads, so adding or deleting offerings drops them too.
+#
+# An arrival before the start is on the next day, so an overnight offering
+# runs on past minute 1440 and its later times read 24:00 and up, as in GTFS
+# stop_times.txt.
+
+DEFAULT_MIN_TRANSFER = 5
+DEFAULT_MAX_TRANSFERS = 3
+INFINITY = 1 << 30
+
+
+class ConnectionTimetable:
+    __slots__ = ("day", "places", "place_index", "offerings",
+                 "departure_place", "arrival_place", "departure", "arrival", "offering")
+
+    def __init__(self, day):
+        self.day = day
+        self.places = []        # ("location", name) or ("stop", number, address)
+        self.place_index = {}   # key of each place -> its index in places
+        self.offerings = []     # (TripNumber, StartMinute) per offering index
+        self.departure_place = array("i")
+        self.arrival_place = array("i")
+        self.departure = array("i")
+        self.arrival = array("i")
+        self.offering = array("i")
+
+    def place(self, key, details):
+        index = self.place_index.get(key)
+        if index is None:
+            index = self.place_index[key] = len(self.places)
+            self.places.append(details)
+        return index
+
+    def location(self, name):
+        return self.place_index.get(("location", name))
+
+    def stop(self, stop_number):
+        return self.place_index.get(("stop", stop_number))
+
+    def describe(self, index):
+        place = self.places[index]
+        if place[0] == "location":
+            return place[1]
+        return f"Stop {place[1]} ({place[2]})"
+
+    def __len__(self):
+        return len(self.departure)
+
+
+def build_timetable(connection, day):
+    timetable = ConnectionTimetable(day)
+    offerings = connection.execute(f'''
+        SELECT o.TripNumber, o.StartMinute, o.ArrivalMinute,
+               t.StartLocationName, t.DestinationName
+        FROM {offerings_source(connection, day)} o
+        JOIN Trip t ON t.TripNumber = o.TripNumber
+        WHERE o.DayNumber = ?
+        ORDER BY o.StartMinute
+    ''', (day,)).fetchall()
+
+    routes = {}
+    for trip in {row[0] for row in offerings}:
+        routes[trip] = connection.execute('''
+            SELECT tsi.StopNumber, s.StopAddress, tsi.DrivingTime
+            FROM TripStopInfo tsi
+            JOIN Stop s ON s.StopNumber = tsi.StopNumber
+            WHERE tsi.TripNumber = ?
+            ORDER BY tsi.SequenceNumber
+        ''', (trip,)).fetchall()
+
+    hops = []
+    for trip, start, arrival, origin, destination in offerings:
+        if arrival is None:
+            continue
+        if arrival < start:
+            arrival += 1440
+        index = len(timetable.offerings)
+        timetable.offerings.append((trip, start))
+
+        # Stop times are clamped into [start, arrival] so a route whose
+        # driving times overrun the scheduled arrival still scans in order
+        events = [(timetable.place(("location", origin), ("location", origin)), start)]
+        minute = start
+        for stop, address, driving_time in routes[trip]:
+            minute = min(arrival, minute + (driving_time or 0))
+            events.append((timetable.place(("stop", stop), ("stop", stop, address)), minute))
+        events.append((timetable.place(("location", destination), ("location", destination)), arrival))
+
+        for sequence in range(len(events) - 1):
+            (from_place, leave), (to_place, reach) = events[sequence], events[sequence + 1]
+            if from_place != to_place:
+                hops.append((leave, reach, index, sequence, from_place, to_place))
+
+    # Within one offering, zero-length hops keep their route order
+    hops.sort()
+    for leave, reach, index, _, from_place, to_place in hops:
+        timetable.departure.append(leave)
+        timetable.arrival.append(reach)
+        timetable.offering.append(index)
+        timetable.departure_place.append(from_place)
+        timetable.arrival_place.append(to_place)
+    return timetable
+
+
+def get_timetable(date):
+    day = to_day_number(date)
+    key = ("connection_timetable", day)
+    timetable = schedule_cache.get(key)
+    if timetable is None:
+        generation = schedule_cache.generation
+        with pooled_connection() as connection:
+            timetable = build_timetable(connection, day)
+        tags = [("day", day)] + [("trip", trip) for trip in {trip for trip, _ in timetable.offerings}]
+        schedule_cache.put(key, timetable, tags, generation)
+    return timetable
+
+
+def _resolve(timetable, place):
+    # Locations are given by name, stops by number
+    if isinstance(place, int):
+        index = timetable.stop(place)
+    else:
+        index = timetable.location(place)
+    if index is None:
+        raise ValueError(f"No service at {place!r} on {from_day_number(timetable.day)}")
+    return index
+
+
+def scan(timetable, origin, target, depart_after, min_transfer, max_trips):
+    # Round k finds the earliest arrival anywhere using at most k offerings.
+    # A round may board an offering only from places reached in the previous
+    # round, so the rounds give the Pareto set of (arrival, transfers).
+    departure = timetable.departure
+    arrival = timetable.arrival
+    departure_place = timetable.departure_place
+    arrival_place = timetable.arrival_place
+    offering = timetable.offering
+    first = bisect_left(departure, depart_after)
+    count = len(departure)
+
+    previous = [INFINITY] * len(timetable.places)
+    previous[origin] = depart_after
+    previous_legs = {}
+    rounds = []
+    for _ in range(max_trips):
+        current = list(previous)
+        legs = dict(previous_legs)
+        boarded = {}
+        improved = False
+        for i in range(first, count):
+            leave = departure[i]
+            # Nothing leaving after the best arrival so far can beat it
+            if leave >= current[target]:
+                break
+            trip = offering[i]
+            boarded_at = boarded.get(trip)
+            if boarded_at is None:
+                place = departure_place[i]
+                reached = previous[place]
+                if place != origin:
+                    reached += min_transfer
+                if reached > leave:
+                    continue
+                boarded[trip] = boarded_at = i
+            place = arrival_place[i]
+            if arrival[i] < current[place]:
+                current[place] = arrival[i]
+                legs[place] = (boarded_at, i)
+                improved = True
+        rounds.append((current[target], legs))
+        if not improved:
+            break
+        previous, previous_legs = current, legs
+    return rounds
+
+
+def _itinerary(timetable, rounds, trips, origin, target):
+    legs = []
+    place = target
+    for k in range(trips - 1, -1, -1):
+        board, alight = rounds[k][1][place]
+        trip, start = timetable.offerings[timetable.offering[board]]
+        legs.append({
+            "trip_number": trip,
+            "scheduled_start": from_minute(start),
+            "board_at": timetable.describe(timetable.departure_place[board]),
+            "departs": from_minute(timetable.departure[board]),
+            "alight_at": timetable.describe(timetable.arrival_place[alight]),
+            "arrives": from_minute(timetable.arrival[alight]),
+        })
+        place = timetable.departure_place[board]
+        if place == origin:
+            break
+    legs.reverse()
+    return {
+        "departs": legs[0]["departs"],
+        "arrives": legs[-1]["arrives"],
+        "transfers": len(legs) - 1,
+        "legs": legs,
+    }
+
+
+def plan_journey(origin, destination, date, depart_after="00:00",
+                 min_transfer=DEFAULT_MIN_TRANSFER, max_transfers=DEFAULT_MAX_TRANSFERS):
+    # origin and destination are location names or stop numbers. Returns the
+    # earliest-arrival and fewest-transfer itineraries (the same one when a
+    # direct trip is also the fastest) plus every other Pareto-optimal option.
+    timetable = get_timetable(date)
+    source = _resolve(timetable, origin)
+    target = _resolve(timetable, destination)
+    if source == target:
+        raise ValueError("Origin and destination are the same place")
+
+    rounds = scan(timetable, source, target, to_minute(depart_after),
+                  min_transfer, max_transfers + 1)
+
+    options = []
+    best = INFINITY
+    for k, (arrival, legs) in enumerate(rounds):
+        if arrival < best:
+            best = arrival
+            # Trace back from the round that first reached this arrival
+            options.append(_itinerary(timetable, rounds, k + 1, source, target))
+
+    return {
+        "earliest_arrival": options[-1] if options else None,
+        "fewest_transfers": options[0] if options else None,
+        "options": options,
+    }
+
+
+def print_journey(result):
+    if not result["options"]:
+        print("No journey found.")
+        return
+    for option in result["options"]:
+        labels = []
+        if option is result["earliest_arrival"]:
+            labels.append("earliest arrival")
+        if option is result["fewest_transfers"]:
+            labels.append("fewest transfers")
+        print(f"\n{option['departs']} -> {option['arrives']}, "
+              f"{option['transfers']} transfer(s) [{', '.join(labels)}]")
+        print("Trip # | Board At | Departs | Alight At | Arrives")
+        print("-" * 70)
+        for leg in option["legs"]:
+            print(f"{leg['trip_number']:^6} | {leg['board_at']} | {leg['departs']} | "
+                  f"{leg['alight_at']} | {leg['arrives']}")
+
+
+def _place_argument(value):
+    return int(value) if value.isdigit() else value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plan a journey across trip offerings")
+    parser.add_argument("origin", type=_place_argument, help="Location name or stop number")
+    parser.add_argument("destination", type=_place_argument, help="Location name or stop number")
+    parser.add_argument("date", help="YYYY-MM-DD")
+    parser.add_argument("--after", default="00:00", help="Earliest departure (HH:MM)")
+    parser.add_argument("--min-transfer", type=int, default=DEFAULT_MIN_TRANSFER)
+    parser.add_argument("--max-transfers", type=int, default=DEFAULT_MAX_TRANSFERS)
+    parser.add_argument("--db", help="Database file (defaults to POMONA_TRANSIT_DB)")
+    args = parser.parse_args(argv)
+
+    from app import setup_database
+    from db_pool import configure_pool
+
+    if args.db:
+        configure_pool(args.db, size=1)
+    setup_database()
+
+    try:
+        result = plan_journey(args.origin, args.destination, args.date, args.after,
+                              args.min_transfer, args.max_transfers)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    print_journey(result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
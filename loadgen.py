@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import json
+import random
+import sqlite3
+import sys
+import time
+from urllib.parse import quote, urlencode
+
+from timecodes import from_day_number, from_minute
+
+# Load generator for server.py. Opens `concurrency` keep-alive connections
+# and has each send read requests back to back for `duration` seconds, with
+# arguments drawn from the server's own database (opened read-only), then
+# reports requests/sec and the latency distribution per endpoint.
+
+DEFAULT_CONCURRENCY = 32
+DEFAULT_DURATION = 10.0
+SAMPLE_SIZE = 2000
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "requests": len(ordered),
+        "p50_ms": _percentile(ordered, 0.50) * 1000,
+        "p95_ms": _percentile(ordered, 0.95) * 1000,
+        "p99_ms": _percentile(ordered, 0.99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def sample_targets(db_path, seed=7):
+    # {endpoint: [path, ...]} for the endpoints that have data to ask about
+    rng = random.Random(seed)
+    connection = sqlite3.connect(f"file:{quote(db_path)}?mode=ro", uri=True)
+    try:
+        offerings = connection.execute('''
+            SELECT o.TripNumber, o.DayNumber, o.StartMinute, o.DriverName,
+                   t.StartLocationName, t.DestinationName
+            FROM (SELECT * FROM TripOfferingData ORDER BY random() LIMIT ?) o
+            JOIN Trip t ON t.TripNumber = o.TripNumber
+        ''', (SAMPLE_SIZE,)).fetchall()
+        actual = connection.execute(
+            "SELECT TripNumber, DayNumber, StartMinute FROM ActualTripStopData ORDER BY random() LIMIT ?",
+            (SAMPLE_SIZE,)).fetchall()
+        stops = connection.execute(
+            "SELECT StopNumber, DayNumber FROM ScheduledStopTime ORDER BY random() LIMIT ?",
+            (SAMPLE_SIZE,)).fetchall()
+    finally:
+        connection.close()
+
+    targets = {
+        "schedule": [
+            "/schedule?" + urlencode({"from": origin, "to": destination, "date": from_day_number(day)})
+            for _, day, _, _, origin, destination in offerings],
+        "trip_stops": [f"/trips/{trip}/stops" for trip, *_ in offerings],
+        "driver_week": [
+            f"/drivers/{quote(driver)}/week?" + urlencode({"start": from_day_number(day - rng.randrange(7))})
+            for _, day, _, driver, _, _ in offerings],
+        "actual": [
+            "/actual?" + urlencode({"trip": trip, "date": from_day_number(day), "start": from_minute(start)})
+            for trip, day, start in actual],
+        "departures": [
+            "/departures?" + urlencode({"stop": stop, "date": from_day_number(day),
+                                        "after": from_minute(rng.randrange(1440))})
+            for stop, day in stops],
+    }
+    return {endpoint: paths for endpoint, paths in targets.items() if paths}
+
+
+async def request(reader, writer, host, path):
+    # Returns (status, body bytes, whether the server is closing the connection)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return status, body, headers.get("connection", "").lower() == "close"
+
+
+async def client(host, port, targets, deadline, rng, results):
+    endpoints = list(targets)
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        endpoint = rng.choice(endpoints)
+        path = rng.choice(targets[endpoint])
+        if writer is None:
+            reader, writer = await asyncio.open_connection(host, port)
+        started = time.perf_counter()
+        try:
+            status, _, closing = await request(reader, writer, host, path)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            status, closing = None, True
+        if closing:
+            writer.close()
+            writer = None
+        elapsed = time.perf_counter() - started
+        results.append((endpoint, status, elapsed))
+        if status == 503:
+            # Honour the server's backpressure instead of hammering it
+            await asyncio.sleep(0.01)
+    if writer is not None:
+        writer.close()
+
+
+async def run(host, port, targets, concurrency, duration, seed):
+    results = []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(client(host, port, targets, deadline, random.Random(seed + i), results)
+                           for i in range(concurrency)))
+    return results, time.perf_counter() - started
+
+
+def report(results, elapsed):
+    statuses = {}
+    by_endpoint = {}
+    for endpoint, status, seconds in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        by_endpoint.setdefault(endpoint, []).append(seconds)
+    ok = [seconds for _, status, seconds in results if status is not None and status < 500]
+    return {
+        "elapsed_seconds": elapsed,
+        "requests": len(results),
+        "requests_per_second": len(results) / elapsed if elapsed else 0.0,
+        "statuses": statuses,
+        "latency": summarize(ok) if ok else None,
+        "endpoints": {endpoint: summarize(samples) for endpoint, samples in sorted(by_endpoint.items())},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive server.py with concurrent read requests")
+    parser.add_argument("--db", required=True, help="The server's database file, to draw arguments from")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Connections, each with one request outstanding")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="Seconds to run")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        targets = sample_targets(args.db, args.seed)
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+        return 1
+    if not targets:
+        print("Error: The database has no offerings to request.")
+        return 1
+
+    try:
+        results, elapsed = asyncio.run(run(args.host, args.port, targets, args.concurrency,
+                                           args.duration, args.seed))
+    except OSError as e:
+        print(f"Error: {e}")
+        return 1
+    summary = report(results, elapsed)
+
+    print(f"{summary['requests']} requests in {elapsed:.1f}s: "
+          f"{summary['requests_per_second']:.0f} requests/sec")
+    print("Statuses: " + ", ".join(f"{status}={count}" for status, count in sorted(summary["statuses"].items())))
+    print("Endpoint | requests | p50 ms | p95 ms | p99 ms | max ms")
+    print("-" * 60)
+    rows = list(summary["endpoints"].items())
+    if summary["latency"]:
+        rows.append(("all (non-5xx)", summary["latency"]))
+    for endpoint, timing in rows:
+        print(f"{endpoint} | {timing['requests']} | {timing['p50_ms']:.2f} | {timing['p95_ms']:.2f} | "
+              f"{timing['p99_ms']:.2f} | {timing['max_ms']:.2f}")
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(summary, handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,485 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import app
+from bookings import BookingConflict, booking_index
+from datagen import ID_BASE, FleetSpec, driver_name, generate
+from db_pool import PoolTimeout, configure_pool, get_pool, pooled_connection
+from query_cache import schedule_cache
+from telemetry import write_stop_rows
+from timecodes import from_day_number, to_day_number
+from writer import get_writer
+
+# Mixed-workload load test. Reader workers run display_schedule and
+# display_driver_weekly_schedule while writer workers add offerings, record
+# actual stop data and delete trips, all against a copy of one generated
+# database, once per configuration: journal mode, write path, read source,
+# busy timeout and pool size. Workers are threads sharing one pool, or
+# separate processes with a pool each (--processes), which is how several
+# clerks' copies of the app contend in practice.
+#
+# Writes take the queued path (the app's single group-commit writer) or the
+# direct path (each writer opens its own BEGIN IMMEDIATE, as every write did
+# before the writer existed). Lock wait is the time a write spent waiting
+# for the right to write: in the queue until its batch ran, or inside
+# BEGIN IMMEDIATE. Busy errors are "database is locked" / "busy" failures
+# that outlasted the busy timeout.
+
+Config = namedtuple("Config", "journal_mode writes reads busy_timeout_ms pool_size")
+
+# Relative frequency of each write
+WRITE_MIX = {"add_trip_offering": 5, "record_actual": 4, "delete_trip": 1}
+
+# Trips created only to be deleted start here
+SCRATCH_BASE = 900000
+
+DEFAULT_DURATION = 5.0
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _classify(error):
+    # PoolTimeout is an OperationalError too, so it is checked first
+    if isinstance(error, PoolTimeout):
+        return "pool_timeouts"
+    if isinstance(error, sqlite3.OperationalError) and (
+            "locked" in str(error) or "busy" in str(error)):
+        return "busy"
+    if isinstance(error, BookingConflict):
+        return "conflicts"
+    return "errors"
+
+
+# === Data ===
+def build_template(path, spec, scratch_trips):
+    pool = configure_pool(path, size=1)
+    app.setup_database()
+    with pool.connection() as connection:
+        counts = generate(connection, spec)
+        # Trips for delete_trip to remove, each with the stops of a generated one
+        connection.execute('''
+            WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+            INSERT INTO Trip SELECT ? + i, t.StartLocationName, t.DestinationName
+            FROM n JOIN Trip t ON t.TripNumber = ? + i % ?
+        ''', (scratch_trips, SCRATCH_BASE, ID_BASE, spec.trips))
+        connection.execute('''
+            INSERT INTO TripStopInfo
+            SELECT t.TripNumber, s.StopNumber, s.SequenceNumber, s.DrivingTime
+            FROM Trip t JOIN TripStopInfo s ON s.TripNumber = ? + (t.TripNumber - ?) % ?
+            WHERE t.TripNumber >= ?
+        ''', (ID_BASE, SCRATCH_BASE, spec.trips, SCRATCH_BASE))
+        connection.commit()
+    pool.close()
+    return counts
+
+
+def prepare(template, path, journal_mode):
+    # A fresh copy per configuration, already in the journal mode under test,
+    # so every run starts from the same data and no earlier run's WAL
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    source = sqlite3.connect(template)
+    target = sqlite3.connect(path)
+    try:
+        source.backup(target)
+        target.execute(f"PRAGMA journal_mode={journal_mode}")
+    finally:
+        target.close()
+        source.close()
+
+
+def sample_arguments(path, spec, seed, count=500):
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    try:
+        routes = connection.execute(
+            "SELECT DISTINCT StartLocationName, DestinationName FROM Trip WHERE TripNumber BETWEEN ? AND ?",
+            (ID_BASE, ID_BASE + spec.trips - 1)).fetchall()
+        offerings = connection.execute(
+            "SELECT TripNumber, DayNumber, StartMinute FROM TripOfferingData ORDER BY random() LIMIT ?",
+            (count,)).fetchall()
+        stop_times = {}
+        for trip, day, start in offerings:
+            stop_times[trip, day, start] = connection.execute('''
+                SELECT StopNumber, ArrivalMinute FROM ScheduledStopTime
+                WHERE TripNumber = ? AND DayNumber = ? AND StartMinute = ?
+            ''', (trip, day, start)).fetchall()
+    finally:
+        connection.close()
+
+    days = [from_day_number(day) for _, day, _ in offerings]
+    return {
+        "schedule": [rng.choice(routes) + (rng.choice(days),) for _ in range(count)],
+        "weekly": [(driver_name(rng.randrange(spec.drivers)), spec.start_date) for _ in range(count)],
+        "actual": [key + (stops,) for key, stops in stop_times.items() if stops],
+    }
+
+
+# === Workload ===
+class Workload:
+    def __init__(self, spec, config, arguments, writers, use_cache=False):
+        self.spec = spec
+        self.config = config
+        self.arguments = arguments
+        self.writers = writers
+        self.use_cache = use_cache
+        # New offerings go past the generated days so they never collide
+        self.new_day = to_day_number(spec.start_date) + spec.days + 1
+        # Lock wait of the calling thread's last write
+        self.lock_wait = threading.local()
+
+    def reads(self):
+        schedule = app.display_schedule
+        weekly = app.display_driver_weekly_schedule
+        if not self.use_cache:
+            schedule, weekly = schedule.__wrapped__, weekly.__wrapped__
+        return [("display_schedule", schedule, self.arguments["schedule"]),
+                ("display_driver_weekly_schedule", weekly, self.arguments["weekly"])]
+
+    def _write(self, operation, args, on_commit=None, on_rollback=None):
+        if self.config.writes == "queued":
+            started = []
+
+            def timed(connection, *args):
+                started.append(time.perf_counter())
+                return operation(connection, *args)
+
+            submitted = time.perf_counter()
+            try:
+                get_writer().execute(timed, *args, on_commit=on_commit, on_rollback=on_rollback)
+            finally:
+                self.lock_wait.seconds = (started[0] if started else time.perf_counter()) - submitted
+        else:
+            self._write_directly(operation, args, on_commit, on_rollback)
+
+    def _write_directly(self, operation, args, on_commit, on_rollback):
+        with pooled_connection() as connection:
+            waiting = time.perf_counter()
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+            finally:
+                self.lock_wait.seconds = time.perf_counter() - waiting
+            try:
+                operation(connection, *args)
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                if on_rollback is not None:
+                    on_rollback()
+                raise
+        if on_commit is not None:
+            on_commit()
+
+    def add_trip_offering(self, rng, index, sequence):
+        # A distinct slot per (writer, sequence). Every offering runs 04:00 to
+        # 05:00, so a day holds one per trip, driver and bus, whichever is
+        # fewest, before the next slot moves on to the following day: no
+        # driver or bus is booked twice
+        i = index + sequence * self.writers
+        per_day = min(self.spec.trips, self.spec.drivers, self.spec.buses)
+        slot = i % per_day
+        day = self.new_day + i // per_day
+        trip = ID_BASE + slot
+        driver = driver_name(slot)
+        bus_id = ID_BASE + slot
+        self._write(
+            app._insert_trip_offering, (trip, day, 240, 300, driver, bus_id),
+            on_commit=lambda: schedule_cache.invalidate(("day", day), ("driver", driver)),
+            on_rollback=lambda: booking_index.discard(trip, day, 240, driver, bus_id))
+
+    def record_actual(self, rng, index, sequence):
+        trip, day, start, stops = rng.choice(self.arguments["actual"])
+        delay = rng.randint(-2, 6)
+        rows = [(trip, day, start, stop, arrival, arrival + delay - 1, arrival + delay,
+                 rng.randint(0, 30), rng.randint(0, 30)) for stop, arrival in stops]
+        self._write(write_stop_rows, (rows,))
+
+    def delete_trip(self, rng, index, sequence):
+        trip = SCRATCH_BASE + index + sequence * self.writers
+        self._write(app._delete_trip, (trip,),
+                    on_commit=lambda: schedule_cache.invalidate(("trip", trip)))
+
+
+def run_reader(workload, index, deadline, seed):
+    # {operation: [(seconds, outcome)]}; outcome is None on success
+    rng = random.Random(seed)
+    reads = workload.reads()
+    samples = {name: [] for name, _, _ in reads}
+    while time.perf_counter() < deadline:
+        name, function, argument_sets = rng.choice(reads)
+        args = rng.choice(argument_sets)
+        started = time.perf_counter()
+        try:
+            function(*args)
+            outcome = None
+        except Exception as e:
+            outcome = _classify(e)
+        samples[name].append((time.perf_counter() - started, 0.0, outcome))
+    return samples
+
+
+def run_writer(workload, index, deadline, seed):
+    # {operation: [(seconds, lock wait, outcome)]}
+    rng = random.Random(seed)
+    names = list(WRITE_MIX)
+    weights = [WRITE_MIX[name] for name in names]
+    sequences = dict.fromkeys(names, 0)
+    samples = {name: [] for name in names}
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        sequence = sequences[name]
+        sequences[name] += 1
+        workload.lock_wait.seconds = 0.0
+        started = time.perf_counter()
+        try:
+            getattr(workload, name)(rng, index, sequence)
+            outcome = None
+        except Exception as e:
+            outcome = _classify(e)
+        samples[name].append((time.perf_counter() - started, workload.lock_wait.seconds, outcome))
+    return samples
+
+
+def _seed(role, index):
+    return index if role == "reader" else 1000 + index
+
+
+def _merge(total, samples):
+    for name, rows in samples.items():
+        total.setdefault(name, []).extend(rows)
+
+
+def _open(path, config, spec, arguments, writers, use_cache, snapshot_path):
+    # Cached results and booking windows from the previous configuration's
+    # copy do not describe this one
+    schedule_cache.clear()
+    configure_pool(path, size=config.pool_size, busy_timeout_ms=config.busy_timeout_ms,
+                   journal_mode=config.journal_mode)
+    if config.reads == "snapshot":
+        from snapshot import enable
+        enable(path=snapshot_path)
+    return Workload(spec, config, arguments, writers, use_cache)
+
+
+def _close():
+    from snapshot import disable
+    disable()
+    get_writer().close()
+    get_pool().close()
+
+
+def _process_worker(role, index, path, config, spec, arguments, writers, use_cache,
+                    start, duration, results):
+    # Runs in a child process with its own pool, writer and snapshot
+    try:
+        workload = _open(path, config, spec, arguments, writers, use_cache,
+                         f"{path}.snapshot-{os.getpid()}")
+        start.wait()
+        runner = run_reader if role == "reader" else run_writer
+        samples = runner(workload, index, time.perf_counter() + duration, _seed(role, index))
+        _close()
+        results.put((role, samples, None))
+    except Exception as e:
+        results.put((role, {}, f"{type(e).__name__}: {e}"))
+
+
+def run_config(path, config, spec, arguments, readers, writers, duration, processes, use_cache):
+    samples = {}
+    extra = {}
+    started = time.perf_counter()
+    if processes:
+        context = multiprocessing.get_context("spawn")
+        start = context.Event()
+        results = context.Queue()
+        children = [context.Process(target=_process_worker, args=(
+                        role, index, path, config, spec, arguments, writers, use_cache,
+                        start, duration, results))
+                    for role, count in (("reader", readers), ("writer", writers))
+                    for index in range(count)]
+        for child in children:
+            child.start()
+        # Children take a while to import; the clock starts when all are ready
+        time.sleep(0.5)
+        start.set()
+        started = time.perf_counter()
+        failures = []
+        for _ in children:
+            _, child_samples, failure = results.get()
+            _merge(samples, child_samples)
+            if failure:
+                failures.append(failure)
+        for child in children:
+            child.join()
+        if failures:
+            extra["worker_failures"] = failures
+    else:
+        workload = _open(path, config, spec, arguments, writers, use_cache, path + ".snapshot")
+        deadline = time.perf_counter() + duration
+        lock = threading.Lock()
+
+        def work(runner, index):
+            role = "reader" if runner is run_reader else "writer"
+            result = runner(workload, index, deadline, _seed(role, index))
+            with lock:
+                _merge(samples, result)
+
+        threads = [threading.Thread(target=work, args=(runner, index))
+                   for runner, count in ((run_reader, readers), (run_writer, writers))
+                   for index in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        extra["pool"] = get_pool().stats()
+        if config.writes == "queued":
+            extra["writer"] = get_writer().stats()
+        _close()
+    elapsed = time.perf_counter() - started
+    return summarize(config, samples, elapsed, extra)
+
+
+def summarize(config, samples, elapsed, extra):
+    operations = {}
+    totals = {"reads": 0, "writes": 0, "busy": 0, "conflicts": 0, "lock_wait_seconds": 0.0}
+    for name, rows in samples.items():
+        role = "writes" if name in WRITE_MIX else "reads"
+        ok = sorted(seconds for seconds, _, outcome in rows if outcome is None)
+        waits = sorted(wait for _, wait, _ in rows)
+        failures = {}
+        for _, _, outcome in rows:
+            if outcome is not None:
+                failures[outcome] = failures.get(outcome, 0) + 1
+        result = {
+            "role": role[:-1],
+            "ops": len(ok),
+            "ops_per_second": len(ok) / elapsed if elapsed else 0.0,
+            "mean_ms": statistics.fmean(ok) * 1000 if ok else None,
+            "p50_ms": _percentile(ok, 0.50) * 1000 if ok else None,
+            "p95_ms": _percentile(ok, 0.95) * 1000 if ok else None,
+            "p99_ms": _percentile(ok, 0.99) * 1000 if ok else None,
+            "max_ms": ok[-1] * 1000 if ok else None,
+            "lock_wait_seconds": sum(waits),
+            "lock_wait_p99_ms": _percentile(waits, 0.99) * 1000 if waits else 0.0,
+        }
+        result.update(failures)
+        operations[name] = result
+        totals[role] += len(ok)
+        totals["busy"] += failures.get("busy", 0)
+        totals["conflicts"] += failures.get("conflicts", 0)
+        totals["lock_wait_seconds"] += result["lock_wait_seconds"]
+
+    return dict(
+        config=config._asdict(),
+        label=label(config),
+        elapsed_seconds=elapsed,
+        reads_per_second=totals["reads"] / elapsed if elapsed else 0.0,
+        writes_per_second=totals["writes"] / elapsed if elapsed else 0.0,
+        busy_errors=totals["busy"],
+        conflicts=totals["conflicts"],
+        lock_wait_seconds=totals["lock_wait_seconds"],
+        operations=operations,
+        **extra,
+    )
+
+
+def label(config):
+    return (f"{config.journal_mode}/{config.writes} writes/{config.reads} reads/"
+            f"busy {config.busy_timeout_ms}ms/pool {config.pool_size}")
+
+
+def _ms(value):
+    return "-" if value is None else f"{value:.2f}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mixed read/write load test for lock contention")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--processes", action="store_true",
+                        help="Run each worker in its own process instead of a thread")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="Seconds per configuration")
+    parser.add_argument("--journal-modes", nargs="+", default=["wal", "delete"],
+                        choices=["wal", "delete", "truncate", "persist", "memory"])
+    parser.add_argument("--writes", nargs="+", default=["queued", "direct"], choices=["queued", "direct"])
+    parser.add_argument("--reads", nargs="+", default=["live"], choices=["live", "snapshot"])
+    parser.add_argument("--busy-timeouts", nargs="+", type=int, default=[5000], help="Milliseconds")
+    parser.add_argument("--pool-sizes", nargs="+", type=int,
+                        help="Connections per pool (default: one per worker plus the writer's)")
+    parser.add_argument("--cache", action="store_true", help="Let reads use the query cache")
+    parser.add_argument("--trips", type=int, default=100)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--departures", type=int, default=8, help="Departures per trip per day")
+    parser.add_argument("--dir", help="Directory for the databases, created if missing "
+                                      "(default: a temporary one)")
+    parser.add_argument("--output", help="Also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.readers < 0 or args.writers < 0 or args.readers + args.writers == 0:
+        print("Error: Need at least one reader or writer.")
+        return 1
+    spec = FleetSpec(trips=args.trips, days=args.days, departures_per_day=args.departures)
+    default_pool = 2 if args.processes else args.readers + args.writers + 1
+    configs = [Config(*values) for values in itertools.product(
+        args.journal_modes, args.writes, args.reads, args.busy_timeouts, args.pool_sizes or [default_pool])]
+
+    if args.dir:
+        os.makedirs(args.dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        template = os.path.join(directory, "template.db")
+        started = time.perf_counter()
+        # Enough scratch trips that delete_trip rarely runs out; deleting a
+        # trip that is already gone is a cheap no-op
+        counts = build_template(template, spec, scratch_trips=max(1000, args.writers * 5000))
+        print(f"Generated {counts} in {time.perf_counter() - started:.1f}s")
+        arguments = sample_arguments(template, spec, seed=spec.seed)
+
+        path = os.path.join(directory, "loadtest.db")
+        results = []
+        for config in configs:
+            prepare(template, path, config.journal_mode)
+            result = run_config(path, config, spec, arguments, args.readers, args.writers,
+                                args.duration, args.processes, args.cache)
+            results.append(result)
+
+            print(f"\n--- {result['label']} ---")
+            print("Operation | ops | ops/s | p50 ms | p95 ms | p99 ms | lock wait s | busy | conflicts | "
+                  "other errors")
+            print("-" * 110)
+            for name, op in result["operations"].items():
+                other = sum(op.get(kind, 0) for kind in ("errors", "pool_timeouts"))
+                print(f"{name} | {op['ops']} | {op['ops_per_second']:.0f} | {_ms(op['p50_ms'])} | "
+                      f"{_ms(op['p95_ms'])} | {_ms(op['p99_ms'])} | {op['lock_wait_seconds']:.2f} | "
+                      f"{op.get('busy', 0)} | {op.get('conflicts', 0)} | {other}")
+            for failure in result.get("worker_failures", []):
+                print(f"Worker failed: {failure}")
+
+    print("\nConfiguration | reads/s | writes/s | lock wait s | busy errors | conflicts")
+    print("-" * 110)
+    for result in results:
+        print(f"{result['label']} | {result['reads_per_second']:.0f} | {result['writes_per_second']:.0f} | "
+              f"{result['lock_wait_seconds']:.2f} | {result['busy_errors']} | {result['conflicts']}")
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump({"readers": args.readers, "writers": args.writers, "processes": args.processes,
+                       "duration": args.duration, "spec": spec.as_dict(), "results": results},
+                      handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
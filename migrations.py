@@ -0,0 +1,661 @@
+# Versioned schema migrations, tracked with PRAGMA user_version.
+# Each entry is (version, description, script). Never edit a migration that
+# has shipped; append a new one instead.
+
+# The original tables: schema version 0, which the migrations start from
+BASE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS Trip (
+        TripNumber INTEGER PRIMARY KEY,
+        StartLocationName TEXT,
+        DestinationName TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS TripOffering (
+        TripNumber INTEGER,
+        Date TEXT,
+        ScheduledStartTime TEXT,
+        ScheduledArrivalTime TEXT,
+        DriverName TEXT,
+        BusID INTEGER,
+        PRIMARY KEY (TripNumber, Date, ScheduledStartTime),
+        FOREIGN KEY (TripNumber) REFERENCES Trip(TripNumber),
+        FOREIGN KEY (DriverName) REFERENCES Driver(DriverName),
+        FOREIGN KEY (BusID) REFERENCES Bus(BusID)
+    );
+
+    CREATE TABLE IF NOT EXISTS Bus (
+        BusID INTEGER PRIMARY KEY,
+        Model TEXT,
+        Year INTEGER
+    );
+
+    CREATE TABLE IF NOT EXISTS Driver (
+        DriverName TEXT PRIMARY KEY,
+        DriverTelephoneNumber TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS Stop (
+        StopNumber INTEGER PRIMARY KEY,
+        StopAddress TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS TripStopInfo (
+        TripNumber INTEGER,
+        StopNumber INTEGER,
+        SequenceNumber INTEGER,
+        DrivingTime INTEGER,
+        PRIMARY KEY (TripNumber, StopNumber),
+        FOREIGN KEY (TripNumber) REFERENCES Trip(TripNumber),
+        FOREIGN KEY (StopNumber) REFERENCES Stop(StopNumber)
+    );
+
+    CREATE TABLE IF NOT EXISTS ActualTripStopInfo (
+        TripNumber INTEGER,
+        Date TEXT,
+        ScheduledStartTime TEXT,
+        StopNumber INTEGER,
+        ScheduledArrivalTime TEXT,
+        ActualStartTime TEXT,
+        ActualArrivalTime TEXT,
+        NumberOfPassengerIn INTEGER,
+        NumberOfPassengerOut INTEGER,
+        PRIMARY KEY (TripNumber, Date, ScheduledStartTime, StopNumber),
+        FOREIGN KEY (TripNumber) REFERENCES Trip(TripNumber),
+        FOREIGN KEY (StopNumber) REFERENCES Stop(StopNumber)
+    );
+'''
+
+
+# SQL expressions shared by the date/time migrations. Day numbers count days
+# since 1970-01-01 (julian day 2440587.5); times are minutes after midnight.
+def _day(column):
+    return f"CAST(julianday({column}) - 2440587.5 AS INTEGER)"
+
+
+def _date(column):
+    return f"date({column} + 2440587.5)"
+
+
+def _minute(column):
+    return (
+        f"CASE WHEN instr({column}, ':') > 0 THEN "
+        f"CAST(substr({column}, 1, instr({column}, ':') - 1) AS INTEGER) * 60 + "
+        f"CAST(substr({column}, instr({column}, ':') + 1, 2) AS INTEGER) END"
+    )
+
+
+def _hhmm(column):
+    return (
+        f"CASE WHEN {column} IS NOT NULL THEN "
+        f"printf('%02d:%02d', {column} / 60, {column} % 60) END"
+    )
+
+
+def _ridership_change(row, sign):
+    # Adds (sign "+") or removes (sign "-") one ActualTripStopData row's
+    # passengers in each ridership aggregate
+    boardings = f"{sign}COALESCE({row}.NumberOfPassengerIn, 0)"
+    alightings = f"{sign}COALESCE({row}.NumberOfPassengerOut, 0)"
+    totals = ("Boardings = Boardings + excluded.Boardings, "
+              "Alightings = Alightings + excluded.Alightings, "
+              "Observations = Observations + excluded.Observations")
+    return f'''
+            INSERT INTO RidershipStopDay VALUES (
+                {row}.StopNumber, {row}.DayNumber, {boardings}, {alightings}, {sign}1)
+            ON CONFLICT (StopNumber, DayNumber) DO UPDATE SET {totals};
+            INSERT INTO RidershipTripDay VALUES (
+                {row}.TripNumber, {row}.DayNumber, {boardings}, {alightings}, {sign}1)
+            ON CONFLICT (TripNumber, DayNumber) DO UPDATE SET {totals};
+            INSERT INTO RidershipRouteHour
+            SELECT t.StartLocationName, t.DestinationName, {row}.DayNumber,
+                   {_ridership_hour(row)},
+                   {boardings}, {alightings}, {sign}1
+            FROM Trip t WHERE t.TripNumber = {row}.TripNumber
+            ON CONFLICT (StartLocationName, DestinationName, DayNumber, Hour) DO UPDATE SET {totals};'''
+
+
+def _ridership_hour(row):
+    return f"(COALESCE({row}.ScheduledArrivalMinute, {row}.StartMinute) / 60) % 24"
+
+
+def _ridership_delta():
+    # Applies an update that keeps the row in the same aggregate groups
+    boardings = "COALESCE(NEW.NumberOfPassengerIn, 0) - COALESCE(OLD.NumberOfPassengerIn, 0)"
+    alightings = "COALESCE(NEW.NumberOfPassengerOut, 0) - COALESCE(OLD.NumberOfPassengerOut, 0)"
+    totals = f"Boardings = Boardings + ({boardings}), Alightings = Alightings + ({alightings})"
+    return f'''
+            UPDATE RidershipStopDay SET {totals}
+            WHERE StopNumber = NEW.StopNumber AND DayNumber = NEW.DayNumber;
+            UPDATE RidershipTripDay SET {totals}
+            WHERE TripNumber = NEW.TripNumber AND DayNumber = NEW.DayNumber;
+            UPDATE RidershipRouteHour SET {totals}
+            WHERE (StartLocationName, DestinationName) = (
+                SELECT StartLocationName, DestinationName FROM Trip WHERE TripNumber = NEW.TripNumber)
+            AND DayNumber = NEW.DayNumber AND Hour = {_ridership_hour("NEW")};'''
+
+
+_RIDERSHIP_SAME_GROUPS = f'''OLD.TripNumber = NEW.TripNumber AND OLD.DayNumber = NEW.DayNumber
+            AND OLD.StopNumber = NEW.StopNumber
+            AND {_ridership_hour("OLD")} = {_ridership_hour("NEW")}'''
+
+
+def _ridership_cleanup(row):
+    # Aggregate rows left with no observations are removed
+    return f'''
+            DELETE FROM RidershipStopDay
+            WHERE StopNumber = {row}.StopNumber AND DayNumber = {row}.DayNumber AND Observations <= 0;
+            DELETE FROM RidershipTripDay
+            WHERE TripNumber = {row}.TripNumber AND DayNumber = {row}.DayNumber AND Observations <= 0;
+            DELETE FROM RidershipRouteHour
+            WHERE (StartLocationName, DestinationName) = (
+                SELECT StartLocationName, DestinationName FROM Trip WHERE TripNumber = {row}.TripNumber)
+            AND DayNumber = {row}.DayNumber
+            AND Hour = {_ridership_hour(row)}
+            AND Observations <= 0;'''
+
+
+
+def _stop_offsets(partition=None, trip=None):
+    # Stops with the running sum of DrivingTime up to and including each
+    # one, for one trip or (with partition) for every trip
+    where = "" if trip is None else f" WHERE TripNumber = {trip}"
+    over = "PARTITION BY TripNumber " if partition else ""
+    return f'''(SELECT TripNumber, StopNumber, SequenceNumber,
+                   SUM(COALESCE(DrivingTime, 0)) OVER (
+                       {over}ORDER BY SequenceNumber, StopNumber ROWS UNBOUNDED PRECEDING) AS Offset
+               FROM TripStopInfo{where})'''
+
+
+def _stop_times_for_offering(row):
+    return f'''
+            INSERT OR REPLACE INTO ScheduledStopTime
+            SELECT {row}.TripNumber, {row}.DayNumber, {row}.StartMinute,
+                   s.StopNumber, s.SequenceNumber, {row}.StartMinute + s.Offset
+            FROM {_stop_offsets(trip=f"{row}.TripNumber")} s;'''
+
+
+def _stop_times_for_trip(trip):
+    # Recomputes every offering of a trip after its stop sequence changed
+    return f'''
+            DELETE FROM ScheduledStopTime WHERE TripNumber = {trip};
+            INSERT INTO ScheduledStopTime
+            SELECT o.TripNumber, o.DayNumber, o.StartMinute,
+                   s.StopNumber, s.SequenceNumber, o.StartMinute + s.Offset
+            FROM TripOfferingData o
+            JOIN {_stop_offsets(trip=trip)} s
+            WHERE o.TripNumber = {trip};'''
+
+
+MIGRATIONS = [
+    (1, "Secondary indexes for schedule, roster and delete guard lookups", '''
+        -- display_schedule: find trips by route, then offerings by trip/date
+        CREATE INDEX IF NOT EXISTS idx_trip_route
+            ON Trip (StartLocationName, DestinationName);
+
+        CREATE INDEX IF NOT EXISTS idx_tripoffering_trip_date
+            ON TripOffering (TripNumber, Date, ScheduledStartTime,
+                             ScheduledArrivalTime, DriverName, BusID);
+
+        -- display_driver_weekly_schedule and the delete_driver guard
+        CREATE INDEX IF NOT EXISTS idx_tripoffering_driver_date
+            ON TripOffering (DriverName, Date, ScheduledStartTime,
+                             TripNumber, ScheduledArrivalTime);
+
+        -- delete_bus guard
+        CREATE INDEX IF NOT EXISTS idx_tripoffering_bus
+            ON TripOffering (BusID);
+
+        -- display_trip_stops / record_actual_trip_data read stops in order
+        CREATE INDEX IF NOT EXISTS idx_tripstopinfo_trip_sequence
+            ON TripStopInfo (TripNumber, SequenceNumber, StopNumber, DrivingTime);
+    '''),
+
+    (2, "Integer day numbers and minute-of-day times for offerings and stop data", f'''
+        -- WITHOUT ROWID keeps the rows clustered on the key, so the primary
+        -- key doubles as the covering index for trip/date lookups.
+        CREATE TABLE TripOfferingData (
+            TripNumber INTEGER NOT NULL,
+            DayNumber INTEGER NOT NULL,
+            StartMinute INTEGER NOT NULL,
+            ArrivalMinute INTEGER,
+            DriverName TEXT,
+            BusID INTEGER,
+            PRIMARY KEY (TripNumber, DayNumber, StartMinute),
+            FOREIGN KEY (TripNumber) REFERENCES Trip(TripNumber),
+            FOREIGN KEY (DriverName) REFERENCES Driver(DriverName),
+            FOREIGN KEY (BusID) REFERENCES Bus(BusID)
+        ) WITHOUT ROWID;
+
+        INSERT INTO TripOfferingData
+        SELECT TripNumber,
+               {_day("Date")},
+               {_minute("ScheduledStartTime")},
+               {_minute("ScheduledArrivalTime")},
+               DriverName,
+               BusID
+        FROM TripOffering;
+
+        DROP TABLE TripOffering;
+
+        CREATE INDEX idx_tripofferingdata_driver_day
+            ON TripOfferingData (DriverName, DayNumber, StartMinute, ArrivalMinute);
+
+        CREATE INDEX idx_tripofferingdata_bus
+            ON TripOfferingData (BusID);
+
+        CREATE TABLE ActualTripStopData (
+            TripNumber INTEGER NOT NULL,
+            DayNumber INTEGER NOT NULL,
+            StartMinute INTEGER NOT NULL,
+            StopNumber INTEGER NOT NULL,
+            ScheduledArrivalMinute INTEGER,
+            ActualStartMinute INTEGER,
+            ActualArrivalMinute INTEGER,
+            NumberOfPassengerIn INTEGER,
+            NumberOfPassengerOut INTEGER,
+            PRIMARY KEY (TripNumber, DayNumber, StartMinute, StopNumber),
+            FOREIGN KEY (TripNumber) REFERENCES Trip(TripNumber),
+            FOREIGN KEY (StopNumber) REFERENCES Stop(StopNumber)
+        ) WITHOUT ROWID;
+
+        INSERT INTO ActualTripStopData
+        SELECT TripNumber,
+               {_day("Date")},
+               {_minute("ScheduledStartTime")},
+               StopNumber,
+               {_minute("ScheduledArrivalTime")},
+               {_minute("ActualStartTime")},
+               {_minute("ActualArrivalTime")},
+               NumberOfPassengerIn,
+               NumberOfPassengerOut
+        FROM ActualTripStopInfo;
+
+        DROP TABLE ActualTripStopInfo;
+
+        -- Text views under the original names for ad-hoc SQL and older
+        -- scripts. Writes through them are redirected to the integer tables.
+        CREATE VIEW TripOffering AS
+        SELECT TripNumber,
+               {_date("DayNumber")} AS Date,
+               {_hhmm("StartMinute")} AS ScheduledStartTime,
+               {_hhmm("ArrivalMinute")} AS ScheduledArrivalTime,
+               DriverName,
+               BusID
+        FROM TripOfferingData;
+
+        CREATE TRIGGER TripOffering_insert INSTEAD OF INSERT ON TripOffering
+        BEGIN
+            INSERT INTO TripOfferingData VALUES (
+                NEW.TripNumber,
+                {_day("NEW.Date")},
+                {_minute("NEW.ScheduledStartTime")},
+                {_minute("NEW.ScheduledArrivalTime")},
+                NEW.DriverName,
+                NEW.BusID
+            );
+        END;
+
+        CREATE TRIGGER TripOffering_update INSTEAD OF UPDATE ON TripOffering
+        BEGIN
+            UPDATE TripOfferingData SET
+                TripNumber = NEW.TripNumber,
+                DayNumber = {_day("NEW.Date")},
+                StartMinute = {_minute("NEW.ScheduledStartTime")},
+                ArrivalMinute = {_minute("NEW.ScheduledArrivalTime")},
+                DriverName = NEW.DriverName,
+                BusID = NEW.BusID
+            WHERE TripNumber = OLD.TripNumber
+            AND DayNumber = {_day("OLD.Date")}
+            AND StartMinute = {_minute("OLD.ScheduledStartTime")};
+        END;
+
+        CREATE TRIGGER TripOffering_delete INSTEAD OF DELETE ON TripOffering
+        BEGIN
+            DELETE FROM TripOfferingData
+            WHERE TripNumber = OLD.TripNumber
+            AND DayNumber = {_day("OLD.Date")}
+            AND StartMinute = {_minute("OLD.ScheduledStartTime")};
+        END;
+
+        CREATE VIEW ActualTripStopInfo AS
+        SELECT TripNumber,
+               {_date("DayNumber")} AS Date,
+               {_hhmm("StartMinute")} AS ScheduledStartTime,
+               StopNumber,
+               {_hhmm("ScheduledArrivalMinute")} AS ScheduledArrivalTime,
+               {_hhmm("ActualStartMinute")} AS ActualStartTime,
+               {_hhmm("ActualArrivalMinute")} AS ActualArrivalTime,
+               NumberOfPassengerIn,
+               NumberOfPassengerOut
+        FROM ActualTripStopData;
+
+        CREATE TRIGGER ActualTripStopInfo_insert INSTEAD OF INSERT ON ActualTripStopInfo
+        BEGIN
+            INSERT INTO ActualTripStopData VALUES (
+                NEW.TripNumber,
+                {_day("NEW.Date")},
+                {_minute("NEW.ScheduledStartTime")},
+                NEW.StopNumber,
+                {_minute("NEW.ScheduledArrivalTime")},
+                {_minute("NEW.ActualStartTime")},
+                {_minute("NEW.ActualArrivalTime")},
+                NEW.NumberOfPassengerIn,
+                NEW.NumberOfPassengerOut
+            );
+        END;
+
+        CREATE TRIGGER ActualTripStopInfo_delete INSTEAD OF DELETE ON ActualTripStopInfo
+        BEGIN
+            DELETE FROM ActualTripStopData
+            WHERE TripNumber = OLD.TripNumber
+            AND DayNumber = {_day("OLD.Date")}
+            AND StartMinute = {_minute("OLD.ScheduledStartTime")}
+            AND StopNumber = OLD.StopNumber;
+        END;
+    '''),
+
+    (3, "Day index on TripOfferingData for whole-day and date-range scans", '''
+        -- Secondary indexes on a WITHOUT ROWID table carry the primary key,
+        -- so this also covers TripNumber
+        CREATE INDEX IF NOT EXISTS idx_tripofferingdata_day
+            ON TripOfferingData (DayNumber, StartMinute, ArrivalMinute);
+    '''),
+
+    (4, "Covering bus/day index for double-booking checks", '''
+        -- Same shape as idx_tripofferingdata_driver_day; BusID alone is a
+        -- prefix of it, so the old single-column index is redundant
+        CREATE INDEX IF NOT EXISTS idx_tripofferingdata_bus_day
+            ON TripOfferingData (BusID, DayNumber, StartMinute, ArrivalMinute);
+        DROP INDEX IF EXISTS idx_tripofferingdata_bus;
+    '''),
+
+    (5, "Day index on ActualTripStopData for date-range exports and reports", '''
+        CREATE INDEX IF NOT EXISTS idx_actualtripstopdata_day
+            ON ActualTripStopData (DayNumber);
+    '''),
+
+    (6, "Ridership aggregates kept current by triggers on ActualTripStopData", f'''
+        CREATE TABLE RidershipStopDay (
+            StopNumber INTEGER NOT NULL,
+            DayNumber INTEGER NOT NULL,
+            Boardings INTEGER NOT NULL,
+            Alightings INTEGER NOT NULL,
+            Observations INTEGER NOT NULL,
+            PRIMARY KEY (StopNumber, DayNumber)
+        ) WITHOUT ROWID;
+
+        CREATE INDEX idx_ridershipstopday_day ON RidershipStopDay (DayNumber);
+
+        CREATE TABLE RidershipTripDay (
+            TripNumber INTEGER NOT NULL,
+            DayNumber INTEGER NOT NULL,
+            Boardings INTEGER NOT NULL,
+            Alightings INTEGER NOT NULL,
+            Observations INTEGER NOT NULL,
+            PRIMARY KEY (TripNumber, DayNumber)
+        ) WITHOUT ROWID;
+
+        CREATE INDEX idx_ridershiptripday_day ON RidershipTripDay (DayNumber);
+
+        -- Hour is the hour of the stop's scheduled arrival
+        CREATE TABLE RidershipRouteHour (
+            StartLocationName TEXT NOT NULL,
+            DestinationName TEXT NOT NULL,
+            DayNumber INTEGER NOT NULL,
+            Hour INTEGER NOT NULL,
+            Boardings INTEGER NOT NULL,
+            Alightings INTEGER NOT NULL,
+            Observations INTEGER NOT NULL,
+            PRIMARY KEY (StartLocationName, DestinationName, DayNumber, Hour)
+        ) WITHOUT ROWID;
+
+        CREATE INDEX idx_ridershiproutehour_day ON RidershipRouteHour (DayNumber);
+
+        CREATE TRIGGER ActualTripStopData_ridership_insert
+        AFTER INSERT ON ActualTripStopData
+        BEGIN{_ridership_change("NEW", "+")}
+        END;
+
+        -- Telemetry merges usually change only the passenger counts, which
+        -- is a plain in-place delta; anything that moves the row to another
+        -- group is handled as a delete plus an insert
+        CREATE TRIGGER ActualTripStopData_ridership_update
+        AFTER UPDATE ON ActualTripStopData
+        WHEN {_RIDERSHIP_SAME_GROUPS}
+            AND (OLD.NumberOfPassengerIn IS NOT NEW.NumberOfPassengerIn
+                 OR OLD.NumberOfPassengerOut IS NOT NEW.NumberOfPassengerOut)
+        BEGIN{_ridership_delta()}
+        END;
+
+        CREATE TRIGGER ActualTripStopData_ridership_move
+        AFTER UPDATE ON ActualTripStopData
+        WHEN NOT ({_RIDERSHIP_SAME_GROUPS})
+        BEGIN{_ridership_change("OLD", "-")}{_ridership_change("NEW", "+")}{_ridership_cleanup("OLD")}
+        END;
+
+        CREATE TRIGGER ActualTripStopData_ridership_delete
+        AFTER DELETE ON ActualTripStopData
+        BEGIN{_ridership_change("OLD", "-")}{_ridership_cleanup("OLD")}
+        END;
+
+        -- Backfill from the rows already recorded
+        INSERT INTO RidershipStopDay
+        SELECT StopNumber, DayNumber, SUM(COALESCE(NumberOfPassengerIn, 0)),
+               SUM(COALESCE(NumberOfPassengerOut, 0)), COUNT(*)
+        FROM ActualTripStopData
+        GROUP BY StopNumber, DayNumber;
+
+        INSERT INTO RidershipTripDay
+        SELECT TripNumber, DayNumber, SUM(COALESCE(NumberOfPassengerIn, 0)),
+               SUM(COALESCE(NumberOfPassengerOut, 0)), COUNT(*)
+        FROM ActualTripStopData
+        GROUP BY TripNumber, DayNumber;
+
+        INSERT INTO RidershipRouteHour
+        SELECT t.StartLocationName, t.DestinationName, a.DayNumber,
+               (COALESCE(a.ScheduledArrivalMinute, a.StartMinute) / 60) % 24,
+               SUM(COALESCE(a.NumberOfPassengerIn, 0)), SUM(COALESCE(a.NumberOfPassengerOut, 0)),
+               COUNT(*)
+        FROM ActualTripStopData a
+        JOIN Trip t ON t.TripNumber = a.TripNumber
+        GROUP BY 1, 2, 3, 4;
+    '''),
+
+    (7, "Registry of monthly archive files for old offerings and stop data", '''
+        CREATE TABLE ArchivedMonth (
+            Month TEXT PRIMARY KEY,
+            Path TEXT NOT NULL,
+            FirstDay INTEGER NOT NULL,
+            LastDay INTEGER NOT NULL,
+            Offerings INTEGER NOT NULL,
+            StopRows INTEGER NOT NULL,
+            ArchivedAt TEXT NOT NULL
+        );
+
+        -- Read functions check every date range against this
+        CREATE INDEX idx_archivedmonth_lastday ON ArchivedMonth (LastDay, FirstDay);
+    '''),
+
+    (8, "Scheduled arrival at every stop of every offering, kept current by triggers", f'''
+        -- ArrivalMinute is StartMinute plus the running sum of DrivingTime
+        -- in stop sequence order, unclamped, so it can pass midnight
+        CREATE TABLE ScheduledStopTime (
+            TripNumber INTEGER NOT NULL,
+            DayNumber INTEGER NOT NULL,
+            StartMinute INTEGER NOT NULL,
+            StopNumber INTEGER NOT NULL,
+            SequenceNumber INTEGER,
+            ArrivalMinute INTEGER NOT NULL,
+            PRIMARY KEY (TripNumber, DayNumber, StartMinute, StopNumber)
+        ) WITHOUT ROWID;
+
+        -- "When does a bus reach stop X": arrivals at a stop by day and time
+        CREATE INDEX idx_scheduledstoptime_stop_day
+            ON ScheduledStopTime (StopNumber, DayNumber, ArrivalMinute);
+
+        CREATE TRIGGER TripOfferingData_stoptimes_insert
+        AFTER INSERT ON TripOfferingData
+        BEGIN{_stop_times_for_offering("NEW")}
+        END;
+
+        -- Only the key columns feed the stop times
+        CREATE TRIGGER TripOfferingData_stoptimes_update
+        AFTER UPDATE OF TripNumber, DayNumber, StartMinute ON TripOfferingData
+        BEGIN
+            DELETE FROM ScheduledStopTime
+            WHERE TripNumber = OLD.TripNumber AND DayNumber = OLD.DayNumber
+            AND StartMinute = OLD.StartMinute;{_stop_times_for_offering("NEW")}
+        END;
+
+        CREATE TRIGGER TripOfferingData_stoptimes_delete
+        AFTER DELETE ON TripOfferingData
+        BEGIN
+            DELETE FROM ScheduledStopTime
+            WHERE TripNumber = OLD.TripNumber AND DayNumber = OLD.DayNumber
+            AND StartMinute = OLD.StartMinute;
+        END;
+
+        CREATE TRIGGER TripStopInfo_stoptimes_insert
+        AFTER INSERT ON TripStopInfo
+        BEGIN{_stop_times_for_trip("NEW.TripNumber")}
+        END;
+
+        CREATE TRIGGER TripStopInfo_stoptimes_update
+        AFTER UPDATE ON TripStopInfo
+        BEGIN{_stop_times_for_trip("NEW.TripNumber")}
+        END;
+
+        CREATE TRIGGER TripStopInfo_stoptimes_move
+        AFTER UPDATE OF TripNumber ON TripStopInfo
+        WHEN OLD.TripNumber <> NEW.TripNumber
+        BEGIN{_stop_times_for_trip("OLD.TripNumber")}
+        END;
+
+        CREATE TRIGGER TripStopInfo_stoptimes_delete
+        AFTER DELETE ON TripStopInfo
+        BEGIN{_stop_times_for_trip("OLD.TripNumber")}
+        END;
+
+        -- Backfill from the offerings already scheduled
+        INSERT INTO ScheduledStopTime
+        SELECT o.TripNumber, o.DayNumber, o.StartMinute,
+               s.StopNumber, s.SequenceNumber, o.StartMinute + s.Offset
+        FROM {_stop_offsets(partition=True)} s
+        JOIN TripOfferingData o ON o.TripNumber = s.TripNumber;
+    '''),
+
+    (9, "Recurring service patterns with exception dates, expanded at query time", '''
+        -- One weekly template per departure: Weekdays is a bit mask with
+        -- bit 0 for Monday through bit 6 for Sunday, active from FirstDay
+        -- to LastDay. Explicit TripOfferingData rows for the same trip, day
+        -- and start time take precedence over the pattern.
+        CREATE TABLE ServicePattern (
+            PatternID INTEGER PRIMARY KEY,
+            TripNumber INTEGER NOT NULL,
+            StartMinute INTEGER NOT NULL,
+            ArrivalMinute INTEGER,
+            DriverName TEXT,
+            BusID INTEGER,
+            Weekdays INTEGER NOT NULL,
+            FirstDay INTEGER NOT NULL,
+            LastDay INTEGER NOT NULL,
+            FOREIGN KEY (TripNumber) REFERENCES Trip(TripNumber),
+            FOREIGN KEY (DriverName) REFERENCES Driver(DriverName),
+            FOREIGN KEY (BusID) REFERENCES Bus(BusID)
+        );
+
+        -- Patterns in force over a date range
+        CREATE INDEX idx_servicepattern_days ON ServicePattern (LastDay, FirstDay);
+
+        -- delete_trip, and the delete_driver / delete_bus guards
+        CREATE INDEX idx_servicepattern_trip ON ServicePattern (TripNumber);
+        CREATE INDEX idx_servicepattern_driver ON ServicePattern (DriverName);
+        CREATE INDEX idx_servicepattern_bus ON ServicePattern (BusID);
+
+        -- Running = 0 cancels the pattern on a day it would run; Running = 1
+        -- adds a day inside FirstDay..LastDay that the weekdays leave out
+        CREATE TABLE ServiceException (
+            PatternID INTEGER NOT NULL,
+            DayNumber INTEGER NOT NULL,
+            Running INTEGER NOT NULL,
+            PRIMARY KEY (PatternID, DayNumber),
+            FOREIGN KEY (PatternID) REFERENCES ServicePattern(PatternID) ON DELETE CASCADE
+        ) WITHOUT ROWID;
+    '''),
+
+    (10, "Indexes set aside by a bulk timetable load, until it rebuilds them", '''
+        -- Written in the same transaction that drops them, so a load that
+        -- dies before rebuilding leaves a record for restore_indexes()
+        CREATE TABLE SetAsideIndex (
+            Name TEXT PRIMARY KEY,
+            Sql TEXT NOT NULL
+        ) WITHOUT ROWID;
+    '''),
+]
+
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def ensure_schema(connection):
+    # Startup check: one PRAGMA read when the schema is current. A new file
+    # gets the base tables, then every migration.
+    current = schema_version(connection)
+    if current >= LATEST_VERSION:
+        return []
+    if current == 0:
+        connection.executescript(BASE_SCHEMA)
+    return migrate(connection)
+
+
+def restore_indexes(connection):
+    # Recreates the indexes a bulk load set aside and never rebuilt (the
+    # process was killed mid-load); returns their names
+    pending = connection.execute("SELECT Name, Sql FROM SetAsideIndex").fetchall()
+    if not pending:
+        return []
+    connection.execute("BEGIN")
+    try:
+        for name, sql in pending:
+            exists = connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone()
+            if exists is None:
+                connection.execute(sql)
+        connection.execute("DELETE FROM SetAsideIndex")
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    return [name for name, _ in pending]
+
+
+def migrate(connection):
+    applied = []
+    current = schema_version(connection)
+    if current >= LATEST_VERSION:
+        return applied
+
+    # Table rebuilds copy rows that predate foreign key enforcement, so
+    # enforcement is paused for the duration (it cannot change mid-transaction).
+    foreign_keys = connection.execute("PRAGMA foreign_keys").fetchone()[0]
+    connection.execute("PRAGMA foreign_keys=OFF")
+    try:
+        for version, description, script in MIGRATIONS:
+            if version <= current:
+                continue
+            # executescript() commits any open transaction first, so the
+            # migration and its version bump are wrapped in their own.
+            connection.executescript(
+                f"BEGIN;\n{script}\nPRAGMA user_version = {version};\nCOMMIT;"
+            )
+            applied.append((version, description))
+            current = version
+    finally:
+        if connection.in_transaction:
+            connection.rollback()
+        connection.execute(f"PRAGMA foreign_keys={foreign_keys}")
+    return applied
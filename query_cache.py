@@ -0,0 +1,150 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get("POMONA_TRANSIT_CACHE_SIZE", "1024"))
+DEFAULT_TTL = float(os.environ.get("POMONA_TRANSIT_CACHE_TTL", "300"))
+
+_MISSING = object()
+
+
+class QueryCache:
+    # LRU cache with a TTL. Every entry carries a set of tags such as
+    # ("trip", 1) or ("day", 20051); writers invalidate by tag, which drops
+    # exactly the entries whose results they may have changed.
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        # Called with the invalidated tags (None after clear()) by structures
+        # that keep their own copy of cached data
+        self._listeners = []
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires, value, tags = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, tags, generation=None):
+        with self._lock:
+            # A write landed while the value was being computed, so it may
+            # already be stale; skip caching it.
+            if generation is not None and generation != self._generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            tags = frozenset(tags)
+            self._entries[key] = (time.monotonic() + self.ttl, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    if key in self._entries:
+                        self._remove(key)
+                        self.invalidations += 1
+        for listener in list(self._listeners):
+            listener(tags)
+
+    def clear(self, notify=True):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._tags.clear()
+        if not notify:
+            return
+        for listener in list(self._listeners):
+            listener(None)
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+def cached(cache, tags_for):
+    # tags_for(args, result) returns the tags the result depends on. Calls
+    # are keyed on their arguments bound to the function's parameters with
+    # defaults filled in, so f(2, d), f(2, d, "00:00") and f(2, d, limit=10)
+    # share an entry, and args always holds every positional parameter.
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (function.__name__,) + bound.args + tuple(sorted(bound.kwargs.items()))
+            value = cache.get(key, _MISSING)
+            if value is not _MISSING:
+                return list(value)
+            generation = cache.generation
+            result = function(*bound.args, **bound.kwargs)
+            cache.put(key, tuple(result), tags_for(bound.args, result), generation)
+            return result
+        return wrapper
+    return decorator
+
+
+# Shared by the schedule reads in app.py and every module that writes offerings
+schedule_cache = QueryCache()
@@ -0,0 +1,197 @@
+import argparse
+import sys
+import time
+
+from db_pool import pooled_connection
+from timecodes import from_day_number, from_minute, to_day_number
+from writer import get_writer
+
+# Boardings and alightings from the ridership aggregate tables. Triggers on
+# ActualTripStopData (migration 6) keep RidershipStopDay, RidershipTripDay
+# and RidershipRouteHour current on every insert, upsert and delete, so the
+# queries below never touch the stop-level rows. rebuild() recomputes a date
+# range from scratch after a backfill or a manual fix-up. Days that have been
+# archived (archive.py) keep their aggregates: their stop rows are no longer
+# all in ActualTripStopData, so rebuild() leaves them alone.
+
+AGGREGATE_TABLES = ("RidershipStopDay", "RidershipTripDay", "RidershipRouteHour")
+
+# True when the day has not been moved into a month archive
+NOT_ARCHIVED = '''
+    NOT EXISTS (SELECT 1 FROM ArchivedMonth m WHERE m.LastDay >= {day} AND m.FirstDay <= {day})
+'''
+
+REBUILD_SQL = [
+    f'''
+    INSERT INTO RidershipStopDay
+    SELECT StopNumber, DayNumber, SUM(COALESCE(NumberOfPassengerIn, 0)),
+           SUM(COALESCE(NumberOfPassengerOut, 0)), COUNT(*)
+    FROM ActualTripStopData
+    WHERE DayNumber BETWEEN ? AND ? AND {NOT_ARCHIVED.format(day="DayNumber")}
+    GROUP BY StopNumber, DayNumber
+    ''',
+    f'''
+    INSERT INTO RidershipTripDay
+    SELECT TripNumber, DayNumber, SUM(COALESCE(NumberOfPassengerIn, 0)),
+           SUM(COALESCE(NumberOfPassengerOut, 0)), COUNT(*)
+    FROM ActualTripStopData
+    WHERE DayNumber BETWEEN ? AND ? AND {NOT_ARCHIVED.format(day="DayNumber")}
+    GROUP BY TripNumber, DayNumber
+    ''',
+    f'''
+    INSERT INTO RidershipRouteHour
+    SELECT t.StartLocationName, t.DestinationName, a.DayNumber,
+           (COALESCE(a.ScheduledArrivalMinute, a.StartMinute) / 60) % 24,
+           SUM(COALESCE(a.NumberOfPassengerIn, 0)), SUM(COALESCE(a.NumberOfPassengerOut, 0)),
+           COUNT(*)
+    FROM ActualTripStopData a
+    JOIN Trip t ON t.TripNumber = a.TripNumber
+    WHERE a.DayNumber BETWEEN ? AND ? AND {NOT_ARCHIVED.format(day="a.DayNumber")}
+    GROUP BY 1, 2, 3, 4
+    ''',
+]
+
+FIRST_DAY = -(1 << 31)
+LAST_DAY = (1 << 31) - 1
+
+
+def _days(first_date, last_date):
+    return (FIRST_DAY if first_date is None else to_day_number(first_date),
+            LAST_DAY if last_date is None else to_day_number(last_date))
+
+
+def _rebuild(connection, days):
+    for table in AGGREGATE_TABLES:
+        connection.execute(f'''
+            DELETE FROM {table}
+            WHERE DayNumber BETWEEN ? AND ? AND {NOT_ARCHIVED.format(day="DayNumber")}
+        ''', days)
+    return {table: connection.execute(sql, days).rowcount
+            for table, sql in zip(AGGREGATE_TABLES, REBUILD_SQL)}
+
+
+def rebuild(first_date=None, last_date=None):
+    # Replaces the aggregates for the range's unarchived days in one write;
+    # returns the number of aggregate rows written per table
+    return get_writer().execute(_rebuild, _days(first_date, last_date))
+
+
+def stop_ridership(stop_number, first_date=None, last_date=None):
+    # (date, boardings, alightings, stops recorded) per day
+    with pooled_connection() as connection:
+        cursor = connection.execute('''
+            SELECT DayNumber, Boardings, Alightings, Observations
+            FROM RidershipStopDay
+            WHERE StopNumber = ? AND DayNumber BETWEEN ? AND ?
+            ORDER BY DayNumber
+        ''', (stop_number,) + _days(first_date, last_date))
+        return [(from_day_number(day), boardings, alightings, observations)
+                for day, boardings, alightings, observations in cursor]
+
+
+def trip_ridership(trip_number, first_date=None, last_date=None):
+    # (date, boardings, alightings, stops recorded) per day
+    with pooled_connection() as connection:
+        cursor = connection.execute('''
+            SELECT DayNumber, Boardings, Alightings, Observations
+            FROM RidershipTripDay
+            WHERE TripNumber = ? AND DayNumber BETWEEN ? AND ?
+            ORDER BY DayNumber
+        ''', (trip_number,) + _days(first_date, last_date))
+        return [(from_day_number(day), boardings, alightings, observations)
+                for day, boardings, alightings, observations in cursor]
+
+
+def route_hourly(start_location, destination, first_date=None, last_date=None):
+    # ('HH:00', boardings, alightings) per hour of day, summed over the range
+    with pooled_connection() as connection:
+        cursor = connection.execute('''
+            SELECT Hour, SUM(Boardings), SUM(Alightings)
+            FROM RidershipRouteHour
+            WHERE StartLocationName = ? AND DestinationName = ?
+            AND DayNumber BETWEEN ? AND ?
+            GROUP BY Hour
+            ORDER BY Hour
+        ''', (start_location, destination) + _days(first_date, last_date))
+        return [(from_minute(hour * 60), boardings, alightings)
+                for hour, boardings, alightings in cursor]
+
+
+def busiest_stops(first_date=None, last_date=None, limit=10):
+    # (stop, address, boardings, alightings), most boardings first
+    with pooled_connection() as connection:
+        cursor = connection.execute('''
+            SELECT r.StopNumber, s.StopAddress, SUM(r.Boardings) AS boardings, SUM(r.Alightings)
+            FROM RidershipStopDay r
+            LEFT JOIN Stop s ON s.StopNumber = r.StopNumber
+            WHERE r.DayNumber BETWEEN ? AND ?
+            GROUP BY r.StopNumber
+            ORDER BY boardings DESC
+            LIMIT ?
+        ''', _days(first_date, last_date) + (limit,))
+        return cursor.fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ridership from the aggregate tables")
+    parser.add_argument("--db", help="Database file (defaults to POMONA_TRANSIT_DB)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def command(name, help):
+        sub = commands.add_parser(name, help=help)
+        sub.add_argument("--from", dest="first_date", help="First date (YYYY-MM-DD)")
+        sub.add_argument("--to", dest="last_date", help="Last date (YYYY-MM-DD)")
+        return sub
+
+    command("rebuild", "Recompute the aggregates for a date range")
+    command("stop", "Daily ridership at one stop").add_argument("stop_number", type=int)
+    command("trip", "Daily ridership on one trip").add_argument("trip_number", type=int)
+    route = command("route", "Ridership by hour on one route")
+    route.add_argument("start_location")
+    route.add_argument("destination")
+    command("top", "Stops with the most boardings").add_argument("--limit", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    from app import setup_database
+    from db_pool import configure_pool
+
+    if args.db:
+        configure_pool(args.db, size=1)
+    setup_database()
+
+    try:
+        if args.command == "rebuild":
+            started = time.perf_counter()
+            counts = rebuild(args.first_date, args.last_date)
+            for table, count in counts.items():
+                print(f"{table}: {count}")
+            print(f"Rebuilt in {time.perf_counter() - started:.1f}s")
+        elif args.command in ("stop", "trip"):
+            if args.command == "stop":
+                rows = stop_ridership(args.stop_number, args.first_date, args.last_date)
+            else:
+                rows = trip_ridership(args.trip_number, args.first_date, args.last_date)
+            print("Date | Boardings | Alightings | Stops Recorded")
+            print("-" * 50)
+            for date, boardings, alightings, observations in rows:
+                print(f"{date} | {boardings:^9} | {alightings:^10} | {observations}")
+        elif args.command == "route":
+            print("Hour | Boardings | Alightings")
+            print("-" * 35)
+            for hour, boardings, alightings in route_hourly(
+                    args.start_location, args.destination, args.first_date, args.last_date):
+                print(f"{hour} | {boardings:^9} | {alightings}")
+        else:
+            print("Stop # | Address | Boardings | Alightings")
+            print("-" * 60)
+            for stop, address, boardings, alightings in busiest_stops(
+                    args.first_date, args.last_date, args.limit):
+                print(f"{stop} | {address} | {boardings} | {alightings}")
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
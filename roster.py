@@ -0,0 +1,219 @@
+import argparse
+import csv
+import json
+import sys
+import time
+from collections import namedtuple
+from itertools import groupby
+
+from service_calendar import offerings_source
+from snapshot import read_connection
+from timecodes import from_day_number, from_minute, to_day_number
+
+# Weekly roster for every driver at once. One query walks the Driver table
+# in name order and, for each driver, the week's slice of the covering
+# (DriverName, DayNumber, StartMinute, ArrivalMinute) index, so rows arrive
+# already grouped by driver with no sort over the whole week, and drivers
+# are cut from them as they go past. Offerings are read as
+# display_driver_weekly_schedule sees them (explicit, archived and
+# pattern-expanded). Duty totals are folded in on the same pass.
+
+# Per-driver duty totals, in minutes. A gap is the time between the end of
+# one trip and the start of the next on the same day (negative when they
+# overlap); rest is the time between the last trip of one working day and
+# the first of the next.
+Duty = namedtuple("Duty", [
+    "trips", "days", "duty_minutes", "max_spread_minutes", "min_gap_minutes", "min_rest_minutes",
+])
+
+SHIFT_COLUMNS = ("DriverName", "TripNumber", "StartLocationName", "DestinationName",
+                 "Date", "ScheduledStartTime", "ScheduledArrivalTime")
+DUTY_COLUMNS = ("DriverName",) + Duty._fields
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def _end(start, arrival):
+    # Minutes from the start of the offering's day; an arrival before the
+    # start is on the next day
+    if arrival is None:
+        return start
+    return arrival + 1440 if arrival < start else arrival
+
+
+def duty(rows):
+    # rows: (trip, origin, destination, day, start minute, arrival minute)
+    # for one driver, in day and start order
+    duty_minutes = 0
+    max_spread = 0
+    min_gap = None
+    min_rest = None
+    days = 0
+    previous_day = previous_end = day_start = None
+    for _, _, _, day, start, arrival in rows:
+        end = _end(start, arrival)
+        duty_minutes += end - start
+        if day != previous_day:
+            if previous_day is not None:
+                rest = (day - previous_day) * 1440 + start - previous_end
+                min_rest = rest if min_rest is None else min(min_rest, rest)
+            days += 1
+            day_start = start
+        else:
+            gap = start - previous_end
+            min_gap = gap if min_gap is None else min(min_gap, gap)
+        max_spread = max(max_spread, end - day_start)
+        previous_day, previous_end = day, end
+    return Duty(len(rows), days, duty_minutes, max_spread, min_gap, min_rest)
+
+
+def _shift(row):
+    trip, origin, destination, day, start, arrival = row
+    return (trip, origin, destination, from_day_number(day), from_minute(start), from_minute(arrival))
+
+
+def weekly_roster(start_date, with_duty=False, all_drivers=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Yields (driver, shifts, duty) in driver name order. shifts are the
+    # rows display_driver_weekly_schedule returns for that driver; duty is
+    # a Duty, or None unless with_duty. With all_drivers, drivers with no
+    # trips that week are included with no shifts.
+    first_day = to_day_number(start_date)
+    with read_connection() as connection:
+        offerings = offerings_source(connection, first_day, first_day + 6)
+        # CROSS JOIN keeps Driver as the outer loop, as LEFT JOIN does
+        cursor = connection.execute(f'''
+            SELECT d.DriverName, tr.TripNumber, t.StartLocationName, t.DestinationName,
+                   tr.DayNumber, tr.StartMinute, tr.ArrivalMinute
+            FROM Driver d
+            {"LEFT" if all_drivers else "CROSS"} JOIN {offerings} tr
+                ON tr.DriverName = d.DriverName AND tr.DayNumber BETWEEN ? AND ?
+            LEFT JOIN Trip t ON t.TripNumber = tr.TripNumber
+            ORDER BY d.DriverName, tr.DayNumber, tr.StartMinute
+        ''', (first_day, first_day + 6))
+        cursor.arraysize = chunk_size
+
+        def rows():
+            while True:
+                chunk = cursor.fetchmany()
+                if not chunk:
+                    return
+                yield from chunk
+
+        for driver, driver_rows in groupby(rows(), key=lambda row: row[0]):
+            # An idle driver's single row has no trip
+            driver_rows = [row[1:] for row in driver_rows if row[1] is not None]
+            yield (driver, [_shift(row) for row in driver_rows],
+                   duty(driver_rows) if with_duty else None)
+
+
+# === Writers ===
+# Each takes the open text output and the roster iterator, and returns the
+# number of drivers written.
+
+def write_text(output, roster):
+    count = 0
+    for driver, shifts, totals in roster:
+        output.write(f"\n{driver}\n")
+        if totals is not None:
+            output.write(f"  {totals.trips} trips on {totals.days} days, "
+                         f"{totals.duty_minutes / 60:.1f} duty hours, "
+                         f"longest day {totals.max_spread_minutes / 60:.1f}h, "
+                         f"shortest gap {_minutes(totals.min_gap_minutes)}, "
+                         f"shortest rest {_minutes(totals.min_rest_minutes)}\n")
+        if not shifts:
+            output.write("  No trips this week.\n")
+        for trip, origin, destination, date, start, arrival in shifts:
+            output.write(f"  {date} {start}-{arrival} | Trip {trip} | {origin} -> {destination}\n")
+        count += 1
+    return count
+
+
+def write_csv(output, roster):
+    # One row per shift; drivers with no shifts get a row with only their name
+    writer = csv.writer(output)
+    writer.writerow(SHIFT_COLUMNS)
+    count = 0
+    for driver, shifts, _ in roster:
+        writer.writerows((driver,) + shift for shift in shifts)
+        if not shifts:
+            writer.writerow((driver,))
+        count += 1
+    return count
+
+
+def write_duty_csv(output, roster):
+    # One row per driver with the duty totals
+    writer = csv.writer(output)
+    writer.writerow(DUTY_COLUMNS)
+    count = 0
+    for driver, _, totals in roster:
+        writer.writerow((driver,) + totals)
+        count += 1
+    return count
+
+
+def write_jsonl(output, roster):
+    # One object per driver
+    names = ("trip", "from", "to", "date", "start", "arrival")
+    count = 0
+    for driver, shifts, totals in roster:
+        record = {"driver": driver, "shifts": [dict(zip(names, shift)) for shift in shifts]}
+        if totals is not None:
+            record["duty"] = totals._asdict()
+        output.write(json.dumps(record) + "\n")
+        count += 1
+    return count
+
+
+WRITERS = {
+    "text": write_text,
+    "csv": write_csv,
+    "duty-csv": write_duty_csv,
+    "jsonl": write_jsonl,
+}
+
+
+def _minutes(value):
+    return "-" if value is None else f"{value // 60}h{value % 60:02d}"
+
+
+def write_roster(start_date, format, output, with_duty=False, all_drivers=False):
+    # output is a path, or "-" for stdout. Returns the number of drivers written.
+    writer = WRITERS[format]
+    roster = weekly_roster(start_date, with_duty or format == "duty-csv", all_drivers)
+    if output == "-":
+        return writer(sys.stdout, roster)
+    with open(output, "w", newline="" if format.endswith("csv") else None) as handle:
+        return writer(handle, roster)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Weekly roster for every driver")
+    parser.add_argument("start_date", help="First day of the week (YYYY-MM-DD)")
+    parser.add_argument("--format", choices=list(WRITERS), default="text",
+                        help="duty-csv writes one row of duty totals per driver")
+    parser.add_argument("--output", default="-", help="Output file, or - for stdout")
+    parser.add_argument("--duty", action="store_true", help="Include duty hours, gaps and rest")
+    parser.add_argument("--all-drivers", action="store_true", help="Include drivers with no trips")
+    parser.add_argument("--db", help="Database file (defaults to POMONA_TRANSIT_DB)")
+    args = parser.parse_args(argv)
+
+    from app import setup_database
+    from db_pool import configure_pool
+
+    if args.db:
+        configure_pool(args.db, size=1)
+    setup_database()
+
+    started = time.perf_counter()
+    try:
+        count = write_roster(args.start_date, args.format, args.output, args.duty, args.all_drivers)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"{count} drivers in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
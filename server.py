@@ -0,0 +1,376 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import app
+from bookings import BookingConflict
+from bookings import describe as describe_conflict
+from db_pool import get_pool
+from query_cache import schedule_cache
+from writer import get_writer
+
+# HTTP/JSON front end. The event loop only parses requests and writes
+# responses; every app function runs on a bounded thread pool, one pooled
+# connection per worker. Requests beyond workers + queue_limit in flight
+# are turned away at once with 503 rather than queued without bound, and a
+# request that takes longer than the timeout gets 504 (the worker finishes
+# it in the background, as SQLite work cannot be interrupted from here).
+#
+#   GET    /schedule?from=&to=&date=
+#   GET    /departures?stop=&date=&after=&limit=
+#   GET    /trips/<trip>/stops
+#   GET    /drivers/<name>/week?start=
+#   GET    /actual?trip=&date=&start=
+#   POST   /drivers           {"name", "phone"}
+#   POST   /buses             {"bus_id", "model", "year"}
+#   POST   /offerings         {"trip", "date", "start", "arrival", "driver", "bus"}
+#   DELETE /drivers/<name>, /buses/<id>, /trips/<trip>
+#   GET    /health, /stats
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 8
+DEFAULT_QUEUE_LIMIT = 64
+DEFAULT_TIMEOUT = 5.0
+HEADER_TIMEOUT = 10.0
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+
+STATUS_TEXT = {
+    200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+    500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _rows(names, rows):
+    return [dict(zip(names, row)) for row in rows]
+
+
+def _required(values, *names):
+    missing = [name for name in names if values.get(name) in (None, "")]
+    if missing:
+        raise HTTPError(400, f"Missing {', '.join(missing)}")
+    return [values[name] for name in names]
+
+
+def _int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"{name} must be an integer") from None
+
+
+# === Handlers ===
+# Each runs on a worker thread and returns (status, JSON-serializable body)
+def schedule(query, body):
+    start, destination, date = _required(query, "from", "to", "date")
+    return 200, _rows(("trip", "start", "arrival", "driver", "bus"),
+                      app.display_schedule(start, destination, date))
+
+
+def departures(query, body):
+    stop, date = _required(query, "stop", "date")
+    rows = app.display_departure_board(_int(stop, "stop"), date, query.get("after") or "00:00",
+                                       _int(query.get("limit", 10), "limit"))
+    return 200, _rows(("time", "trip", "trip_start", "from", "to", "driver", "bus"), rows)
+
+
+def trip_stops(query, body, trip):
+    return 200, _rows(("trip", "stop", "address", "sequence", "driving_time"),
+                      app.display_trip_stops(_int(trip, "trip")))
+
+
+def driver_week(query, body, name):
+    (start,) = _required(query, "start")
+    return 200, _rows(("trip", "from", "to", "date", "start", "arrival"),
+                      app.display_driver_weekly_schedule(name, start))
+
+
+def actual(query, body):
+    trip, date, start = _required(query, "trip", "date", "start")
+    return 200, _rows(("stop", "address", "scheduled_arrival", "actual_start", "actual_arrival",
+                       "passengers_in", "passengers_out"),
+                      app.display_actual_trip_data(_int(trip, "trip"), date, start))
+
+
+def add_driver(query, body):
+    name, phone = _required(body, "name", "phone")
+    try:
+        app.add_driver(name, phone)
+    except sqlite3.IntegrityError:
+        raise HTTPError(409, "Driver already exists") from None
+    return 201, {"name": name}
+
+
+def add_bus(query, body):
+    bus_id, model, year = _required(body, "bus_id", "model", "year")
+    if not app.add_bus(_int(bus_id, "bus_id"), model, _int(year, "year")):
+        raise HTTPError(409, "Bus ID already exists")
+    return 201, {"bus_id": bus_id}
+
+
+def add_offering(query, body):
+    trip, date, start, arrival, driver, bus = _required(
+        body, "trip", "date", "start", "arrival", "driver", "bus")
+    try:
+        app.add_trip_offering(_int(trip, "trip"), date, start, arrival, driver, _int(bus, "bus"))
+    except BookingConflict as e:
+        raise HTTPError(409, "; ".join(describe_conflict(conflict) for conflict in e.conflicts)) from None
+    except sqlite3.IntegrityError as e:
+        raise HTTPError(409, str(e)) from None
+    return 201, {"trip": trip, "date": date, "start": start}
+
+
+def delete_driver(query, body, name):
+    if not app.delete_driver(name):
+        raise HTTPError(409, "Driver is assigned to trip offerings or could not be deleted")
+    return 200, {"deleted": name}
+
+
+def delete_bus(query, body, bus_id):
+    if not app.delete_bus(_int(bus_id, "bus_id")):
+        raise HTTPError(409, "Bus is assigned to trip offerings or could not be deleted")
+    return 200, {"deleted": bus_id}
+
+
+def delete_trip(query, body, trip):
+    if not app.delete_trip(_int(trip, "trip")):
+        raise HTTPError(500, "Trip could not be deleted")
+    return 200, {"deleted": trip}
+
+
+# (method, path segments) -> handler; "*" segments are passed as arguments
+ROUTES = {
+    ("GET", ("schedule",)): schedule,
+    ("GET", ("departures",)): departures,
+    ("GET", ("trips", "*", "stops")): trip_stops,
+    ("GET", ("drivers", "*", "week")): driver_week,
+    ("GET", ("actual",)): actual,
+    ("POST", ("drivers",)): add_driver,
+    ("POST", ("buses",)): add_bus,
+    ("POST", ("offerings",)): add_offering,
+    ("DELETE", ("drivers", "*")): delete_driver,
+    ("DELETE", ("buses", "*")): delete_bus,
+    ("DELETE", ("trips", "*")): delete_trip,
+}
+
+
+def route(method, path):
+    segments = tuple(unquote(segment) for segment in path.strip("/").split("/") if segment)
+    allowed = False
+    for (route_method, pattern), handler in ROUTES.items():
+        if len(pattern) != len(segments):
+            continue
+        if any(part != "*" and part != segment for part, segment in zip(pattern, segments)):
+            continue
+        if route_method != method:
+            allowed = True
+            continue
+        return handler, [segment for part, segment in zip(pattern, segments) if part == "*"]
+    raise HTTPError(405 if allowed else 404, "Method not allowed" if allowed else "Not found")
+
+
+def run_handler(handler, query, body, arguments):
+    try:
+        return handler(query, body, *arguments)
+    except HTTPError as e:
+        return e.status, {"error": str(e)}
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    except sqlite3.Error as e:
+        return 500, {"error": str(e)}
+
+
+class TransitServer:
+    def __init__(self, workers=DEFAULT_WORKERS, queue_limit=DEFAULT_QUEUE_LIMIT, timeout=DEFAULT_TIMEOUT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http-worker")
+        self._in_flight = 0
+        self._started = time.perf_counter()
+
+        self.requests = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.statuses = {}
+        self.max_in_flight = 0
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._started
+        return {
+            "requests": self.requests,
+            "requests_per_second": self.requests / elapsed if elapsed else 0.0,
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "pool": get_pool().stats(),
+            "writer": get_writer().stats(),
+            "cache": schedule_cache.stats(),
+        }
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        if method == "GET" and url.path == "/health":
+            return 200, {"status": "ok"}
+        if method == "GET" and url.path == "/stats":
+            return 200, self.stats()
+        handler, arguments = route(method, url.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        # Backpressure: refuse rather than queue without bound
+        if self._in_flight >= self.workers + self.queue_limit:
+            self.rejected += 1
+            raise HTTPError(503, "Server busy, retry later")
+        self._in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            loop = asyncio.get_running_loop()
+            work = loop.run_in_executor(self.executor, run_handler, handler, query, body, arguments)
+            try:
+                return await asyncio.wait_for(asyncio.shield(work), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise HTTPError(504, f"Request took longer than {self.timeout}s") from None
+        finally:
+            self._in_flight -= 1
+
+    async def read_request(self, reader):
+        # (method, target, headers, body), or None when the client is done
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEADER_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(413, "Request headers too large") from None
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line") from None
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        length = _int(headers.get("content-length", 0), "Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, "Request body too large")
+        body = {}
+        if length:
+            raw = await asyncio.wait_for(reader.readexactly(length), HEADER_TIMEOUT)
+            try:
+                body = json.loads(raw)
+            except ValueError:
+                raise HTTPError(400, "Body is not valid JSON") from None
+            if not isinstance(body, dict):
+                raise HTTPError(400, "Body must be a JSON object")
+        return method.upper(), target, headers, body
+
+    async def handle_connection(self, reader, writer):
+        # HTTP/1.1 keep-alive: requests on one connection are served in turn
+        try:
+            while True:
+                # A request that could not be parsed leaves the stream in an
+                # unknown state, so the connection is closed after answering
+                keep_alive = False
+                try:
+                    request = await self.read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                    status, payload = await self.dispatch(method, target, body)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except Exception as e:
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                    keep_alive = False
+                self.requests += 1
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+
+                data = json.dumps(payload).encode()
+                writer.write((
+                    f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    + ("Retry-After: 1\r\n" if status == 503 else "")
+                    + f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                ).encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, ready=None):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        if ready is not None:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP/JSON front end for the transit system")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Threads running database work, one pooled connection each")
+    parser.add_argument("--queue-limit", type=int, default=DEFAULT_QUEUE_LIMIT,
+                        help="Requests allowed to wait for a worker before 503s")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="Seconds per request")
+    parser.add_argument("--db", help="Database file (defaults to POMONA_TRANSIT_DB)")
+    args = parser.parse_args(argv)
+
+    from db_pool import DEFAULT_DB_PATH, configure_pool
+    from instrumentation import enable_from_environment
+    from snapshot import enable_from_environment as enable_snapshots_from_environment
+
+    # One connection per worker, plus the writer thread's
+    configure_pool(args.db or DEFAULT_DB_PATH, size=args.workers + 1)
+    app.setup_database()
+    enable_from_environment(app)
+    enable_snapshots_from_environment()
+
+    server = TransitServer(args.workers, args.queue_limit, args.timeout)
+
+    def ready(listener):
+        host, port = listener.sockets[0].getsockname()[:2]
+        print(f"Serving on http://{host}:{port} with {args.workers} workers", flush=True)
+
+    try:
+        asyncio.run(server.serve(args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+import argparse
+import sys
+
+from archive import table_source
+from db_pool import pooled_connection
+from query_cache import schedule_cache
+from timecodes import from_day_number, from_minute, to_day_number, to_minute
+from writer import get_writer
+
+# Recurring service. A ServicePattern is a weekly template for one departure
+# of a trip (start and arrival time, default driver and bus) between two
+# dates, with ServiceException rows cancelling or adding single days. Nothing
+# is materialized: offerings_source() expands the patterns for the dates a
+# query asks about and merges them with the explicit TripOfferingData rows,
+# which override a pattern's departure on their day.
+
+WEEKDAY_NAMES = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+EVERY_DAY = 0b1111111
+
+
+def parse_weekdays(value):
+    # "1111100" (Monday first, as in GTFS calendar.txt), "mon,wed,fri",
+    # or a bit mask
+    if isinstance(value, int):
+        mask = value
+    elif len(value) == 7 and set(value) <= {"0", "1"}:
+        mask = sum(1 << i for i, flag in enumerate(value) if flag == "1")
+    else:
+        mask = 0
+        for name in value.lower().replace(" ", "").split(","):
+            if name[:3] not in WEEKDAY_NAMES:
+                raise ValueError(f"Invalid weekday {name!r}, expected one of {', '.join(WEEKDAY_NAMES)}")
+            mask |= 1 << WEEKDAY_NAMES.index(name[:3])
+    if not 0 < mask <= EVERY_DAY:
+        raise ValueError(f"Invalid weekdays {value!r}")
+    return mask
+
+
+def format_weekdays(mask):
+    return "".join("1" if mask >> i & 1 else "0" for i in range(7))
+
+
+def _weekday(day):
+    # Monday = 0; day 0 (1970-01-01) was a Thursday
+    return f"((({day}) % 7 + 10) % 7)"
+
+
+def expansion_sql(first_day, last_day, offerings="TripOfferingData"):
+    # TripOfferingData-shaped rows for every pattern departure in the range
+    # that no explicit offering (read from `offerings`) overrides. The bounds
+    # are integers from to_day_number(), so they are inlined like the table
+    # names from table_source().
+    first_day, last_day = int(first_day), int(last_day)
+    return f'''
+        WITH RECURSIVE service_days(DayNumber) AS (
+            SELECT {first_day}
+            UNION ALL
+            SELECT DayNumber + 1 FROM service_days WHERE DayNumber < {last_day}
+        )
+        SELECT p.TripNumber, d.DayNumber, p.StartMinute, p.ArrivalMinute, p.DriverName, p.BusID
+        FROM ServicePattern p
+        JOIN service_days d ON d.DayNumber BETWEEN p.FirstDay AND p.LastDay
+        LEFT JOIN ServiceException e ON e.PatternID = p.PatternID AND e.DayNumber = d.DayNumber
+        WHERE p.LastDay >= {first_day} AND p.FirstDay <= {last_day}
+        AND COALESCE(e.Running, p.Weekdays >> {_weekday("d.DayNumber")} & 1)
+        AND NOT EXISTS (
+            SELECT 1 FROM {offerings} o
+            WHERE o.TripNumber = p.TripNumber AND o.DayNumber = d.DayNumber
+            AND o.StartMinute = p.StartMinute
+        )'''
+
+
+def offerings_source(connection, first_day, last_day=None):
+    # What to put after FROM to read offerings for the range, like
+    # archive.table_source(): explicit offerings (hot or archived) plus the
+    # pattern departures. Ranges no pattern covers get the plain source.
+    last_day = first_day if last_day is None else last_day
+    offerings = table_source(connection, "TripOfferingData", first_day, last_day)
+    patterns = connection.execute('''
+        SELECT EXISTS (SELECT 1 FROM ServicePattern WHERE LastDay >= ? AND FirstDay <= ?)
+    ''', (first_day, last_day)).fetchone()[0]
+    if not patterns:
+        return offerings
+    return (f"(SELECT * FROM {offerings} UNION ALL "
+            f"SELECT * FROM ({expansion_sql(first_day, last_day, offerings)}))")
+
+
+def offering_exists(connection, trip_number, day, start):
+    # Whether stop data can be recorded for the departure: an explicit
+    # offering or a pattern departure, on a day not yet archived (archived
+    # months are read-only history)
+    archived = connection.execute('''
+        SELECT EXISTS (SELECT 1 FROM ArchivedMonth WHERE LastDay >= ? AND FirstDay <= ?)
+    ''', (day, day)).fetchone()[0]
+    if archived:
+        return False
+    explicit = connection.execute('''
+        SELECT EXISTS (
+            SELECT 1 FROM TripOfferingData
+            WHERE TripNumber = ? AND DayNumber = ? AND StartMinute = ?
+        )
+    ''', (trip_number, day, start)).fetchone()[0]
+    if explicit:
+        return True
+    # The day's expansion is a handful of rows (one per pattern)
+    return bool(connection.execute(f'''
+        SELECT EXISTS (
+            SELECT 1 FROM ({expansion_sql(day, day)})
+            WHERE TripNumber = ? AND StartMinute = ?
+        )
+    ''', (trip_number, start)).fetchone()[0])
+
+
+# === Writes ===
+# Operations for the single writer (writer.py). A pattern change can alter
+# any day in its range, so every day is invalidated, along with the drivers
+# involved, and a ("pattern", trip) tag tells listeners the days' departures
+# changed. The trip itself is unchanged: listeners read a ("trip", n) tag
+# as the trip's route or offerings being replaced, so it is not sent.
+def _invalidate(pattern):
+    trip_number, driver, first_day, last_day = pattern
+    tags = [("day", day) for day in range(first_day, last_day + 1)]
+    schedule_cache.invalidate(("pattern", trip_number), ("driver", driver), *tags)
+
+
+def _pattern(connection, pattern_id):
+    row = connection.execute('''
+        SELECT TripNumber, DriverName, FirstDay, LastDay FROM ServicePattern WHERE PatternID = ?
+    ''', (pattern_id,)).fetchone()
+    if row is None:
+        raise ValueError(f"No service pattern {pattern_id}")
+    return row
+
+
+def _insert_pattern(connection, row):
+    return connection.execute('''
+        INSERT INTO ServicePattern (TripNumber, StartMinute, ArrivalMinute, DriverName,
+                                    BusID, Weekdays, FirstDay, LastDay)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', row).lastrowid
+
+
+def add_service_pattern(trip_number, start_time, arrival_time, weekdays, first_date, last_date,
+                        driver=None, bus_id=None):
+    # Returns the new PatternID
+    first_day, last_day = to_day_number(first_date), to_day_number(last_date)
+    if last_day < first_day:
+        raise ValueError("Last date is before first date")
+    row = (trip_number, to_minute(start_time), to_minute(arrival_time), driver, bus_id,
+           parse_weekdays(weekdays), first_day, last_day)
+    return get_writer().execute(
+        _insert_pattern, row,
+        on_commit=lambda: _invalidate((trip_number, driver, first_day, last_day)))
+
+
+PATTERN_COLUMNS = {
+    "start_time": ("StartMinute", to_minute),
+    "arrival_time": ("ArrivalMinute", to_minute),
+    "driver": ("DriverName", None),
+    "bus_id": ("BusID", None),
+    "weekdays": ("Weekdays", parse_weekdays),
+    "first_date": ("FirstDay", to_day_number),
+    "last_date": ("LastDay", to_day_number),
+}
+
+
+def _update_pattern(connection, pattern_id, assignments, changed):
+    before = _pattern(connection, pattern_id)
+    connection.execute(
+        f"UPDATE ServicePattern SET {', '.join(f'{column} = ?' for column, _ in assignments)} "
+        "WHERE PatternID = ?", [value for _, value in assignments] + [pattern_id])
+    after = _pattern(connection, pattern_id)
+    if after[3] < after[2]:
+        raise ValueError("Last date is before first date")
+    # Both the old and the new range, trip and driver
+    changed.extend([before, after])
+
+
+def update_service_pattern(pattern_id, **changes):
+    # e.g. update_service_pattern(7, driver="Jane Smith") re-crews every
+    # remaining departure in one write
+    assignments = []
+    for name, value in changes.items():
+        if name not in PATTERN_COLUMNS:
+            raise ValueError(f"Unknown pattern field {name!r}")
+        column, convert = PATTERN_COLUMNS[name]
+        assignments.append((column, value if convert is None or value is None else convert(value)))
+    if not assignments:
+        return
+    changed = []
+    get_writer().execute(
+        _update_pattern, pattern_id, assignments, changed,
+        on_commit=lambda: [_invalidate(pattern) for pattern in changed])
+
+
+def _set_exception(connection, pattern_id, day, running):
+    _pattern(connection, pattern_id)
+    connection.execute('''
+        INSERT INTO ServiceException VALUES (?, ?, ?)
+        ON CONFLICT (PatternID, DayNumber) DO UPDATE SET Running = excluded.Running
+    ''', (pattern_id, day, int(running)))
+
+
+def add_service_exception(pattern_id, date, running=False):
+    # running=False cancels the departure on that date; True adds it
+    day = to_day_number(date)
+    with pooled_connection() as connection:
+        pattern = _pattern(connection, pattern_id)
+    get_writer().execute(
+        _set_exception, pattern_id, day, running,
+        on_commit=lambda: _invalidate(pattern[:2] + (day, day)))
+
+
+def _delete_pattern(connection, pattern_id, deleted):
+    deleted.append(_pattern(connection, pattern_id))
+    connection.execute("DELETE FROM ServicePattern WHERE PatternID = ?", (pattern_id,))
+
+
+def delete_service_pattern(pattern_id):
+    deleted = []
+    get_writer().execute(_delete_pattern, pattern_id, deleted,
+                         on_commit=lambda: [_invalidate(pattern) for pattern in deleted])
+
+
+# === Reads ===
+def service_patterns(trip_number=None):
+    # (pattern, trip, start, arrival, driver, bus, weekdays, first date,
+    # last date, exceptions as [(date, running)])
+    with pooled_connection() as connection:
+        where, parameters = ("WHERE TripNumber = ?", (trip_number,)) if trip_number is not None else ("", ())
+        patterns = connection.execute(f'''
+            SELECT PatternID, TripNumber, StartMinute, ArrivalMinute, DriverName, BusID,
+                   Weekdays, FirstDay, LastDay
+            FROM ServicePattern {where}
+            ORDER BY TripNumber, StartMinute, FirstDay
+        ''', parameters).fetchall()
+        exceptions = {}
+        for pattern_id, day, running in connection.execute(
+                "SELECT PatternID, DayNumber, Running FROM ServiceException ORDER BY PatternID, DayNumber"):
+            exceptions.setdefault(pattern_id, []).append((from_day_number(day), bool(running)))
+    return [(pattern_id, trip, from_minute(start), from_minute(arrival), driver, bus_id,
+             format_weekdays(weekdays), from_day_number(first_day), from_day_number(last_day),
+             exceptions.get(pattern_id, []))
+            for pattern_id, trip, start, arrival, driver, bus_id, weekdays, first_day, last_day in patterns]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recurring service patterns")
+    parser.add_argument("--db", help="Database file (defaults to POMONA_TRANSIT_DB)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="Add a weekly pattern for one departure")
+    add.add_argument("trip_number", type=int)
+    add.add_argument("start_time", help="HH:MM")
+    add.add_argument("arrival_time", help="HH:MM")
+    add.add_argument("weekdays", help="1111100 (Monday first) or mon,tue,...")
+    add.add_argument("first_date", help="YYYY-MM-DD")
+    add.add_argument("last_date", help="YYYY-MM-DD")
+    add.add_argument("--driver")
+    add.add_argument("--bus", type=int)
+
+    update = commands.add_parser("update", help="Change a pattern for its whole range")
+    update.add_argument("pattern_id", type=int)
+    for name in PATTERN_COLUMNS:
+        update.add_argument("--" + name.replace("_", "-"), dest=name)
+
+    for name, help in (("cancel", "Cancel a pattern on one date"), ("extra", "Run a pattern on one extra date")):
+        sub = commands.add_parser(name, help=help)
+        sub.add_argument("pattern_id", type=int)
+        sub.add_argument("date", help="YYYY-MM-DD")
+
+    commands.add_parser("delete", help="Delete a pattern").add_argument("pattern_id", type=int)
+    commands.add_parser("list", help="List patterns").add_argument("--trip", type=int)
+    args = parser.parse_args(argv)
+
+    import sqlite3
+
+    from app import setup_database
+    from db_pool import configure_pool
+
+    if args.db:
+        configure_pool(args.db, size=1)
+    setup_database()
+
+    try:
+        if args.command == "add":
+            pattern_id = add_service_pattern(args.trip_number, args.start_time, args.arrival_time,
+                                             args.weekdays, args.first_date, args.last_date,
+                                             args.driver, args.bus)
+            print(f"Added service pattern {pattern_id}")
+        elif args.command == "update":
+            changes = {name: getattr(args, name) for name in PATTERN_COLUMNS
+                       if getattr(args, name) is not None}
+            if "bus_id" in changes:
+                changes["bus_id"] = int(changes["bus_id"])
+            update_service_pattern(args.pattern_id, **changes)
+            print(f"Updated service pattern {args.pattern_id}")
+        elif args.command in ("cancel", "extra"):
+            add_service_exception(args.pattern_id, args.date, running=args.command == "extra")
+            print(f"Recorded exception for pattern {args.pattern_id} on {args.date}")
+        elif args.command == "delete":
+            delete_service_pattern(args.pattern_id)
+            print(f"Deleted service pattern {args.pattern_id}")
+        else:
+            print("Pattern | Trip | Start | Arrival | Driver | Bus | Mon-Sun | From | To | Exceptions")
+            print("-" * 100)
+            for pattern in service_patterns(args.trip):
+                exceptions = ", ".join(f"{'+' if running else '-'}{date}" for date, running in pattern[9])
+                print(" | ".join(str(value) for value in pattern[:9]) + f" | {exceptions}")
+    except (ValueError, sqlite3.Error) as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from db_pool import DEFAULT_MMAP_SIZE, get_pool, pooled_connection
+from query_cache import schedule_cache
+
+# Snapshot reads. Read-only queries can be served from a point-in-time copy
+# of the database made with the sqlite3 backup API, so they never wait on a
+# writer, a bulk load or a checkpoint, and never pay for a long WAL. The copy
+# is rebuilt in the background every refresh_interval seconds if anything
+# has committed, or as soon as refresh_commits writing checkouts have gone
+# back to the pool. Readers see the data as of the last refresh.
+#
+# Opt-in: nothing here runs until enable() is called (or the environment
+# variable POMONA_TRANSIT_SNAPSHOT is set when app.py starts).
+
+DEFAULT_REFRESH_INTERVAL = float(os.environ.get("POMONA_TRANSIT_SNAPSHOT_INTERVAL", "5"))
+DEFAULT_REFRESH_COMMITS = int(os.environ.get("POMONA_TRANSIT_SNAPSHOT_COMMITS", "100"))
+DEFAULT_IDLE_READERS = 4
+
+# Checkout and checkin hooks for snapshot readers, called like the pool's
+# (db_pool.add_hooks). Kept here rather than on a Snapshot so they apply to
+# whichever snapshot is enabled, before or after they are added.
+_reader_checkout_hooks = []
+_reader_checkin_hooks = []
+
+
+class Snapshot:
+    def __init__(self, pool=None, path=None, refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 refresh_commits=DEFAULT_REFRESH_COMMITS, idle_readers=DEFAULT_IDLE_READERS):
+        self.pool = pool or get_pool()
+        self.path = path or self.pool.db_path + ".snapshot"
+        self.refresh_interval = refresh_interval
+        self.refresh_commits = refresh_commits
+        self.idle_readers = idle_readers
+
+        # (generation, connection) pairs; a reader from an older generation
+        # is closed instead of reused
+        self._idle = queue.LifoQueue()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+        # Source of every copy, and of PRAGMA data_version between copies.
+        # Only used under _refresh_lock.
+        self._source = None
+        self._data_version = None
+        self._refresh_lock = threading.Lock()
+
+        # total_changes per checked-out pool connection, to count the
+        # checkouts that wrote something
+        self._changes = {}
+        self._pending = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._reads = 0
+        self._refreshes = 0
+        self._errors = 0
+        self._last_error = None
+        self._refreshed_at = None
+        self._total_refresh = 0.0
+        self._max_refresh = 0.0
+
+    # === Lifecycle ===
+    def start(self):
+        self._source = sqlite3.connect(self.pool.db_path, check_same_thread=False)
+        self.refresh()
+        self.pool.add_hooks(self._on_checkout, self._on_checkin)
+        self._thread = threading.Thread(target=self._run, name="snapshot-refresh", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.pool.remove_hooks(self._on_checkout, self._on_checkin)
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._refresh_lock:
+            if self._source is not None:
+                self._source.close()
+                self._source = None
+        while True:
+            try:
+                _, connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+
+    # === Refresh ===
+    def refresh(self):
+        # Copies the database in one backup step: the source holds a single
+        # read transaction for the whole copy, which in WAL mode never blocks
+        # writers, so the copy is consistent. It is written beside the
+        # snapshot and renamed over it; open readers keep the old file until
+        # they are checked in.
+        with self._refresh_lock:
+            started = time.perf_counter()
+            # Read before copying, so a commit made during the copy still
+            # shows up as a change afterwards
+            data_version = self._source.execute("PRAGMA data_version").fetchone()[0]
+            with self._lock:
+                self._pending = 0
+            building = self.path + ".new"
+            if os.path.exists(building):
+                os.remove(building)
+            target = sqlite3.connect(building)
+            try:
+                self._source.backup(target)
+                # Readers open the copy as immutable, which needs a rollback
+                # journal rather than WAL
+                target.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                target.close()
+            os.replace(building, self.path)
+            self._data_version = data_version
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._generation += 1
+                self._refreshes += 1
+                self._refreshed_at = time.time()
+                self._total_refresh += elapsed
+                self._max_refresh = max(self._max_refresh, elapsed)
+        # Results cached from the previous copy may be older than the new
+        # one. Structures kept by listeners read the live database, so they
+        # are left alone.
+        schedule_cache.clear(notify=False)
+
+    def _changed(self):
+        with self._refresh_lock:
+            return self._source.execute("PRAGMA data_version").fetchone()[0] != self._data_version
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.refresh_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                if self._pending >= self.refresh_commits or self._changed():
+                    self.refresh()
+            except (sqlite3.Error, OSError) as e:
+                with self._lock:
+                    self._errors += 1
+                    self._last_error = str(e)
+
+    def _on_checkout(self, connection):
+        self._changes[id(connection)] = connection.total_changes
+
+    def _on_checkin(self, connection):
+        before = self._changes.pop(id(connection), None)
+        if before is None or connection.total_changes == before:
+            return
+        with self._lock:
+            self._pending += 1
+            due = self._pending >= self.refresh_commits
+        if due:
+            self._wake.set()
+
+    # === Readers ===
+    def _connect(self):
+        uri = "file:" + quote(os.path.abspath(self.path)) + "?immutable=1"
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256)
+        connection.execute("PRAGMA query_only=ON")
+        connection.execute(f"PRAGMA mmap_size={int(DEFAULT_MMAP_SIZE)}")
+        return connection
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            generation = self._generation
+            self._reads += 1
+        connection = None
+        while connection is None:
+            try:
+                reader_generation, reader = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self._connect()
+                break
+            if reader_generation == generation:
+                connection = reader
+            else:
+                reader.close()
+        for hook in _reader_checkout_hooks:
+            hook(connection)
+        try:
+            yield connection
+        finally:
+            for hook in _reader_checkin_hooks:
+                hook(connection)
+            if connection.in_transaction:
+                connection.rollback()
+            if generation == self._generation and self._idle.qsize() < self.idle_readers:
+                self._idle.put((generation, connection))
+            else:
+                connection.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "path": self.path,
+                "generation": self._generation,
+                "reads": self._reads,
+                "refreshes": self._refreshes,
+                "pending_commits": self._pending,
+                "age_seconds": time.time() - self._refreshed_at if self._refreshed_at else None,
+                "total_refresh_seconds": self._total_refresh,
+                "max_refresh_seconds": self._max_refresh,
+                "avg_refresh_seconds": self._total_refresh / self._refreshes if self._refreshes else 0.0,
+                "errors": self._errors,
+                "last_error": self._last_error,
+            }
+
+
+def add_reader_hooks(on_checkout=None, on_checkin=None):
+    if on_checkout is not None:
+        _reader_checkout_hooks.append(on_checkout)
+    if on_checkin is not None:
+        _reader_checkin_hooks.append(on_checkin)
+
+
+def remove_reader_hooks(on_checkout=None, on_checkin=None):
+    if on_checkout in _reader_checkout_hooks:
+        _reader_checkout_hooks.remove(on_checkout)
+    if on_checkin in _reader_checkin_hooks:
+        _reader_checkin_hooks.remove(on_checkin)
+
+
+# === Process-wide snapshot ===
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def enable(pool=None, **options):
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is not None:
+            _snapshot.stop()
+        _snapshot = Snapshot(pool, **options).start()
+        return _snapshot
+
+
+def disable():
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is not None:
+            _snapshot.stop()
+            _snapshot = None
+
+
+def get_snapshot():
+    return _snapshot
+
+
+def read_connection():
+    # The snapshot when snapshot mode is on, otherwise a live pooled connection
+    snapshot = _snapshot
+    if snapshot is None:
+        return pooled_connection()
+    return snapshot.connection()
+
+
+def enable_from_environment():
+    # POMONA_TRANSIT_SNAPSHOT=1 serves the display reads from a snapshot
+    if not os.environ.get("POMONA_TRANSIT_SNAPSHOT"):
+        return None
+    return enable()
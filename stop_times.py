@@ -0,0 +1,128 @@
+import argparse
+import sys
+import time
+
+from db_pool import pooled_connection
+from timecodes import from_minute, to_day_number, to_minute
+from writer import get_writer
+
+# Scheduled arrival at each stop of each offering, from ScheduledStopTime.
+# Every offering's stop times are expanded once, as StartMinute plus the
+# running sum of TripStopInfo.DrivingTime in sequence order, and triggers
+# (migration 8) redo just the affected offerings when offerings or a trip's
+# stops change. rebuild() recomputes a date range from scratch.
+
+REBUILD_SQL = '''
+    INSERT INTO ScheduledStopTime
+    SELECT o.TripNumber, o.DayNumber, o.StartMinute,
+           s.StopNumber, s.SequenceNumber, o.StartMinute + s.Offset
+    FROM (SELECT TripNumber, StopNumber, SequenceNumber,
+                 SUM(COALESCE(DrivingTime, 0)) OVER (
+                     PARTITION BY TripNumber
+                     ORDER BY SequenceNumber, StopNumber ROWS UNBOUNDED PRECEDING) AS Offset
+          FROM TripStopInfo) s
+    JOIN TripOfferingData o ON o.TripNumber = s.TripNumber
+    WHERE o.DayNumber BETWEEN ? AND ?
+'''
+
+FIRST_DAY = -(1 << 31)
+LAST_DAY = (1 << 31) - 1
+
+
+def _days(first_date, last_date):
+    return (FIRST_DAY if first_date is None else to_day_number(first_date),
+            LAST_DAY if last_date is None else to_day_number(last_date))
+
+
+def _rebuild(connection, days):
+    connection.execute("DELETE FROM ScheduledStopTime WHERE DayNumber BETWEEN ? AND ?", days)
+    return connection.execute(REBUILD_SQL, days).rowcount
+
+
+def rebuild(first_date=None, last_date=None):
+    # Replaces the stop times for the range in one write; returns the number
+    # written
+    return get_writer().execute(_rebuild, _days(first_date, last_date))
+
+
+def offering_stop_times(trip_number, date, start_time):
+    # (stop, address, sequence, 'HH:MM') for every stop of one offering,
+    # in route order
+    with pooled_connection() as connection:
+        cursor = connection.execute('''
+            SELECT st.StopNumber, s.StopAddress, st.SequenceNumber, st.ArrivalMinute
+            FROM ScheduledStopTime st
+            LEFT JOIN Stop s ON s.StopNumber = st.StopNumber
+            WHERE st.TripNumber = ? AND st.DayNumber = ? AND st.StartMinute = ?
+            ORDER BY st.ArrivalMinute, st.SequenceNumber
+        ''', (trip_number, to_day_number(date), to_minute(start_time)))
+        return [(stop, address, sequence, from_minute(minute))
+                for stop, address, sequence, minute in cursor]
+
+
+def arrival_at_stop(trip_number, date, start_time, stop_number):
+    # 'HH:MM' the offering is scheduled to reach the stop, or None when the
+    # stop is not on its route
+    with pooled_connection() as connection:
+        row = connection.execute('''
+            SELECT ArrivalMinute FROM ScheduledStopTime
+            WHERE TripNumber = ? AND DayNumber = ? AND StartMinute = ? AND StopNumber = ?
+        ''', (trip_number, to_day_number(date), to_minute(start_time), stop_number)).fetchone()
+    return None if row is None else from_minute(row[0])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scheduled arrival times at each stop")
+    parser.add_argument("--db", help="Database file (defaults to POMONA_TRANSIT_DB)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_command = commands.add_parser("rebuild", help="Recompute the stop times for a date range")
+    rebuild_command.add_argument("--from", dest="first_date", help="First date (YYYY-MM-DD)")
+    rebuild_command.add_argument("--to", dest="last_date", help="Last date (YYYY-MM-DD)")
+
+    def offering(name, help):
+        sub = commands.add_parser(name, help=help)
+        sub.add_argument("trip_number", type=int)
+        sub.add_argument("date", help="YYYY-MM-DD")
+        sub.add_argument("start_time", help="Scheduled start time (HH:MM)")
+        return sub
+
+    offering("offering", "Every stop of one offering")
+    offering("when", "When one offering reaches a stop").add_argument("stop_number", type=int)
+    args = parser.parse_args(argv)
+
+    from app import setup_database
+    from db_pool import configure_pool
+
+    if args.db:
+        configure_pool(args.db, size=1)
+    setup_database()
+
+    try:
+        if args.command == "rebuild":
+            started = time.perf_counter()
+            count = rebuild(args.first_date, args.last_date)
+            print(f"{count} stop times rebuilt in {time.perf_counter() - started:.1f}s")
+        elif args.command == "offering":
+            rows = offering_stop_times(args.trip_number, args.date, args.start_time)
+            if not rows:
+                print("No stop times found for this offering.")
+                return 1
+            print("Stop # | Address | Sequence | Scheduled Arrival")
+            print("-" * 60)
+            for stop, address, sequence, arrival in rows:
+                print(f"{stop} | {address} | {sequence} | {arrival}")
+        else:
+            arrival = arrival_at_stop(args.trip_number, args.date, args.start_time, args.stop_number)
+            if arrival is None:
+                print("This offering does not stop there.")
+                return 1
+            print(arrival)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from db_pool import get_pool
+from query_cache import schedule_cache
+from service_calendar import offering_exists
+from timecodes import to_day_number, to_minute
+from writer import get_writer
+
+DEFAULT_BATCH_SIZE = 2000
+DEFAULT_MAX_DELAY = 0.25
+DEFAULT_LOOKUP_CACHE_SIZE = 50000
+
+# One stop event reported by a bus. Dates may be 'YYYY-MM-DD' strings, date
+# objects or day numbers; times may be 'HH:MM' strings or minutes.
+StopEvent = namedtuple("StopEvent", [
+    "trip_number", "date", "scheduled_start_time", "stop_number",
+    "scheduled_arrival_time", "actual_start_time", "actual_arrival_time",
+    "passengers_in", "passengers_out",
+], defaults=[None, None, None, None, None])
+
+# Re-sent or partial events for the same offering stop merge into one row;
+# fields a later event leaves empty keep their recorded value
+UPSERT_SQL = '''
+    INSERT INTO ActualTripStopData (
+        TripNumber, DayNumber, StartMinute, StopNumber,
+        ScheduledArrivalMinute, ActualStartMinute, ActualArrivalMinute,
+        NumberOfPassengerIn, NumberOfPassengerOut
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (TripNumber, DayNumber, StartMinute, StopNumber) DO UPDATE SET
+        ScheduledArrivalMinute = COALESCE(excluded.ScheduledArrivalMinute, ScheduledArrivalMinute),
+        ActualStartMinute = COALESCE(excluded.ActualStartMinute, ActualStartMinute),
+        ActualArrivalMinute = COALESCE(excluded.ActualArrivalMinute, ActualArrivalMinute),
+        NumberOfPassengerIn = COALESCE(excluded.NumberOfPassengerIn, NumberOfPassengerIn),
+        NumberOfPassengerOut = COALESCE(excluded.NumberOfPassengerOut, NumberOfPassengerOut)
+'''
+
+
+class RejectedEvent(ValueError):
+    pass
+
+
+class _LookupCache:
+    # Small LRU map used for offering and trip-stop lookups
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def discard_where(self, predicate):
+        for key in [key for key in self._entries if predicate(key)]:
+            del self._entries[key]
+
+
+def write_stop_rows(connection, rows):
+    connection.executemany(UPSERT_SQL, rows)
+
+
+class TelemetryIngestor:
+    def __init__(self, pool=None, batch_size=DEFAULT_BATCH_SIZE, max_delay=DEFAULT_MAX_DELAY,
+                 lookup_cache_size=DEFAULT_LOOKUP_CACHE_SIZE, on_reject=None, cache=schedule_cache):
+        self.pool = pool or get_pool()
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.on_reject = on_reject
+
+        self._offerings = _LookupCache(lookup_cache_size)
+        self._trip_stops = _LookupCache(lookup_cache_size)
+        # Separate from _lock: invalidations arrive on the writer thread
+        # while a flush may hold _lock waiting for that writer
+        self._lookup_lock = threading.Lock()
+        self._cache = cache
+        cache.subscribe(self._on_invalidate)
+        self._buffer = []
+        self._buffer_started = None
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+        self.received = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.failed_flushes = 0
+        self.commit_seconds = 0.0
+
+    # === Validation ===
+    # Lookups only check out a connection on a cache miss. Results are kept
+    # until schedule_cache reports a change to their trip or day, and one
+    # read while such a change was committing is not kept.
+    def _offering_exists(self, key):
+        with self._lookup_lock:
+            if self._offerings.get(key):
+                return True
+            generation = self._cache.generation
+        with self.pool.connection() as connection:
+            found = offering_exists(connection, *key)
+        # Only hits are cached; a missing offering may be added later
+        with self._lookup_lock:
+            if found and self._cache.generation == generation:
+                self._offerings.put(key, True)
+        return bool(found)
+
+    def _stops_for_trip(self, trip_number):
+        with self._lookup_lock:
+            stops = self._trip_stops.get(trip_number)
+            generation = self._cache.generation
+        if stops is None:
+            with self.pool.connection() as connection:
+                stops = frozenset(row[0] for row in connection.execute(
+                    'SELECT StopNumber FROM TripStopInfo WHERE TripNumber = ?', (trip_number,)))
+            with self._lookup_lock:
+                if stops and self._cache.generation == generation:
+                    self._trip_stops.put(trip_number, stops)
+        return stops
+
+    def _to_row(self, event):
+        try:
+            key = (int(event.trip_number), to_day_number(event.date),
+                   to_minute(event.scheduled_start_time))
+            stop_number = int(event.stop_number)
+            row = key + (
+                stop_number,
+                to_minute(event.scheduled_arrival_time),
+                to_minute(event.actual_start_time),
+                to_minute(event.actual_arrival_time),
+                None if event.passengers_in is None else int(event.passengers_in),
+                None if event.passengers_out is None else int(event.passengers_out),
+            )
+        except (TypeError, ValueError) as e:
+            raise RejectedEvent(str(e))
+        if key[2] is None:
+            raise RejectedEvent("Scheduled start time is required")
+        if not self._offering_exists(key):
+            raise RejectedEvent(f"No trip offering {key[0]} on day {key[1]} at minute {key[2]}")
+        if stop_number not in self._stops_for_trip(key[0]):
+            raise RejectedEvent(f"Stop {stop_number} is not on trip {key[0]}")
+        return row
+
+    def _on_invalidate(self, tags):
+        # Offering keys are (trip, day, start): a trip tag (route or
+        # offerings replaced) or a day tag (offerings or pattern departures
+        # added or removed) drops the lookups it covers
+        with self._lookup_lock:
+            if tags is None:
+                self._offerings.clear()
+                self._trip_stops.clear()
+                return
+            trips = {value for kind, value in tags if kind == "trip"}
+            days = {value for kind, value in tags if kind == "day"}
+            if trips or days:
+                self._offerings.discard_where(lambda key: key[0] in trips or key[1] in days)
+            for trip in trips:
+                self._trip_stops.discard_where(lambda key: key == trip)
+
+    def invalidate_lookups(self):
+        # For changes made outside this process's writer
+        with self._lookup_lock:
+            self._offerings.clear()
+            self._trip_stops.clear()
+
+    def close(self):
+        self._cache.unsubscribe(self._on_invalidate)
+
+    # === Group commit ===
+    def submit(self, event):
+        with self._lock:
+            return self._submit_locked(event)
+
+    def submit_many(self, events):
+        with self._lock:
+            return sum(self._submit_locked(event) for event in events)
+
+    def _submit_locked(self, event):
+        self.received += 1
+        try:
+            row = self._to_row(event)
+        except RejectedEvent as e:
+            self.rejected += 1
+            if self.on_reject is not None:
+                self.on_reject(event, e)
+            return False
+        if not self._buffer:
+            self._buffer_started = time.monotonic()
+        self._buffer.append(row)
+        if self._flush_due():
+            self._flush_locked()
+        return True
+
+    def _flush_due(self):
+        if len(self._buffer) >= self.batch_size:
+            return True
+        return bool(self._buffer) and time.monotonic() - self._buffer_started >= self.max_delay
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def flush_if_due(self):
+        with self._lock:
+            if self._flush_due():
+                self._flush_locked()
+
+    def _flush_locked(self):
+        # The rows stay buffered until their write has committed, so a failed
+        # write raises with nothing lost and the next flush retries it
+        if not self._buffer:
+            return
+        rows = self._buffer
+        started = time.perf_counter()
+        try:
+            get_writer().execute(write_stop_rows, rows)
+        except Exception:
+            self.failed_flushes += 1
+            raise
+        self._buffer = []
+        self.commit_seconds += time.perf_counter() - started
+        self.accepted += len(rows)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(rows))
+
+    def ingest(self, events):
+        with self._lock:
+            for event in events:
+                self._submit_locked(event)
+            self._flush_locked()
+        return self.stats()
+
+    async def ingest_async(self, events):
+        # Consumes an async iterator of events. Events are handed to a worker
+        # thread in chunks for validation and commit, and a quiet stream is
+        # still flushed once max_delay has passed.
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        iterator = events.__aiter__()
+        chunk = []
+        pending = None
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=self.max_delay)
+            if not done:
+                # Keep waiting on the same __anext__(); cancelling it would
+                # close an async generator source
+                await loop.run_in_executor(None, self.submit_many, chunk)
+                await loop.run_in_executor(None, self.flush_if_due)
+                chunk = []
+                continue
+            try:
+                chunk.append(pending.result())
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+            if len(chunk) >= self.batch_size:
+                await loop.run_in_executor(None, self.submit_many, chunk)
+                chunk = []
+        await loop.run_in_executor(None, self.submit_many, chunk)
+        await loop.run_in_executor(None, self.flush)
+        return self.stats()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._started
+        return {
+            "received": self.received,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "pending": len(self._buffer),
+            "batches": self.batches,
+            "largest_batch": self.largest_batch,
+            "failed_flushes": self.failed_flushes,
+            "avg_batch": self.accepted / self.batches if self.batches else 0.0,
+            "commit_seconds": self.commit_seconds,
+            "events_per_second": self.received / elapsed if elapsed else 0.0,
+        }
+
+
+def ingest_stop_events(events, **options):
+    ingestor = TelemetryIngestor(**options)
+    try:
+        return ingestor.ingest(events)
+    finally:
+        ingestor.close()
@@ -0,0 +1,45 @@
+from datetime import date, timedelta
+
+# Dates are stored as day numbers (days since 1970-01-01) and times of day
+# as minutes after midnight, so range predicates and arithmetic stay on
+# plain integers. These helpers convert to and from the text forms that
+# the menus and the compatibility views use.
+EPOCH = date(1970, 1, 1)
+
+
+def to_day_number(value):
+    if isinstance(value, int):
+        return value
+    if isinstance(value, date):
+        return (value - EPOCH).days
+    try:
+        return (date.fromisoformat(value.strip()) - EPOCH).days
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid date {value!r}, expected YYYY-MM-DD")
+
+
+def from_day_number(day_number):
+    if day_number is None:
+        return None
+    return (EPOCH + timedelta(days=day_number)).isoformat()
+
+
+def to_minute(value):
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return value
+    try:
+        hours, minutes = value.strip().split(":")[:2]
+        hours, minutes = int(hours), int(minutes)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid time {value!r}, expected HH:MM")
+    if hours < 0 or not 0 <= minutes < 60:
+        raise ValueError(f"Invalid time {value!r}, expected HH:MM")
+    return hours * 60 + minutes
+
+
+def from_minute(minute):
+    if minute is None:
+        return None
+    return f"{minute // 60:02d}:{minute % 60:02d}"
@@ -0,0 +1,317 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from db_pool import pooled_connection
+from query_cache import schedule_cache
+from timecodes import from_minute, to_day_number, to_minute
+
+# In-memory timetable: one service day's offerings held as parallel arrays
+# sorted by start minute, with hash indexes from route, driver and stop to
+# row positions. Trips (route and stop offsets) are shared by every loaded
+# day. The engine listens to schedule_cache invalidations, so the same tags
+# the writers in app.py already send keep it current:
+#
+#   ("day", n)   re-read that day's offerings and apply the difference
+#   ("trip", n)  re-read the trip's route, and every loaded day it runs on
+#   clear()      drop everything
+
+DEFAULT_MAX_DAYS = 7
+
+
+class Interner:
+    # Maps strings to small integers so columns can be int arrays
+    __slots__ = ("values", "ids")
+
+    def __init__(self):
+        self.values = []
+        self.ids = {}
+
+    def id(self, value):
+        index = self.ids.get(value)
+        if index is None:
+            index = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+    def get(self, value):
+        return self.ids.get(value)
+
+
+class TripRecord:
+    __slots__ = ("number", "origin", "destination", "stops", "offsets")
+
+    def __init__(self, number, origin, destination):
+        self.number = number
+        self.origin = origin
+        self.destination = destination
+        self.stops = array("i")      # StopNumber in SequenceNumber order
+        self.offsets = array("i")    # minutes from the start to each stop
+
+
+class ServiceDay:
+    __slots__ = ("day", "trip", "start", "arrival", "driver", "bus",
+                 "by_route", "by_driver", "by_stop", "indexed")
+
+    def __init__(self, day):
+        self.day = day
+        # Columns, sorted by (start, trip)
+        self.trip = array("i")
+        self.start = array("i")
+        self.arrival = array("i")
+        self.driver = array("i")
+        self.bus = array("i")
+        self.by_route = {}
+        self.by_driver = {}
+        self.by_stop = {}
+        self.indexed = False
+
+    def __len__(self):
+        return len(self.trip)
+
+    def keys(self):
+        return set(zip(self.trip, self.start))
+
+    def position(self, trip, start):
+        # Rows are sorted by (start, trip); search the start range for the trip
+        low = bisect_left(self.start, start)
+        high = bisect_right(self.start, start)
+        for i in range(low, high):
+            if self.trip[i] == trip:
+                return i
+        return None
+
+    def insert(self, trip, start, arrival, driver, bus):
+        low = bisect_left(self.start, start)
+        high = bisect_right(self.start, start)
+        i = low
+        while i < high and self.trip[i] < trip:
+            i += 1
+        for column, value in ((self.trip, trip), (self.start, start), (self.arrival, arrival),
+                              (self.driver, driver), (self.bus, bus)):
+            column.insert(i, value)
+        self.indexed = False
+
+    def delete(self, i):
+        for column in (self.trip, self.start, self.arrival, self.driver, self.bus):
+            del column[i]
+        self.indexed = False
+
+
+class TimetableEngine:
+    def __init__(self, max_days=DEFAULT_MAX_DAYS, cache=schedule_cache):
+        self.max_days = max_days
+        self.locations = Interner()
+        self.drivers = Interner()
+        self.trips = {}
+        self._days = OrderedDict()
+        self._stale_days = set()
+        self._lock = threading.RLock()
+        self._cache = cache
+        self.loads = 0
+        self.refreshes = 0
+        cache.subscribe(self._on_invalidate)
+
+    def close(self):
+        self._cache.unsubscribe(self._on_invalidate)
+        with self._lock:
+            self._days.clear()
+            self.trips.clear()
+
+    # === Keeping in sync ===
+    def _on_invalidate(self, tags):
+        with self._lock:
+            if tags is None:
+                self._days.clear()
+                self._stale_days.clear()
+                self.trips.clear()
+                return
+            for kind, value in tags:
+                if kind == "day" and value in self._days:
+                    self._stale_days.add(value)
+                elif kind == "trip":
+                    self._forget_trip(value)
+
+    def _forget_trip(self, trip):
+        # The offerings may have been replaced rather than removed, so the
+        # days are refreshed from the table instead of dropping its rows
+        self.trips.pop(trip, None)
+        for day, service_day in self._days.items():
+            if trip in service_day.trip:
+                service_day.indexed = False
+                self._stale_days.add(day)
+
+    def _fetch_offerings(self, connection, day):
+        return connection.execute('''
+            SELECT TripNumber, StartMinute, ArrivalMinute, DriverName, BusID
+            FROM TripOfferingData
+            WHERE DayNumber = ?
+        ''', (day,)).fetchall()
+
+    def _load_trips(self, connection, numbers):
+        missing = [number for number in numbers if number not in self.trips]
+        for number in missing:
+            row = connection.execute(
+                "SELECT StartLocationName, DestinationName FROM Trip WHERE TripNumber = ?",
+                (number,)).fetchone()
+            if row is None:
+                continue
+            record = TripRecord(number, self.locations.id(row[0]), self.locations.id(row[1]))
+            offset = 0
+            for stop, driving_time in connection.execute('''
+                SELECT StopNumber, DrivingTime
+                FROM TripStopInfo
+                WHERE TripNumber = ?
+                ORDER BY SequenceNumber
+            ''', (number,)):
+                offset += driving_time or 0
+                record.stops.append(stop)
+                record.offsets.append(offset)
+            self.trips[number] = record
+
+    def _row(self, trip, start, arrival, driver, bus):
+        return (trip, start, -1 if arrival is None else arrival,
+                self.drivers.id(driver), -1 if bus is None else bus)
+
+    def _load(self, day):
+        with pooled_connection() as connection:
+            rows = self._fetch_offerings(connection, day)
+            self._load_trips(connection, {row[0] for row in rows})
+        service_day = ServiceDay(day)
+        for trip, start, arrival, driver, bus in sorted(
+                (self._row(*row) for row in rows), key=lambda row: (row[1], row[0])):
+            service_day.trip.append(trip)
+            service_day.start.append(start)
+            service_day.arrival.append(arrival)
+            service_day.driver.append(driver)
+            service_day.bus.append(bus)
+        self.loads += 1
+        return service_day
+
+    def _refresh(self, service_day):
+        # Apply only the difference between the loaded rows and the table
+        with pooled_connection() as connection:
+            rows = {(row[0], row[1]): row for row in self._fetch_offerings(connection, service_day.day)}
+            self._load_trips(connection, {trip for trip, _ in rows})
+        current = service_day.keys()
+        for trip, start in current:
+            row = rows.get((trip, start))
+            i = service_day.position(trip, start)
+            if row is None or self._row(*row) != (trip, start, service_day.arrival[i],
+                                                 service_day.driver[i], service_day.bus[i]):
+                service_day.delete(i)
+        for key, row in rows.items():
+            if service_day.position(*key) is None:
+                service_day.insert(*self._row(*row))
+        self.refreshes += 1
+
+    def _index(self, service_day):
+        by_route = {}
+        by_driver = {}
+        stop_rows = {}
+        for i in range(len(service_day)):
+            record = self.trips.get(service_day.trip[i])
+            if record is None:
+                continue
+            by_route.setdefault((record.origin, record.destination), array("i")).append(i)
+            by_driver.setdefault(service_day.driver[i], array("i")).append(i)
+            start = service_day.start[i]
+            for stop, offset in zip(record.stops, record.offsets):
+                stop_rows.setdefault(stop, []).append((start + offset, i))
+        by_stop = {}
+        for stop, entries in stop_rows.items():
+            entries.sort()
+            by_stop[stop] = (array("i", (minute for minute, _ in entries)),
+                             array("i", (i for _, i in entries)))
+        service_day.by_route = by_route
+        service_day.by_driver = by_driver
+        service_day.by_stop = by_stop
+        service_day.indexed = True
+
+    def service_day(self, date):
+        day = to_day_number(date)
+        with self._lock:
+            service_day = self._days.get(day)
+            if service_day is None:
+                service_day = self._days[day] = self._load(day)
+                while len(self._days) > self.max_days:
+                    self._days.popitem(last=False)
+            else:
+                self._days.move_to_end(day)
+                if day in self._stale_days:
+                    self._stale_days.discard(day)
+                    self._refresh(service_day)
+            if not service_day.indexed:
+                self._index(service_day)
+            return service_day
+
+    # === Lookups ===
+    def _time(self, minute):
+        return None if minute < 0 else from_minute(minute)
+
+    def schedule(self, start_location, destination, date):
+        # Same rows as app.display_schedule
+        with self._lock:
+            service_day = self.service_day(date)
+            origin = self.locations.get(start_location)
+            target = self.locations.get(destination)
+            rows = service_day.by_route.get((origin, target), ())
+            return [(service_day.trip[i], from_minute(service_day.start[i]),
+                     self._time(service_day.arrival[i]), self.drivers.values[service_day.driver[i]],
+                     None if service_day.bus[i] < 0 else service_day.bus[i])
+                    for i in rows]
+
+    def departures(self, stop_number, date, after="00:00", limit=10):
+        # (time at stop, trip, scheduled start, destination, driver, bus) for
+        # the next offerings to reach the stop at or after the given time
+        with self._lock:
+            service_day = self.service_day(date)
+            minutes, rows = service_day.by_stop.get(stop_number, ((), ()))
+            first = bisect_left(minutes, to_minute(after))
+            results = []
+            for minute, i in zip(minutes[first:first + limit], rows[first:first + limit]):
+                record = self.trips[service_day.trip[i]]
+                results.append((from_minute(minute), service_day.trip[i],
+                                from_minute(service_day.start[i]),
+                                self.locations.values[record.destination],
+                                self.drivers.values[service_day.driver[i]],
+                                None if service_day.bus[i] < 0 else service_day.bus[i]))
+            return results
+
+    def driver_day(self, driver_name, date):
+        # (trip, start location, destination, start, arrival, bus) in start order
+        with self._lock:
+            service_day = self.service_day(date)
+            driver = self.drivers.get(driver_name)
+            results = []
+            for i in service_day.by_driver.get(driver, ()):
+                record = self.trips[service_day.trip[i]]
+                results.append((service_day.trip[i], self.locations.values[record.origin],
+                                self.locations.values[record.destination],
+                                from_minute(service_day.start[i]), self._time(service_day.arrival[i]),
+                                None if service_day.bus[i] < 0 else service_day.bus[i]))
+            return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "days_loaded": len(self._days),
+                "offerings_loaded": sum(len(day) for day in self._days.values()),
+                "trips_loaded": len(self.trips),
+                "loads": self.loads,
+                "refreshes": self.refreshes,
+            }
+
+
+# === Process-wide engine ===
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = TimetableEngine()
+        return _engine
@@ -0,0 +1,408 @@
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+from db_pool import DEFAULT_DB_PATH, configure_pool
+from migrations import restore_indexes
+from query_cache import schedule_cache
+from timecodes import EPOCH, to_day_number, to_minute
+
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_COMMIT_EVERY = 200000
+PROGRESS_EVERY = 50000
+
+# Target tables in foreign key order, with the insert for each
+TABLES = [
+    ("Bus", "INSERT INTO Bus VALUES (?, ?, ?)"),
+    ("Driver", "INSERT INTO Driver VALUES (?, ?)"),
+    ("Stop", "INSERT INTO Stop VALUES (?, ?)"),
+    ("Trip", "INSERT INTO Trip VALUES (?, ?, ?)"),
+    ("TripStopInfo", "INSERT INTO TripStopInfo VALUES (?, ?, ?, ?)"),
+    ("TripOfferingData", "INSERT INTO TripOfferingData VALUES (?, ?, ?, ?, ?, ?)"),
+]
+INSERTS = dict(TABLES)
+
+
+class BadRow(ValueError):
+    pass
+
+
+def _optional_int(value):
+    value = (value or "").strip()
+    return int(value) if value else None
+
+
+def _optional_text(value):
+    value = (value or "").strip()
+    return value or None
+
+
+# === CSV ===
+# One file per table, with a header row naming the columns:
+#   buses.csv          BusID, Model, Year
+#   drivers.csv        DriverName, DriverTelephoneNumber
+#   stops.csv          StopNumber, StopAddress
+#   trips.csv          TripNumber, StartLocationName, DestinationName
+#   trip_stops.csv     TripNumber, StopNumber, SequenceNumber, DrivingTime
+#   trip_offerings.csv TripNumber, Date, ScheduledStartTime,
+#                      ScheduledArrivalTime, DriverName, BusID
+CSV_FILES = [
+    ("Bus", "buses.csv", lambda r: (
+        int(r["BusID"]), _optional_text(r["Model"]), _optional_int(r["Year"]))),
+    ("Driver", "drivers.csv", lambda r: (
+        r["DriverName"].strip(), _optional_text(r["DriverTelephoneNumber"]))),
+    ("Stop", "stops.csv", lambda r: (
+        int(r["StopNumber"]), _optional_text(r["StopAddress"]))),
+    ("Trip", "trips.csv", lambda r: (
+        int(r["TripNumber"]), _optional_text(r["StartLocationName"]),
+        _optional_text(r["DestinationName"]))),
+    ("TripStopInfo", "trip_stops.csv", lambda r: (
+        int(r["TripNumber"]), int(r["StopNumber"]), int(r["SequenceNumber"]),
+        _optional_int(r["DrivingTime"]))),
+    ("TripOfferingData", "trip_offerings.csv", lambda r: (
+        int(r["TripNumber"]), to_day_number(r["Date"]), to_minute(r["ScheduledStartTime"]),
+        to_minute(_optional_text(r["ScheduledArrivalTime"])),
+        _optional_text(r["DriverName"]), _optional_int(r["BusID"]))),
+]
+
+
+def read_csv_rows(path, convert):
+    # Yields (line number, row tuple) or (line number, BadRow)
+    with open(path, newline="", encoding="utf-8-sig") as handle:
+        reader = csv.DictReader(handle)
+        for record in reader:
+            try:
+                yield reader.line_num, convert(record)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                yield reader.line_num, BadRow(f"{type(e).__name__}: {e}")
+
+
+def csv_sources(directory):
+    for table, filename, convert in CSV_FILES:
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            yield table, path, read_csv_rows(path, convert)
+
+
+# === GTFS ===
+# stops.txt, stop_times.txt and (optionally) trips.txt, calendar.txt and
+# calendar_dates.txt. Numeric stop_id / trip_id values become StopNumber /
+# TripNumber; stop_times.txt must list each trip's stops contiguously.
+def _gtfs_path(directory, name):
+    return os.path.join(directory, name)
+
+
+def _read_gtfs(directory, name):
+    with open(_gtfs_path(directory, name), newline="", encoding="utf-8-sig") as handle:
+        reader = csv.DictReader(handle)
+        for record in reader:
+            yield reader.line_num, record
+
+
+def gtfs_stops(directory, stop_names):
+    for line, record in _read_gtfs(directory, "stops.txt"):
+        try:
+            stop_number = int(record["stop_id"])
+            name = _optional_text(record.get("stop_name"))
+            address = _optional_text(record.get("stop_desc")) or name
+        except (KeyError, ValueError) as e:
+            yield line, BadRow(f"{type(e).__name__}: {e}")
+            continue
+        stop_names[stop_number] = name
+        yield line, (stop_number, address)
+
+
+def _gtfs_trip_groups(directory):
+    # Groups stop_times.txt rows by trip without holding the whole file
+    current, rows, first_line = None, [], None
+    finished = set()
+    for line, record in _read_gtfs(directory, "stop_times.txt"):
+        trip_id = record.get("trip_id")
+        if trip_id != current:
+            if current is not None:
+                yield first_line, current, rows
+                finished.add(current)
+            if trip_id in finished:
+                yield line, trip_id, BadRow(f"stop_times for trip {trip_id} are not contiguous")
+                current, rows = None, []
+                continue
+            current, rows, first_line = trip_id, [], line
+        rows.append((line, record))
+    if current is not None:
+        yield first_line, current, rows
+
+
+def gtfs_trips(directory, stop_names, trip_spans):
+    # Yields ("Trip", line, row) and ("TripStopInfo", line, row) items
+    for first_line, trip_id, rows in _gtfs_trip_groups(directory):
+        if isinstance(rows, BadRow):
+            yield "Trip", first_line, rows
+            continue
+        try:
+            trip_number = int(trip_id)
+            stops = []
+            for line, record in rows:
+                arrival = to_minute(_optional_text(record.get("arrival_time")))
+                departure = to_minute(_optional_text(record.get("departure_time")))
+                stops.append((int(record["stop_sequence"]), int(record["stop_id"]),
+                              arrival, departure if departure is not None else arrival))
+            stops.sort()
+        except (KeyError, TypeError, ValueError) as e:
+            yield "Trip", first_line, BadRow(f"trip {trip_id}: {type(e).__name__}: {e}")
+            continue
+
+        first, last = stops[0], stops[-1]
+        yield "Trip", first_line, (
+            trip_number, stop_names.get(first[1]), stop_names.get(last[1]))
+        previous_departure = None
+        for sequence, stop_number, arrival, departure in stops:
+            if previous_departure is None or arrival is None:
+                driving_time = 0
+            else:
+                driving_time = arrival - previous_departure
+            previous_departure = departure
+            yield "TripStopInfo", first_line, (trip_number, stop_number, sequence, driving_time)
+        trip_spans[trip_id] = (trip_number, first[3], last[2])
+
+
+def _service_days(directory):
+    # (service_id -> sorted day numbers, {file name: [(line, BadRow)]}) from
+    # calendar.txt and calendar_dates.txt. A bad row is skipped and reported;
+    # the rest still count.
+    weekdays = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+    services = {}
+    rejected = {}
+    if os.path.exists(_gtfs_path(directory, "calendar.txt")):
+        for line, record in _read_gtfs(directory, "calendar.txt"):
+            try:
+                start = date(*_gtfs_date(record["start_date"]))
+                end = date(*_gtfs_date(record["end_date"]))
+                running = [record[day].strip() == "1" for day in weekdays]
+                service = record["service_id"]
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                rejected.setdefault("calendar.txt", []).append((line, BadRow(f"{type(e).__name__}: {e}")))
+                continue
+            days = services.setdefault(service, set())
+            current = start
+            while current <= end:
+                if running[current.weekday()]:
+                    days.add((current - EPOCH).days)
+                current += timedelta(days=1)
+    if os.path.exists(_gtfs_path(directory, "calendar_dates.txt")):
+        for line, record in _read_gtfs(directory, "calendar_dates.txt"):
+            try:
+                day = (date(*_gtfs_date(record["date"])) - EPOCH).days
+                service = record["service_id"]
+                adding = record["exception_type"].strip() == "1"
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                rejected.setdefault("calendar_dates.txt", []).append(
+                    (line, BadRow(f"{type(e).__name__}: {e}")))
+                continue
+            days = services.setdefault(service, set())
+            if adding:
+                days.add(day)
+            else:
+                days.discard(day)
+    return {service: sorted(days) for service, days in services.items()}, rejected
+
+
+def _gtfs_date(value):
+    value = value.strip()
+    return int(value[:4]), int(value[4:6]), int(value[6:8])
+
+
+def gtfs_offerings(directory, trip_spans, services):
+    # One offering per trip per service day; driver and bus are left empty
+    for line, record in _read_gtfs(directory, "trips.txt"):
+        span = trip_spans.get(record.get("trip_id"))
+        if span is None:
+            yield line, BadRow(f"trip {record.get('trip_id')} has no stop_times")
+            continue
+        trip_number, start_minute, arrival_minute = span
+        if start_minute is None:
+            yield line, BadRow(f"trip {trip_number} has no departure time")
+            continue
+        for day in services.get(record.get("service_id"), ()):
+            yield line, (trip_number, day, start_minute, arrival_minute, None, None)
+
+
+def gtfs_sources(directory):
+    stop_names = {}
+    trip_spans = {}
+    yield "Stop", _gtfs_path(directory, "stops.txt"), gtfs_stops(directory, stop_names)
+
+    # Trip and TripStopInfo rows come out of the same pass over stop_times.txt
+    trips, trip_stops = [], []
+    path = _gtfs_path(directory, "stop_times.txt")
+    for table, line, row in gtfs_trips(directory, stop_names, trip_spans):
+        (trips if table == "Trip" else trip_stops).append((line, row))
+        if len(trip_stops) >= DEFAULT_BATCH_SIZE:
+            yield "Trip", path, iter(trips)
+            yield "TripStopInfo", path, iter(trip_stops)
+            trips, trip_stops = [], []
+    yield "Trip", path, iter(trips)
+    yield "TripStopInfo", path, iter(trip_stops)
+
+    if not os.path.exists(_gtfs_path(directory, "trips.txt")):
+        return
+    services, rejected = _service_days(directory)
+    # Bad calendar rows are reported against their own file and line
+    for name, rows in rejected.items():
+        yield "TripOfferingData", _gtfs_path(directory, name), iter(rows)
+    yield "TripOfferingData", _gtfs_path(directory, "trips.txt"), gtfs_offerings(directory, trip_spans, services)
+
+
+# === Loader ===
+class TimetableLoader:
+    def __init__(self, connection, batch_size=DEFAULT_BATCH_SIZE,
+                 commit_every=DEFAULT_COMMIT_EVERY, out=sys.stdout, errors=sys.stderr):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.out = out
+        self.errors = errors
+        self.loaded = {}
+        self.rejected = {}
+        self._uncommitted = 0
+        self._started = None
+        self._total = 0
+        self._next_progress = PROGRESS_EVERY
+
+    def _report_bad_row(self, table, path, line, error):
+        self.rejected[table] = self.rejected.get(table, 0) + 1
+        print(f"{path}:{line}: rejected {table} row: {error}", file=self.errors)
+
+    def _insert_batch(self, table, path, batch):
+        sql = INSERTS[table]
+        # Batches nest inside the long-running load transaction; releasing
+        # an outermost savepoint would commit every batch on its own
+        if not self.connection.in_transaction:
+            self.connection.execute("BEGIN")
+        self.connection.execute("SAVEPOINT import_batch")
+        try:
+            self.connection.executemany(sql, [row for _, row in batch])
+            inserted = len(batch)
+        except sqlite3.Error:
+            # Isolate the offending rows; good rows in the batch still load
+            self.connection.execute("ROLLBACK TO import_batch")
+            inserted = 0
+            for line, row in batch:
+                try:
+                    self.connection.execute(sql, row)
+                    inserted += 1
+                except sqlite3.Error as e:
+                    self._report_bad_row(table, path, line, e)
+        self.connection.execute("RELEASE import_batch")
+
+        self.loaded[table] = self.loaded.get(table, 0) + inserted
+        self._total += inserted
+        self._uncommitted += inserted
+        if self._uncommitted >= self.commit_every:
+            self.connection.commit()
+            self._uncommitted = 0
+        if self._total >= self._next_progress:
+            self._progress()
+            self._next_progress += PROGRESS_EVERY
+
+    def _progress(self):
+        elapsed = time.perf_counter() - self._started
+        rate = self._total / elapsed if elapsed else 0.0
+        print(f"  {self._total:,} rows loaded ({rate:,.0f} rows/s)", file=self.out)
+
+    def load(self, sources):
+        self._started = time.perf_counter()
+        # A previous load killed mid-way may have left indexes dropped
+        restore_indexes(self.connection)
+        dropped = self._drop_indexes()
+        try:
+            for table, path, rows in sources:
+                batch = []
+                for line, row in rows:
+                    if isinstance(row, BadRow):
+                        self._report_bad_row(table, path, line, row)
+                        continue
+                    batch.append((line, row))
+                    if len(batch) >= self.batch_size:
+                        self._insert_batch(table, path, batch)
+                        batch = []
+                if batch:
+                    self._insert_batch(table, path, batch)
+            self.connection.commit()
+        finally:
+            if self.connection.in_transaction:
+                self.connection.commit()
+            self._rebuild_indexes(dropped)
+            schedule_cache.clear()
+
+        self._progress()
+        return self.loaded, self.rejected
+
+    def _drop_indexes(self):
+        # Secondary indexes are rebuilt once at the end, which is far cheaper
+        # than maintaining them row by row during the load. They are listed
+        # in SetAsideIndex as they are dropped, so if the process dies before
+        # the rebuild, the next start (setup_database) restores them.
+        tables = [table for table, _ in TABLES]
+        placeholders = ", ".join("?" * len(tables))
+        dropped = self.connection.execute(f'''
+            SELECT name, sql FROM sqlite_master
+            WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+        ''', tables).fetchall()
+        self.connection.execute("BEGIN")
+        self.connection.executemany("INSERT INTO SetAsideIndex VALUES (?, ?)", dropped)
+        for name, _ in dropped:
+            self.connection.execute(f'DROP INDEX "{name}"')
+        self.connection.commit()
+        return dropped
+
+    def _rebuild_indexes(self, dropped):
+        started = time.perf_counter()
+        self.connection.execute("BEGIN")
+        for _, sql in dropped:
+            self.connection.execute(sql)
+        self.connection.execute("DELETE FROM SetAsideIndex")
+        self.connection.commit()
+        if dropped:
+            print(f"  rebuilt {len(dropped)} indexes in {time.perf_counter() - started:.1f}s",
+                  file=self.out)
+
+
+def import_timetable(source_format, directory, batch_size=DEFAULT_BATCH_SIZE,
+                     commit_every=DEFAULT_COMMIT_EVERY):
+    from app import setup_database
+    from db_pool import get_pool
+
+    setup_database()
+    sources = csv_sources(directory) if source_format == "csv" else gtfs_sources(directory)
+    with get_pool().connection() as connection:
+        loader = TimetableLoader(connection, batch_size, commit_every)
+        return loader.load(sources)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-load a timetable into the transit database")
+    parser.add_argument("format", choices=["csv", "gtfs"])
+    parser.add_argument("directory", help="Directory holding the CSV or GTFS files")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Database file to load into")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--commit-every", type=int, default=DEFAULT_COMMIT_EVERY)
+    args = parser.parse_args(argv)
+
+    configure_pool(args.db, size=1)
+    loaded, rejected = import_timetable(args.format, args.directory,
+                                        args.batch_size, args.commit_every)
+
+    print("\nTable | Loaded | Rejected")
+    print("-" * 40)
+    for table, _ in TABLES:
+        if table in loaded or table in rejected:
+            print(f"{table} | {loaded.get(table, 0)} | {rejected.get(table, 0)}")
+    return 1 if rejected else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
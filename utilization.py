@@ -0,0 +1,242 @@
+import argparse
+import csv
+import json
+import sys
+import time
+from array import array
+from collections import namedtuple
+
+from service_calendar import offerings_source
+from snapshot import read_connection
+from timecodes import from_day_number, to_day_number
+
+# Fleet utilization. One query walks the Bus table in BusID order and, for
+# each bus, the range's slice of the covering (BusID, DayNumber,
+# StartMinute, ArrivalMinute) index, so offerings arrive ordered by bus,
+# day and start time and are folded into running totals as they go past.
+# Totals live in compact arrays indexed by the bus's position, plus one
+# fleet-wide and one per Model/Year array of minutes for each day of the
+# range, so memory depends on buses and days, not offerings, and a year or
+# more is a single pass.
+#
+# Minutes in service are the union of a bus's offerings on a day, so
+# overlapping (double-booked) offerings are not counted twice. Idle minutes
+# are the gaps between them, from the day's first start to its last
+# arrival. An offering counts towards the day it starts on, including the
+# minutes of a trip that runs past midnight.
+
+BusUsage = namedtuple("BusUsage", [
+    "bus_id", "model", "year", "offerings", "days_in_service", "service_minutes",
+    "idle_minutes", "longest_idle_minutes", "peak_day_minutes", "hours_per_day",
+])
+ModelUsage = namedtuple("ModelUsage", [
+    "model", "year", "buses", "offerings", "service_minutes", "idle_minutes", "hours_per_bus_day",
+])
+DayUsage = namedtuple("DayUsage", ["date", "buses_in_service", "offerings", "service_minutes"])
+
+DEFAULT_CHUNK_SIZE = 50000
+
+
+def _zeros(length):
+    return array("q", bytes(array("q").itemsize * length))
+
+
+def fleet_utilization(first_date, last_date, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Returns {"first_date", "last_date", "days", "buses": [BusUsage],
+    # "models": [ModelUsage], "daily": [DayUsage]}. hours_per_day averages
+    # over every day of the range, in service or not.
+    first_day, last_day = to_day_number(first_date), to_day_number(last_date)
+    if last_day < first_day:
+        raise ValueError("The last date is before the first date")
+    days = last_day - first_day + 1
+
+    with read_connection() as connection:
+        buses = connection.execute("SELECT BusID, Model, Year FROM Bus ORDER BY BusID").fetchall()
+        position = {bus_id: i for i, (bus_id, _, _) in enumerate(buses)}
+        models = sorted({(model, year) for _, model, year in buses},
+                        key=lambda key: (key[0] or "", key[1] or 0))
+        model_index = {key: i for i, key in enumerate(models)}
+        bus_model = [model_index[model, year] for _, model, year in buses]
+
+        # Per bus
+        offerings = _zeros(len(buses))
+        days_in_service = _zeros(len(buses))
+        service = _zeros(len(buses))
+        idle = _zeros(len(buses))
+        longest_idle = _zeros(len(buses))
+        peak = _zeros(len(buses))
+        # Per day of the range
+        day_minutes = _zeros(days)
+        day_buses = _zeros(days)
+        day_offerings = _zeros(days)
+        model_minutes = [_zeros(days) for _ in models]
+
+        source = offerings_source(connection, first_day, last_day)
+        # CROSS JOIN keeps Bus as the outer loop, so rows come out in BusID
+        # order without a sort over the whole range
+        cursor = connection.execute(f'''
+            SELECT b.BusID, tr.DayNumber, tr.StartMinute, tr.ArrivalMinute
+            FROM Bus b
+            CROSS JOIN {source} tr ON tr.BusID = b.BusID AND tr.DayNumber BETWEEN ? AND ?
+            ORDER BY b.BusID, tr.DayNumber, tr.StartMinute
+        ''', (first_day, last_day))
+        cursor.arraysize = chunk_size
+
+        # The bus-day being accumulated: position, day offset, end of the
+        # latest offering so far and minutes in service
+        bus = day = None
+        end = minutes = 0
+
+        def close_day():
+            service[bus] += minutes
+            day_minutes[day] += minutes
+            day_buses[day] += 1
+            model_minutes[bus_model[bus]][day] += minutes
+            if minutes > peak[bus]:
+                peak[bus] = minutes
+
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            for bus_id, row_day, start, arrival in rows:
+                i = position[bus_id]
+                d = row_day - first_day
+                if arrival is None:
+                    finish = start
+                else:
+                    # An arrival before the start is on the next day
+                    finish = arrival + 1440 if arrival < start else arrival
+                if i != bus or d != day:
+                    if bus is not None:
+                        close_day()
+                    bus, day, end, minutes = i, d, start, 0
+                    days_in_service[i] += 1
+                elif start > end:
+                    gap = start - end
+                    idle[i] += gap
+                    if gap > longest_idle[i]:
+                        longest_idle[i] = gap
+                if finish > end:
+                    minutes += finish - max(start, end)
+                    end = finish
+                offerings[i] += 1
+                day_offerings[d] += 1
+        if bus is not None:
+            close_day()
+
+    model_totals = {}
+    bus_usage = []
+    for i, (bus_id, model, year) in enumerate(buses):
+        bus_usage.append(BusUsage(bus_id, model, year, offerings[i], days_in_service[i], service[i],
+                                  idle[i], longest_idle[i], peak[i], service[i] / 60 / days))
+        totals = model_totals.setdefault(bus_model[i], [0, 0, 0])
+        totals[0] += 1
+        totals[1] += offerings[i]
+        totals[2] += idle[i]
+
+    model_usage = []
+    for m, (model, year) in enumerate(models):
+        count, model_offerings, model_idle = model_totals[m]
+        minutes = sum(model_minutes[m])
+        model_usage.append(ModelUsage(model, year, count, model_offerings, minutes, model_idle,
+                                      minutes / 60 / (count * days)))
+
+    return {
+        "first_date": from_day_number(first_day),
+        "last_date": from_day_number(last_day),
+        "days": days,
+        "buses": bus_usage,
+        "models": model_usage,
+        "daily": [DayUsage(from_day_number(first_day + d), day_buses[d], day_offerings[d], day_minutes[d])
+                  for d in range(days)],
+    }
+
+
+def _hours(minutes):
+    return f"{minutes / 60:.1f}"
+
+
+def print_report(report, limit=10):
+    buses = report["buses"]
+    fleet_minutes = sum(bus.service_minutes for bus in buses)
+    print(f"{report['first_date']} to {report['last_date']} ({report['days']} days): "
+          f"{len(buses)} buses, {sum(bus.offerings for bus in buses)} offerings, "
+          f"{_hours(fleet_minutes)} bus-hours")
+
+    print("\n=== By model ===")
+    print("Model | Year | Buses | Offerings | Bus-hours | Idle hours | Hours per bus-day")
+    print("-" * 80)
+    for model in report["models"]:
+        print(f"{model.model} | {model.year} | {model.buses} | {model.offerings} | "
+              f"{_hours(model.service_minutes)} | {_hours(model.idle_minutes)} | {model.hours_per_bus_day:.2f}")
+
+    ranked = sorted(buses, key=lambda bus: (bus.service_minutes, -bus.bus_id))
+    for title, shown in ((f"Least used {min(limit, len(ranked))} buses", ranked[:limit]),
+                         (f"Most used {min(limit, len(ranked))} buses", ranked[::-1][:limit])):
+        print(f"\n=== {title} ===")
+        print("Bus ID | Model | Year | Offerings | Days | Bus-hours | Idle hours | Longest idle | Peak day | Hours/day")
+        print("-" * 100)
+        for bus in shown:
+            print(f"{bus.bus_id} | {bus.model} | {bus.year} | {bus.offerings} | {bus.days_in_service} | "
+                  f"{_hours(bus.service_minutes)} | {_hours(bus.idle_minutes)} | "
+                  f"{_hours(bus.longest_idle_minutes)} | {_hours(bus.peak_day_minutes)} | {bus.hours_per_day:.2f}")
+
+    daily = report["daily"]
+    busiest = max(daily, key=lambda day: day.service_minutes)
+    quietest = min(daily, key=lambda day: day.service_minutes)
+    print(f"\nBusiest day {busiest.date}: {busiest.buses_in_service} buses, {_hours(busiest.service_minutes)} bus-hours")
+    print(f"Quietest day {quietest.date}: {quietest.buses_in_service} buses, "
+          f"{_hours(quietest.service_minutes)} bus-hours")
+
+
+def write_csv(path, rows, fields):
+    with open(path, "w", newline="") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(fields)
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fleet utilization and bus-hours in service")
+    parser.add_argument("--from", dest="first_date", required=True, help="First date (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="last_date", required=True, help="Last date (YYYY-MM-DD)")
+    parser.add_argument("--limit", type=int, default=10, help="Buses shown at each end of the ranking")
+    parser.add_argument("--json", help="Also write the full report to this file")
+    parser.add_argument("--csv", help="Also write the buses, models and daily tables to PREFIX_*.csv",
+                        metavar="PREFIX")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--db", help="Database file (defaults to POMONA_TRANSIT_DB)")
+    args = parser.parse_args(argv)
+
+    from app import setup_database
+    from db_pool import configure_pool
+
+    if args.db:
+        configure_pool(args.db, size=1)
+    setup_database()
+
+    started = time.perf_counter()
+    try:
+        report = fleet_utilization(args.first_date, args.last_date, args.chunk_size)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    elapsed = time.perf_counter() - started
+    print_report(report, args.limit)
+    print(f"\n{sum(bus.offerings for bus in report['buses'])} offerings in {elapsed:.2f}s")
+
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump({**report,
+                       "buses": [bus._asdict() for bus in report["buses"]],
+                       "models": [model._asdict() for model in report["models"]],
+                       "daily": [day._asdict() for day in report["daily"]]}, handle, indent=2)
+    if args.csv:
+        for table, kind in (("buses", BusUsage), ("models", ModelUsage), ("daily", DayUsage)):
+            write_csv(f"{args.csv}_{table}.csv", report[table], kind._fields)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import ExitStack
+
+from db_pool import get_pool
+
+# Single writer with group commit. Every mutation is queued as an operation,
+# a callable run as operation(connection, *args), and one thread applies them.
+# Whatever has queued up while the previous batch was committing (up to
+# max_batch operations, optionally waiting max_delay seconds for more) runs
+# in a single BEGIN IMMEDIATE transaction with one commit. Each operation
+# runs inside its own savepoint, so one that raises (an IntegrityError, a
+# booking conflict) is rolled back alone and the rest of the batch commits.
+#
+# submit() returns a concurrent.futures.Future that resolves to the
+# operation's return value once its batch has committed, or to the exception
+# it raised. on_commit runs after the commit, before the future resolves;
+# on_rollback runs if the operation succeeded but the commit itself failed.
+# A callback that raises is counted in stats() and does not stop the writer
+# or change the operation's result.
+
+DEFAULT_MAX_BATCH = int(os.environ.get("POMONA_TRANSIT_WRITE_BATCH", "256"))
+DEFAULT_MAX_DELAY = float(os.environ.get("POMONA_TRANSIT_WRITE_DELAY", "0"))
+
+_Request = namedtuple("_Request", "operation args future on_commit on_rollback queued contexts")
+
+# Called on the submitting thread; each returns a context manager that the
+# writer thread enters around the operation. Instrumentation uses this to
+# credit an operation's statements to the function that queued it.
+_context_hooks = []
+
+_STOP = object()
+
+
+class WriteQueue:
+    def __init__(self, pool=None, max_batch=DEFAULT_MAX_BATCH, max_delay=DEFAULT_MAX_DELAY):
+        if max_batch < 1:
+            raise ValueError("Batch size must be at least 1")
+        self.pool = pool or get_pool()
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+        self._submitted = 0
+        self._succeeded = 0
+        self._failed = 0
+        self._batches = 0
+        self._failed_commits = 0
+        self._largest_batch = 0
+        self._max_depth = 0
+        self._commit_seconds = 0.0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._callback_errors = 0
+        self._last_callback_error = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        # Operations already queued are still applied
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._requests.put(_STOP)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, operation, *args, on_commit=None, on_rollback=None):
+        # Imported here, as it pulls in logging and threading machinery that
+        # a read-only run never needs
+        from concurrent.futures import Future
+
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Write queue is closed")
+            if threading.current_thread() is self._thread:
+                # Waiting on the future from inside a batch would deadlock
+                raise RuntimeError("Operations cannot submit further writes")
+            self._submitted += 1
+            self._requests.put(_Request(operation, args, future, on_commit, on_rollback,
+                                        time.perf_counter(), [hook() for hook in _context_hooks]))
+            self._max_depth = max(self._max_depth, self._requests.qsize())
+        return future
+
+    def execute(self, operation, *args, on_commit=None, on_rollback=None):
+        # Blocks until the operation's batch has committed
+        return self.submit(operation, *args, on_commit=on_commit, on_rollback=on_rollback).result()
+
+    # === Writer thread ===
+    def _next_batch(self):
+        request = self._requests.get()
+        if request is _STOP:
+            return None
+        batch = [request]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                if self.max_delay > 0:
+                    request = self._requests.get(timeout=max(0.0, deadline - time.monotonic()))
+                else:
+                    request = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is _STOP:
+                # Finish this batch, then stop
+                self._requests.put(_STOP)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            outcomes = []
+            try:
+                self._apply(batch, outcomes)
+            except Exception as e:
+                # The transaction could not be opened or committed: nothing
+                # in the batch was written
+                with self._lock:
+                    self._failed_commits += 1
+                for request, (ok, _) in zip(batch, outcomes):
+                    if ok:
+                        self._callback(request.on_rollback)
+                self._resolve(batch, [(False, e)] * len(batch), started)
+                continue
+            for request, (ok, _) in zip(batch, outcomes):
+                if ok:
+                    self._callback(request.on_commit)
+            self._resolve(batch, outcomes, started)
+
+    def _callback(self, callback):
+        # The writer thread must outlive a failing callback, or every later
+        # execute() would wait forever
+        if callback is None:
+            return
+        try:
+            callback()
+        except Exception as e:
+            with self._lock:
+                self._callback_errors += 1
+                self._last_callback_error = repr(e)
+
+    def _apply(self, batch, outcomes):
+        # Appends (True, result) or (False, exception) per operation
+        with self.pool.connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            for request in batch:
+                connection.execute("SAVEPOINT operation")
+                try:
+                    with ExitStack() as stack:
+                        for context in request.contexts:
+                            stack.enter_context(context)
+                        result = request.operation(connection, *request.args)
+                except Exception as e:
+                    connection.execute("ROLLBACK TO operation")
+                    connection.execute("RELEASE operation")
+                    outcomes.append((False, e))
+                else:
+                    connection.execute("RELEASE operation")
+                    outcomes.append((True, result))
+            connection.commit()
+
+    def _resolve(self, batch, outcomes, started):
+        finished = time.perf_counter()
+        succeeded = sum(1 for ok, _ in outcomes if ok)
+        with self._lock:
+            self._batches += 1
+            self._largest_batch = max(self._largest_batch, len(batch))
+            self._succeeded += succeeded
+            self._failed += len(batch) - succeeded
+            self._commit_seconds += finished - started
+            for request in batch:
+                waited = finished - request.queued
+                self._total_wait += waited
+                self._max_wait = max(self._max_wait, waited)
+        for request, (ok, value) in zip(batch, outcomes):
+            if ok:
+                request.future.set_result(value)
+            else:
+                request.future.set_exception(value)
+
+    def stats(self):
+        with self._lock:
+            completed = self._succeeded + self._failed
+            return {
+                "queue_depth": self._requests.qsize(),
+                "max_queue_depth": self._max_depth,
+                "submitted": self._submitted,
+                "succeeded": self._succeeded,
+                "failed": self._failed,
+                "batches": self._batches,
+                "failed_commits": self._failed_commits,
+                "largest_batch": self._largest_batch,
+                "avg_batch": completed / self._batches if self._batches else 0.0,
+                "commit_seconds": self._commit_seconds,
+                "avg_latency_seconds": self._total_wait / completed if completed else 0.0,
+                "max_latency_seconds": self._max_wait,
+                "callback_errors": self._callback_errors,
+                "last_callback_error": self._last_callback_error,
+            }
+
+
+def add_context_hook(hook):
+    _context_hooks.append(hook)
+
+
+def remove_context_hook(hook):
+    if hook in _context_hooks:
+        _context_hooks.remove(hook)
+
+
+# === Process-wide writer ===
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def configure_writer(pool=None, **options):
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+        _writer = WriteQueue(pool, **options).start()
+        return _writer
+
+
+def get_writer():
+    # Started on first use. A writer built before configure_pool() is
+    # replaced, so it never writes to the previous database.
+    global _writer
+    with _writer_lock:
+        pool = get_pool()
+        if _writer is None or _writer.pool is not pool:
+            if _writer is not None:
+                _writer.close()
+            _writer = WriteQueue(pool).start()
+        return _writer
+
+
+def writer_stats():
+    return get_writer().stats()